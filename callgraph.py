@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Splits tintin_fw binary into functions and builds call graph,
+# or tells which functions are affected by hooking given one.
+
+import json
+import os
+import sys
+
+from libpatcher.callgraph import analyze
+
+
+def parse_args():
+    import argparse
+    hexint = lambda x: int(x, base=0)
+    parser = argparse.ArgumentParser(
+        description="Call graph of Pebble firmware")
+    parser.add_argument("-t", "--tintin", default="tintin_fw.bin",
+                        help="Input tintin_fw file, defaults to tintin_fw.bin")
+    parser.add_argument("-c", "--codebase", type=hexint, default=0x8004000,
+                        help="Codebase of the binary. "
+                        "Defaults to 0x8004000 (which is for 3.x fw); "
+                        "for 1.x-2.x set it to 0x8010000")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't store analysis results next to binary")
+    parser.add_argument("-j", "--json", metavar="FILE",
+                        help="Write whole graph as JSON ('-' for stdout)")
+    parser.add_argument("-g", "--dot", metavar="FILE",
+                        help="Write whole graph in Graphviz format "
+                        "('-' for stdout)")
+    parser.add_argument("-a", "--affected", type=hexint, metavar="FUNC",
+                        help="List functions calling FUNC, directly or not")
+    parser.add_argument("-d", "--depth", type=int,
+                        help="Limit --affected to this many levels")
+    parser.add_argument("-f", "--function", type=hexint, metavar="ADDR",
+                        help="Show function containing ADDR "
+                        "with its callers and callees")
+    return parser.parse_args()
+
+def write(name, func):
+    " Calls func with file opened for writing, '-' meaning stdout "
+    if name == '-':
+        func(sys.stdout)
+    else:
+        with open(name, 'w') as f:
+            func(f)
+
+if __name__ == "__main__":
+    args = parse_args()
+    data = open(args.tintin, "rb").read()
+    cachedir = None if args.no_cache else (
+        os.path.dirname(os.path.abspath(args.tintin)))
+    graph = analyze(data, args.codebase, cachedir)
+    if args.json:
+        write(args.json, lambda f: json.dump(graph.toJSON(), f, indent=1))
+    if args.dot:
+        write(args.dot, graph.writeDot)
+    if args.function is not None:
+        func = graph.function(args.function)
+        if func is None:
+            print("No function at 0x%X" % args.function)
+        else:
+            start, end = func
+            print("Function %08X-%08X" % (start, end))
+            for c in graph.callers(start):
+                print("  called from %08X" % c)
+            for c in graph.callees(start):
+                print("  calls %08X" % c)
+    if args.affected is not None:
+        sites = graph.callSites(args.affected)
+        print("%d call sites of %08X:" % (len(sites), args.affected & ~1))
+        for s in sites:
+            print("  %08X" % s)
+        affected = graph.affected(args.affected, args.depth)
+        print("%d affected functions:" % len(affected))
+        for f, dist in sorted(affected.items(), key=lambda x: (x[1], x[0])):
+            print("  %08X (depth %d)" % (f, dist))
+    if not (args.json or args.dot or args.function is not None or
+            args.affected is not None):
+        print(graph)
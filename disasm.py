@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+#
+# Disassembles tintin_fw binary (or part of it)
+# using instruction definitions from libpatcher
+
+import os
+
+from libpatcher import disasm
+
+
+def parse_args():
+    import argparse
+    hexint = lambda x: int(x, base=0)
+    parser = argparse.ArgumentParser(
+        description="Thumb-2 disassembler for Pebble firmware")
+    parser.add_argument("-t", "--tintin", default="tintin_fw.bin",
+                        help="Input tintin_fw file, defaults to tintin_fw.bin")
+    parser.add_argument("-c", "--codebase", type=hexint, default=0x8004000,
+                        help="Codebase of the binary. "
+                        "Defaults to 0x8004000 (which is for 3.x fw); "
+                        "for 1.x-2.x set it to 0x8010000")
+    parser.add_argument("-r", "--refs", type=hexint, metavar="ADDR",
+                        help="List instructions referring to given address "
+                        "instead of disassembling a range")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't store decoded binary next to it")
+    parser.add_argument("start", nargs='?', type=hexint,
+                        help="Start address, defaults to codebase")
+    parser.add_argument("end", nargs='?', type=hexint,
+                        help="End address, defaults to start+0x40")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    data = open(args.tintin, "rb").read()
+    cachedir = None if args.no_cache else (
+        os.path.dirname(os.path.abspath(args.tintin)))
+    d = disasm.disassemble(data, args.codebase, cachedir)
+    if args.refs is not None:
+        instrs = d.refsTo(args.refs)
+    else:
+        start = args.codebase if args.start is None else args.start
+        end = start + 0x40 if args.end is None else args.end
+        instrs = d.between(start, end)
+    for i in instrs:
+        print("%08X: %s" % (i.addr, i))
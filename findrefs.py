@@ -1,69 +1,100 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 #
-# Finds all references to given address
+# Finds all references to given addresses
 # Either plain or procedure calls
 
+import json
 import sys
-from struct import pack
 
-def genCode(pos, to, is_bl):
+from libpatcher.refs import RefIndex
+
+
+def parse_query(text):
     """
-    Returns assembler code for B.W or BL instruction
-    placed at [pos], which refers to [to].
+    Parses address (0xVALUE) or range (0xSTART-0xEND, end exclusive).
+    Returns (start, end) tuple.
     """
-    offset = to - (pos+4)
-    offset = offset >> 1
-    if abs(offset) >= 1<<22:
-        #print ("Offset %X exceeds maximum of %X!" %
-        #                    (offset, 1<<22))
-        return '' # we don't need exception here,
-                  # just return empty string which will not match anything
-        raise ValueError("Offset %X exceeds maximum of %X!" %
-                            (offset, 1<<22))
-    hi_o = (offset >> 11) & 0b11111111111
-    lo_o = (offset >> 0)  & 0b11111111111
-    hi_c = 0b11110
-    lo_c = 0b11111 if is_bl else 0b10111
-    hi = (hi_c << 11) + hi_o
-    lo = (lo_c << 11) + lo_o
-    code = pack('<HH', hi, lo)
-    return code
+    if '-' in text.lstrip('-'):
+        start, end = text.split('-', 1)
+        return int(start, 0), int(end, 0)
+    val = int(text, 0)
+    return val, val + 1
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Finds references to addresses in Pebble firmware",
+        epilog="Legacy form 'findrefs.py [tintin_fw.bin] [base] 0xVALUE' "
+        "is still accepted.")
+    parser.add_argument("-t", "--tintin",
+                        help="Input tintin_fw file, defaults to tintin_fw.bin")
+    parser.add_argument("-c", "--codebase", type=lambda x: int(x, 0),
+                        help="Codebase of the binary. "
+                        "Defaults to 0x8004000 (which is for 3.x fw); "
+                        "for 1.x-2.x set it to 0x8010000")
+    parser.add_argument("-f", "--file", action="append", default=[],
+                        help="Read addresses and ranges from file, "
+                        "one or more per line; '-' reads stdin")
+    parser.add_argument("-j", "--json", action="store_true",
+                        help="Print results as JSON object")
+    parser.add_argument("queries", nargs='*', metavar="ADDR",
+                        help="Address (0x080412f9) or range "
+                        "(0x8040000-0x8041000, end exclusive)")
+    args = parser.parse_args()
+
+    queries = list(args.queries)
+    # legacy positional tintin file and base
+    if queries and args.tintin is None:
+        try:
+            parse_query(queries[0])
+        except ValueError:
+            args.tintin = queries.pop(0)
+            if len(queries) == 2 and args.codebase is None:
+                args.codebase = int(queries.pop(0), 0)
+    for name in args.file:
+        f = sys.stdin if name == '-' else open(name)
+        for line in f:
+            queries.extend(line.split('#', 1)[0].split())
+    if not queries:
+        parser.error("no addresses given")
+    args.queries = queries
+    if args.tintin is None:
+        args.tintin = "tintin_fw.bin"
+    if args.codebase is None:
+        args.codebase = 0x08004000
+    return args
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print "Usage: findrefs.py [tintin_fw.bin] [base] 0xVALUE"
-        print "Examples:"
-        print "  findrefs.py 0x080412f9"
-        print "  findrefs.py tintin_fw.patched.bin 0x0801FEDC"
-        print "Base defaults to 0x08004000 (v3.x), for v2.x use 0x8010000"
-        exit(1)
+    args = parse_args()
+    base = args.codebase
+    queries = [(q, parse_query(q)) for q in args.queries]
+    data = open(args.tintin, "rb").read()
 
-    base = 0x08004000
-    if len(sys.argv) == 2:
-        tintin = "tintin_fw.bin"
-        val = sys.argv[1]
-    else:
-        tintin = sys.argv[1]
-        if len(sys.argv) > 3:
-            base = int(sys.argv[2], 0) # from hex
-            val = sys.argv[3]
+    index = RefIndex(data, base)
+    if len(queries) == 1 and not args.json:
+        # single address doesn't need sorting whole binary
+        text, (start, end) = queries[0]
+        if end == start + 1:
+            results = [[(offset, kind, start)
+                        for offset, kind in index.find(start)]]
         else:
-            val = sys.argv[2]
-
-    val = int(val, 0)
-    sval = pack('I', val)
-    data = open(tintin, "rb").read()
+            results = [index.findRange(start, end)]
+    else:
+        results = index.findMany([r for q, r in queries])
 
-    for i in range(0, len(data)-3, 2):
-        for ix in (i, i+1) if i<len(data)-1 else (i,):
-            d = data[ix:ix+4]
-            iadr = ix + base
-            if d == sval:
-                print "Offset 0x%X / 0x%X : DCD 0x%X" % (ix, iadr, val)
-        d = data[i:i+4]
-        iadr = i + base
-        if d == genCode(iadr, val, False):
-            print "Offset 0x%X / 0x%X : B.W 0x%X" % (i, iadr, val)
-        if d == genCode(iadr, val, True):
-            print "Offset 0x%X / 0x%X : BL 0x%X" % (i, iadr, val)
-    print "Done."
+    if args.json:
+        json.dump(dict(
+            (text, [dict(offset=offset, address=offset + base,
+                         kind=kind, target=target)
+                    for offset, kind, target in refs])
+            for (text, r), refs in zip(queries, results)),
+                  sys.stdout, indent=2)
+        print()
+        exit(0)
+    for (text, r), refs in zip(queries, results):
+        if len(queries) > 1:
+            print("%s: %d references" % (text, len(refs)))
+        for offset, kind, target in refs:
+            print("Offset 0x%X / 0x%X : %s 0x%X" % (offset, offset + base,
+                                                     kind, target))
+    print("Done.")
@@ -1,6 +1,12 @@
 from .parser import *
 from .asm import *
 from .block import *
+from .fold import *
+from .layout import *
+from .linkmap import *
 from .mask import *
 from .patch import *
+from .peephole import *
 from .ranges import *
+from .symbols import *
+from .unused import *
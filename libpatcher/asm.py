@@ -2,7 +2,9 @@
 
 from struct import pack, unpack
 
-__all__ = ['Num', 'List', 'Reg', 'Label', 'Str',
+from . import thumbimm
+
+__all__ = ['Num', 'List', 'Reg', 'Label', 'Str', 'Literal',
            #'Argument', 'LabelError', 'Instruction',
            'findInstruction']
 
@@ -12,6 +14,9 @@ __all__ = ['Num', 'List', 'Reg', 'Label', 'Str',
 
 
 class Argument(object):
+    __slots__ = ()
+    # kind of argument, used to index instruction definitions by arguments
+    kind = None
 
     def match(self, other):
         """ Matches this instance with given obj """
@@ -19,12 +24,18 @@ class Argument(object):
 
 
 class Num(int, Argument):
-    """ Just remember initially specified value format """
+    """
+    Just remember initially specified value format.
+    Concrete numbers are immutable and interned,
+    so equal numbers written the same way share one object.
+    """
+    kind = 'num'
+    bits = None  # for concrete numbers
+    _interned = {}
+
     def __new__(cls, val=None, initial=None, bits='any',
                 positive=False, lsl=None):
-        if isinstance(val, str):
-            ret = int.__new__(cls, val, 0)  # auto determine base
-        elif val is None:
+        if val is None:  # mask
             ret = int.__new__(cls, 0)
             ret.bits = bits
             if bits != 'any':
@@ -32,14 +43,24 @@ class Num(int, Argument):
             ret.positive = positive
             ret.lsl = lsl
             return ret
+        if isinstance(val, str):
+            num = int(val, 0)  # auto determine base
         else:
-            ret = int.__new__(cls, val)
-        ret.initial = str(val) if initial is None else initial
-        # and for consistency with Reg:
-        ret.val = ret
-        ret.bits = None
+            num = int(val)
+        initial = str(val) if initial is None else initial
+        key = (cls, num, initial)
+        ret = Num._interned.get(key)
+        if ret is None:
+            ret = int.__new__(cls, num)
+            ret.initial = initial
+            Num._interned[key] = ret
         return ret
 
+    @property
+    def val(self):
+        " for consistency with Reg "
+        return self
+
     def __repr__(self):
         if self.bits is not None:
             if self.bits != 'any':  # numeric
@@ -48,6 +69,12 @@ class Num(int, Argument):
             return "Integer%s" % (", positive" if self.positive else "")
         return str(self.initial)
 
+    def __reduce__(self):
+        # plain int pickling would lose our extra fields
+        if self.bits is not None:
+            return (Num, (None, None, self.bits, self.positive, self.lsl))
+        return (Num, (int(self), self.initial))
+
     def match(self, other):
         if not isinstance(other, Num):
             return False
@@ -64,8 +91,21 @@ class Num(int, Argument):
     def part(self, bits, shift=0):
         return (self >> shift) & (2**bits - 1)
 
+    @property
+    def theval(self):
+        """
+        12-bit ThumbExpandImm encoding of this number.
+        Raises ValueError if it cannot be encoded.
+        """
+        return thumbimm.encode(self)
+
+    def the(self, bits, shift):
+        " Like part(), but for ThumbExpandImm encoding of this number "
+        return (self.theval >> shift) & (2**bits - 1)
+
     class ThumbExpandable(Argument):
         """ Number compatible with ThumbExpandImm function """
+        kind = 'num'
 
         def __init__(self, bits=12):
             self.bits = bits
@@ -74,59 +114,17 @@ class Num(int, Argument):
             return "ThumbExpandable integer for %s bits" % self.bits
 
         def match(self, other):
-            def encode(n):
-                " Encodes n to thumb-form or raises ValueError if impossible "
-                # 11110 i 0 0010 S 1111   0 imm3 rd4 imm8
-                if n <= 0xFF:  # 1 byte
-                    return n
-                b1 = n >> 24
-                b2 = (n >> 16) & 0xFF
-                b3 = (n >> 8) & 0xFF
-                b4 = n & 0xFF
-                if b1 == b2 == b3 == b4:
-                    return (0b11 << 8) + b1
-                if b1 == 0 and b3 == 0 and b2 == b4:
-                    return (0b01 << 8) + b2
-                if b2 == 0 and b4 == 0 and b1 == b3:
-                    return (0b10 << 8) + b1
-                # rotating scheme
-
-                def rol(n, ofs):
-                    return ((n << ofs) & 0xFFFFFFFF) | (n >> (32 - ofs))
-                    # maybe buggy for x >= 1<<32,
-                    # but we will not have such values -
-                    # see parseNumber above for explanation
-
-                for i in range(0b1000, 32):
-                    # ^^ - lower values will cause autodetermining to fail
-                    val = rol(n, i)
-                    if((val & 0xFFFFFF00) == 0 and
-                       (val & 0xFF) == 0x80 + (val & 0x7F)):  # correct
-                        return ((i << 7) & 0xFFF) + (val & 0x7F)
-                raise ValueError
-
-            def the(bits, shift):
-                return (val >> shift) & (2**bits - 1)
-
             if not isinstance(other, Num):
                 return False
-            if abs(other) > 2**32 - 1:
-                return False  # too large
-            if other < 0:
-                other += 2**32  # convert to positive
             try:
-                val = encode(other)
+                thumbimm.encode(other)
             except ValueError:
                 return False
-            other.theval = val
-            other.the = the
-            other.imm8 = val & (2**8 - 1)
-            other.imm3 = (val >> 8) & (2**3 - 1)
-            other.i = val >> 11
             return True
 
 
 class List(list, Argument):
+    kind = 'list'
 
     def match(self, other):
         if not isinstance(other, (List, list)):
@@ -146,6 +144,12 @@ class List(list, Argument):
 
 
 class Reg(int, Argument):
+    """
+    Register or register mask.
+    These are immutable and interned by name.
+    """
+    kind = 'reg'
+    _interned = {}
     _regs = {
         'R0': 0, 'R1': 1, 'R2': 2, 'R3': 3,
         'R4': 4, 'R5': 5, 'R6': 6, 'R7': 7, 'WR': 7,
@@ -176,6 +180,9 @@ class Reg(int, Argument):
         Usage: either Reg('name') or Reg(hi=True/False) or Reg()
         First is a plain register, others are masks
         """
+        key = (cls, name, hi)
+        if key in Reg._interned:
+            return Reg._interned[key]
         if not name or name in ['HI', 'LO']:  # pure mask
             if name == 'HI':
                 hi = True
@@ -193,11 +200,17 @@ class Reg(int, Argument):
         ret = int.__new__(cls, val)
         ret.name = name
         ret.mask = mask
+        Reg._interned[key] = ret
         return ret
 
     def __repr__(self):
         return self.name
 
+    def __reduce__(self):
+        if self.mask is not None:
+            return (Reg, (None, self.mask))
+        return (Reg, (self.name,))
+
     def match(self, other):
         if not isinstance(other, Reg):
             return False
@@ -212,6 +225,7 @@ class Reg(int, Argument):
 
 
 class RegList(List):  # list of registers
+    kind = 'reglist'
 
     def __init__(self, lo=None, lcount=8, pc=False, lr=False, sp=False):
         self.src = []
@@ -227,6 +241,14 @@ class RegList(List):  # list of registers
     def __repr__(self):
         return '{%s}' % ','.join(self.src)
 
+    def __reduce__(self):
+        # our append() wants source text, so restore items in setstate
+        return (RegList, (), (self.__dict__, list(self)))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state[0])
+        list.extend(self, state[1])
+
     def append(self, s, pos):
         if not isinstance(s, str):
             raise ValueError(s)
@@ -311,12 +333,25 @@ class LabelError(Exception):
     pass
 
 
+class OffsetError(LabelError):
+    """
+    This exception is raised when label is found
+    but its offset doesn't fit instruction encoding.
+    Larger encoding of the same instruction may still fit.
+    """
+    pass
+
+
 class Label(Argument):
+    __slots__ = ('name', 'shift', 'addr')
+    kind = 'label'
 
     def __init__(self, name=None):
         self.name = name
         # This is used by parser for constructions like DCD someProc+1
         self.shift = 0
+        # resolved by SymbolTable; None means look it up on demand
+        self.addr = None
 
     def __repr__(self):
         return (":%s" % self.name) if self.name else "Label"
@@ -327,6 +362,8 @@ class Label(Argument):
     def getAddress(self, instr):
         if not self.name:
             raise LabelError("This is a mask, not label!")
+        if self.addr is not None:
+            return self.addr + self.shift
         try:
             return instr.findLabel(self) + self.shift
         except IndexError:
@@ -341,9 +378,10 @@ class Label(Argument):
     def offset(self, instr, bits, shift=0, positive=False, align=False):
         """
         Returns offset from given instruction to this label.
-        bits - maximum bit-width for offset;
+        bits - maximum bit-width for offset, including sign bit
+            unless offset must be positive;
             if offset doesn't fit that width,
-            LabelError will be raised.
+            OffsetError will be raised.
         shift - how many bits to cut off from the end
             (they are added to Bits on checking);
             these bits must be 0.
@@ -352,18 +390,23 @@ class Label(Argument):
         This method is intended to be used one time, in non-lambda procs.
         """
         ofs = self._getOffset(instr, align)
-        if abs(ofs) >= (1 << (bits + shift)):
-            raise LabelError("Offset is too far: 0x%X" % ofs)
+        width = bits + shift
+        if positive:
+            too_far = ofs >= (1 << width)
+        else:  # two's complement
+            too_far = not -(1 << (width - 1)) <= ofs < (1 << (width - 1))
+        if too_far:
+            raise OffsetError("Offset is too far: 0x%X" % ofs)
         if ofs < 0:
             if positive:
-                raise LabelError(
+                raise OffsetError(
                     "Negative offset not allowed here: 0x%X" % ofs)
             ofs = (1 << (bits + shift)) + ofs
         if bits > 0:
             rem = ofs & (2**shift - 1)
             if rem:
                 # FIXME
-                raise LabelError("Spare bits in offset 0x%X: %X" % (ofs, rem))
+                raise OffsetError("Spare bits in offset 0x%X: %X" % (ofs, rem))
             ofs = ofs >> shift
         return ofs
 
@@ -386,7 +429,7 @@ class Label(Argument):
         Tests if offset from given instruction to this label
         fits in `bits' bits.
         Returns 0 on success, for usage in lambdas.
-        Raises LabelError on failure.
+        Raises OffsetError on failure.
         """
         self.offset(instr, bits)
         return 0
@@ -398,7 +441,7 @@ class Label(Argument):
         Returns 0 on success, for usage in lambdas.
         """
         if self._getOffset(instr) < 0:
-            raise LabelError("Negative offset not allowed here")
+            raise OffsetError("Negative offset not allowed here")
         return 0
 
     def off_range(self, instr, min, max):
@@ -406,17 +449,54 @@ class Label(Argument):
         Tests if offset from given instruction to this label
         fits given range.
         Returns 0 on success, for usage in lambdas.
-        Raises LabelError on failure.
+        Raises OffsetError on failure.
         """
         ofs = self._getOffset(instr)
         if ofs < min or ofs > max:
-            raise LabelError("Offset %X doesn't fit range %X..%X" %
+            raise OffsetError("Offset %X doesn't fit range %X..%X" %
                              (ofs, min, max))
         return 0
 
 
+class LiteralLabel(Label):
+    """
+    Label of literal pool entry holding given value
+    (either Num or Label, the latter maybe with shift).
+    Its name is made from that value, so equal values share entry.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        if isinstance(value, Label):
+            name = "=%s%s" % (value.name,
+                              "%+d" % value.shift if value.shift else "")
+        else:
+            name = "=0x%X" % (value & 0xFFFFFFFF)
+        super(LiteralLabel, self).__init__(name)
+        self.value = value
+
+
+class Literal(Argument):
+    """ Value to be loaded from literal pool, written as =value """
+    __slots__ = ('value',)
+    kind = 'literal'
+
+    def __init__(self, value=None):
+        self.value = value  # Num or Label; None for mask
+
+    def __repr__(self):
+        if self.value is None:
+            return "Literal"
+        return LiteralLabel(self.value).name
+
+    def match(self, other):
+        return isinstance(other, Literal) and other.value is not None
+
+
 class Str(bytes, Argument):
     """ This represents _quoted_ string """
+    kind = 'str'
+
     def __new__(cls, val=None):
         # val is expected to be bytes
         if isinstance(val, str):
@@ -449,6 +529,9 @@ class Instruction(object):
     or real instruction (with concrete args and context).
     Instruction handler may access its current opcode via self.opcode field.
     """
+    # there may be lots of instructions, so don't waste memory on __dict__
+    __slots__ = ('opcode', 'args', 'proc', 'mask', 'pos', 'size', 'sizeproc',
+                 'addr', 'original', 'block', 'shape', 'alternatives')
 
     def __init__(self, opcode, args, proc, mask=True, pos=None):
         self.opcode = opcode
@@ -457,8 +540,12 @@ class Instruction(object):
         self.mask = mask
         self.pos = pos
         self.size = None
+        self.sizeproc = None  # for definitions with calculated size
         self.addr = None
         self.original = None
+        self.shape = None  # for definitions, see _register
+        # larger definitions matching this instruction, see widen()
+        self.alternatives = ()
 
     def __repr__(self):
         ret = "<%s %s>" % (self.opcode, ','.join([repr(x) for x in self.args]))
@@ -482,9 +569,9 @@ class Instruction(object):
         # ... and args
         if len(self.args) != len(args):
             return False
-        # __func__ to avoid type checking, as match() will excellently work
-        # on plain list.
-        if not List.match.__func__(self.args, args):
+        # call it unbound to avoid type checking,
+        # as match() will excellently work on plain list.
+        if not List.match(self.args, args):
             return False
         return True
 
@@ -495,14 +582,40 @@ class Instruction(object):
         ret = self.__class__(opcode, args, self.proc, mask=False, pos=pos)
         if self.size is not None:
             ret.size = self.size
-        else:
-            # this magic is to correctly "replant" custom method to another
-            # instance
-            import types
-            ret.getSize = types.MethodType(self.getSize.__func__, ret)
+        ret.sizeproc = self.sizeproc
         ret.original = self
         return ret
 
+    def __reduce_ex__(self, protocol):
+        """
+        Instances created from definitions hold their handler procs,
+        which are mostly lambdas and cannot be pickled;
+        so pickle the instance as a reference to its definition
+        and instantiate it again on unpickling.
+        """
+        if self.original is None:
+            return super(Instruction, self).__reduce_ex__(protocol)
+        return (_reinstantiate, (_instructions.index(self.original),
+                                 self.opcode, self.args, self.pos,
+                                 [_instructions.index(d)
+                                  for d in self.alternatives]))
+
+    def widen(self):
+        """
+        Switches this instruction to the next larger definition
+        which matches it, e.g. when its label is out of reach.
+        Returns False if there are no more such definitions.
+        """
+        if not self.alternatives:
+            return False
+        d = self.alternatives[0]
+        self.alternatives = self.alternatives[1:]
+        self.proc = d.proc
+        self.size = d.size
+        self.sizeproc = d.sizeproc
+        self.original = d
+        return True
+
     def setAddr(self, addr):
         """
         Sets memory address at which
@@ -517,6 +630,22 @@ class Instruction(object):
 
     def setBlock(self, block):
         self.block = block
+        # make symbols available for lookup right away;
+        # duplicates are reported by SymbolTable
+        for name, value, scope in self.definitions():
+            scope.context.setdefault(name, value)
+
+    def definitions(self):
+        """
+        Returns (name, value, scope) tuples for symbols
+        defined by this bound instruction;
+        scope is patch for global symbols and block for local ones.
+        """
+        return ()
+
+    def references(self):
+        """ Returns labels this instruction refers to """
+        return _labels(self.args)
 
     def findLabel(self, label):
         if label.name in self.block.context:
@@ -545,9 +674,19 @@ class Instruction(object):
                              (repr(self), repr(code)))
 
     def getSize(self):
-        """ default implementation; may be overriden by decorator """
+        """ default implementation; may be overriden by subclasses """
+        if self.sizeproc:
+            return self.sizeproc(self)
         return self.size
 
+    def sizeAt(self, addr):
+        """
+        Returns size which this instruction will have at given address.
+        Only alignment of address may matter here.
+        Default implementation is for position-independent instructions.
+        """
+        return self.getSize()
+
     def getPos(self):
         " pos is instruction's position in patch file "
         return self.pos
@@ -558,6 +697,7 @@ class NullInstruction(Instruction):
     This class represents instruction with no code.
     It is intended to be subclassed.
     """
+    __slots__ = ()
 
     def getSize(self):
         return 0
@@ -571,24 +711,95 @@ class LabelInstruction(NullInstruction):
     This class represents an abstract label instruction. It has zero size.
     It should be instantiated directly.
     """
+    __slots__ = ('name', 'glob', 'owner')
 
     def __init__(self, name, pos, glob=False):
         Instruction.__init__(self, None, [Label(name)], None, False, pos)
         self.name = name
         self.glob = glob
+        # patch of global label, if it differs from block's one
+        # (when label was moved to another block, see fold)
+        self.owner = None
 
     def __repr__(self):
         return "<%slabel:%s>" % ("global " if self.glob else "", self.name)
 
-    def setBlock(self, block):
-        self.block = block
-        ctx = block.patch.context if self.glob else block.context
-        if self.name in ctx:
-            raise ValueError('Duplicate label ' + self.name)
-        ctx[self.name] = self.getAddr()
+    def definitions(self):
+        return [(self.name, self.getAddr(), self.getScope())]
+
+    def getScope(self):
+        """ Returns patch or block which this label belongs to """
+        if not self.glob:
+            return self.block
+        return self.owner or self.block.patch
+
+    def references(self):
+        return []
 
 
 _instructions = []
+# definitions indexed by opcode; those with opcode None are for any opcode
+_byOpcode = {}
+_anyOpcode = []
+# cache of candidate definitions for given opcode and argument kinds
+_candidates = {}
+
+
+def _argShape(args):
+    """
+    Returns tuple of sets of argument kinds acceptable
+    for given definition args.
+    """
+    def accepts(a):
+        # alternatives are given as tuple
+        kinds = set()
+        for alt in (a if isinstance(a, tuple) else (a,)):
+            if alt.kind == 'list':  # it will accept RegList as well
+                kinds.update(('list', 'reglist'))
+            else:
+                kinds.add(alt.kind)
+        return frozenset(kinds)
+    return tuple([accepts(a) for a in args])
+
+
+def _register(instr):
+    """ Appends instruction definition to the table and its index """
+    _instructions.append(instr)
+    if type(instr).match is Instruction.match:
+        instr.shape = _argShape(instr.args)
+    else:  # custom match, so no assumptions on args
+        instr.shape = None
+    if instr.opcode is None:
+        _anyOpcode.append(instr)
+    else:
+        opcodes = ([instr.opcode] if isinstance(instr.opcode, str)
+                   else instr.opcode)
+        for opcode in opcodes:
+            _byOpcode.setdefault(opcode, []).append(instr)
+    _candidates.clear()
+
+
+def findCandidates(opcode, args):
+    """
+    Returns definitions which may match given opcode and args,
+    judging by opcode and by count and kinds of args,
+    in the order of their definition.
+    """
+    kinds = tuple([a.kind if isinstance(a, Argument) else
+                   'list' if isinstance(a, list) else None
+                   for a in args])
+    key = (opcode, kinds)
+    if key not in _candidates:
+        defs = _byOpcode.get(opcode, [])
+        if _anyOpcode:
+            defs = sorted(defs + _anyOpcode, key=_instructions.index)
+        _candidates[key] = [
+            d for d in defs
+            if d.shape is None or (
+                len(d.shape) == len(kinds) and
+                all([k in s for k, s in zip(kinds, d.shape)]))
+        ]
+    return _candidates[key]
 
 
 def instruction(opcode, args, size=2, proc=None):
@@ -614,10 +825,10 @@ def instruction(opcode, args, size=2, proc=None):
 
         instr = Instruction(opcode, args, proc)
         if callable(size):
-            instr.getSize = size
+            instr.sizeproc = size
         else:
             instr.size = size
-        _instructions.append(instr)
+        _register(instr)
         return proc
     if proc:  # not used as decorator
         gethandler(proc)
@@ -627,22 +838,44 @@ def instruction(opcode, args, size=2, proc=None):
 
 def instruct_class(c):
     """ decorator for custom instruction classes """
-    _instructions.append(c())
+    _register(c())
     return c
 
 
+def _reinstantiate(index, opcode, args, pos, alternatives=()):
+    """ Unpickling helper for Instruction """
+    definition = _instructions[index]
+    # match again, as it may attach some data to args
+    if not definition.match(opcode, args):
+        raise ValueError("Definition doesn't match %s %s" % (opcode, args))
+    ret = definition.instantiate(opcode, args, pos)
+    ret.alternatives = tuple([_instructions[i] for i in alternatives])
+    return ret
+
+
 def findInstruction(opcode, args, pos):
     """
     This method tries to find matching instruction
     for given opcode and args.
     On success, it will instantiate that instruction with given pos
     (cloning that pos).
+    If several plain definitions match, the shortest one is used,
+    and the others are remembered for Instruction.widen().
     On failure, it will throw IndexError.
     """
-    for i in _instructions:
-        if i.match(opcode, args):
-            return i.instantiate(opcode, args, pos.clone())
-    raise IndexError("Unsupported instruction: %s" % opcode)
+    matching = [i for i in findCandidates(opcode, args)
+                if i.match(opcode, args)]
+    if not matching:
+        raise IndexError("Unsupported instruction: %s" % opcode)
+    if type(matching[0]) is not Instruction or matching[0].size is None:
+        return matching[0].instantiate(opcode, args, pos.clone())
+    # sorted() is stable, so equal sizes keep definition order
+    matching = sorted([i for i in matching
+                       if type(i) is Instruction and i.size is not None],
+                      key=lambda i: i.size)
+    ret = matching[0].instantiate(opcode, args, pos.clone())
+    ret.alternatives = tuple(matching[1:])
+    return ret
 
 ###
 # All the instruction definitions
@@ -660,14 +893,16 @@ def _longJump(self, dest, bl):
     return (hi, lo)
 instruction('BL', [Label()], 4, lambda self, dest:
             _longJump(self, dest, True))
-instruction('B.W', [Label()], 4, lambda self, dest:
+# B is also an alias for B.W when 16-bit B cannot reach its label
+instruction(['B.W', 'B'], [Label()], 4, lambda self, dest:
             _longJump(self, dest, False))
 
 
 @instruct_class
 class DCB(Instruction):
+    __slots__ = ('code',)
 
-    def __init__(self, opcode=None, args=None, pos=None):
+    def __init__(self, opcode=['DCB', 'db'], args=None, pos=None):
         Instruction.__init__(self, opcode, args, None, pos=pos)
         if args:
             code = b''
@@ -696,6 +931,7 @@ class DCB(Instruction):
 
 @instruct_class
 class ALIGN(Instruction):
+    __slots__ = ()
     # TODO support ALIGN 2?
 
     def __init__(self, opcode='ALIGN', args=[(Num(4), Num(4))],
@@ -705,14 +941,32 @@ class ALIGN(Instruction):
             self.size = args[0]
 
     def getCode(self):
-        return '\x00\x00\x00\xBF'[4 - self.getSize():]
+        return _padding(self.getSize())
 
     def getSize(self):
         if self.getAddr() is None:
             # if checking against unbound block,
             # assume maximum size
             return 3
-        return 3 - (self.getAddr() + 3) % 4
+        return self.sizeAt(self.getAddr())
+
+    def sizeAt(self, addr):
+        return -addr % 4
+
+
+def _labels(args):
+    """ Returns labels found in given (possibly nested) arguments """
+    ret = []
+    for a in args:
+        if isinstance(a, Label) and a.name:
+            ret.append(a)
+        elif isinstance(a, list):
+            ret.extend(_labels(a))
+    return ret
+
+def _padding(size):
+    " Returns filler bytes for alignment: NOP if possible "
+    return b'\x00\x00\x00\xBF'[4 - size:]
 
 instruction('DCW', [Num(bits=16)], 2, lambda self, num: pack('<H', num))
 instruction('DCD', [Num(bits=32)], 4, lambda self, num: pack('<I', num))
@@ -724,13 +978,16 @@ instruction('NOP', [], 2, 0xBF00)
 def Bcond_instruction(cond, val):
     instruction('B' + cond, [Label()], 2, lambda self, lbl:
                 (0b1101 << 12) + (val << 8) + (lbl.offset(self, 9) >> 1))
-    instruction('B' + cond + '.W', [Label()], 4, lambda self, lbl:
-                (lbl.off_max(self, 19) +  # test for maximum
+    # offset is S:J2:J1:imm6:imm11:0
+    instruction(['B' + cond + '.W', 'B' + cond], [Label()], 4, lambda self, lbl:
+                (lbl.off_max(self, 21) +  # test for maximum
 
-                 (0b11110 << 11) + (lbl.off_s(self, 1, 18) << 10) +
+                 (0b11110 << 11) + (lbl.off_s(self, 1, 20) << 10) +
                     (val << 6) + (lbl.off_s(self, 6, 12) >> 0),
 
-                 (0b10101 << 11) + (lbl.off_s(self, 11, 1) >> 0)))
+                 (0b10 << 14) + (lbl.off_s(self, 1, 18) << 13) +
+                    (lbl.off_s(self, 1, 19) << 11) +
+                    (lbl.off_s(self, 11, 1) >> 0)))
 for cond, val in {
     'CC': 0x3, 'CS': 0x2, 'EQ': 0x0, 'GE': 0xA,
     'GT': 0xC, 'HI': 0x8, 'LE': 0xD, 'LS': 0x9,
@@ -743,7 +1000,7 @@ for cond, val in {
 @instruction(['CBZ', 'CBNZ'], [Reg('LO'), Label()])
 def CBx(self, reg, lbl):
     lbl.off_range(self, 0, 126)
-    offset = lbl.offset(self, 7) >> 1
+    offset = lbl.offset(self, 7, positive=True) >> 1
     op = 1 if 'N' in self.opcode else 0
     return ((0b1011 << 12) +
             (op << 11) +
@@ -757,6 +1014,7 @@ instruction('B', [Label()], 2, lambda self, lbl:
 
 @instruct_class
 class GlobalLabel(LabelInstruction):
+    __slots__ = ()
 
     def __init__(self):
         Instruction.__init__(self, ["global", "proc"], [Label()], None)
@@ -772,6 +1030,7 @@ class ValInstruction(NullInstruction):
     This class represents "val" instruction. It has zero size.
     It stores 4bytes integer at its position on setBlock.
     """
+    __slots__ = ('name',)
 
     def __init__(self, pos=None, name=None):
         Instruction.__init__(self, "val", [Label()], None, True, pos)
@@ -787,13 +1046,16 @@ class ValInstruction(NullInstruction):
     def setBlock(self, block):
         if block.mask and block.mask.floating:
             raise ValueError("Cannot use val instruction in floating block")
-        self.block = block
-        codebase = block.codebase
-        # get value...
-        addr = self.getAddr() - codebase
+        Instruction.setBlock(self, block)
+
+    def definitions(self):
+        # get value and store it at patch level
+        addr = self.getAddr() - self.block.codebase
         value = unpack('<I', self.block.patch.binary[addr:addr + 4])[0]
-        # ...and store it at patch level
-        block.patch.context[self.name] = value
+        return [(self.name, value, self.block.patch)]
+
+    def references(self):
+        return []
 
 
 # ADD version for SP
@@ -939,6 +1201,91 @@ instruction(['LDR.W', 'LDR'], [Reg(), ([Reg(), Num(bits=12)], [Reg()])], 4,
 instruction('LDR', [Reg("LO"), Label()], 2, lambda self, rt, lbl:
             (0b1001 << 11) + (rt << 8) +
             lbl.offset(self, 8, shift=2, positive=True, align=True))
+
+
+@instruction(['LDR.W', 'LDR'], [Reg(), Label()], 4)
+def LDRW_literal(self, rt, lbl):
+    # offset is not two's complement here but U(add) bit and 12-bit value
+    ofs = lbl._getOffset(self, align=True)
+    if abs(ofs) > 0xFFF:
+        raise OffsetError("Offset is too far: 0x%X" % ofs)
+    return ((0b11111 << 11) +
+            ((1 if ofs >= 0 else 0) << 7) +
+            (0b101 << 4) +
+            0b1111,
+            (rt << 12) +
+            abs(ofs))
+
+
+@instruct_class
+class LiteralLoad(Instruction):
+    """
+    LDR Rx, =value pseudo-instruction.
+    It is instantiated as plain LDR Rx, label
+    where label points to value's entry in block's literal pool,
+    so it may be widened as any other LDR.
+    """
+    __slots__ = ()
+
+    def __init__(self):
+        Instruction.__init__(self, ['LDR', 'LDR.W'], [Reg(), Literal()], None)
+
+    def instantiate(self, opcode, args, pos):
+        return findInstruction(opcode, [args[0], LiteralLabel(args[1].value)],
+                               pos)
+
+
+@instruct_class
+class LiteralPool(Instruction):
+    """
+    Pool of 4-byte values loaded by LDR Rx, =value instructions.
+    It is placed with LTORG instruction;
+    block which needs a pool but has no LTORG gets one at its end
+    (see Block).
+    """
+    __slots__ = ('entries',)
+
+    def __init__(self, opcode='LTORG', args=[], proc=None,
+                 mask=True, pos=None):
+        Instruction.__init__(self, opcode, args, proc, mask, pos)
+        self.entries = []  # LiteralLabels
+
+    def __repr__(self):
+        return "<pool:%s>" % ','.join([e.name for e in self.entries])
+
+    def instantiate(self, opcode, args, pos):
+        return LiteralPool(opcode, args, None, False, pos)
+
+    def getSize(self):
+        if self.getAddr() is None:
+            # if checking against unbound block,
+            # assume maximum alignment
+            return 3 + 4 * len(self.entries) if self.entries else 0
+        return self.sizeAt(self.getAddr())
+
+    def sizeAt(self, addr):
+        if not self.entries:
+            return 0
+        return -addr % 4 + 4 * len(self.entries)
+
+    def definitions(self):
+        addr = self.getAddr() + -self.getAddr() % 4
+        return [(e.name, addr + 4 * n, self.block)
+                for n, e in enumerate(self.entries)]
+
+    def references(self):
+        return [e.value for e in self.entries if isinstance(e.value, Label)]
+
+    def getCode(self):
+        if not self.entries:
+            return b''
+        code = _padding(-self.getAddr() % 4)
+        for e in self.entries:
+            value = e.value
+            if isinstance(value, Label):
+                value = value.getAddress(self)
+            code += pack('<I', value & 0xFFFFFFFF)
+        return code
 # T1
 instruction('LDRB', [Reg("LO"), ([Reg("LO"), Num(bits=5)], [Reg("LO")])],
             2, lambda self, rt, lst:
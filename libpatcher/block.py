@@ -1,14 +1,43 @@
 # This module holds Block class
-from .asm import LabelInstruction
+from .asm import LabelInstruction, LiteralLabel, LiteralPool
 from .patch import PatchingError
 
 class Block(object):
+    __slots__ = ('patch', '_mask', 'instructions', '_context', 'position',
+                 'addr', 'codebase', 'preferred')
+
     def __init__(self, patch, mask, instructions):
         self.patch = patch
         self._mask = mask
         self.instructions = instructions
         self._context = {}
         self.position = None # to cache mask.match() result
+        self.addr = None
+        # position to try first for floating block, e.g. from previous map
+        self.preferred = None
+        self._makePools()
+    def _makePools(self):
+        """
+        Puts values of LDR Rx, =value instructions to literal pools:
+        to the first LTORG after the instruction, or to a new pool
+        at the end of block.
+        Each value is stored once per block.
+        """
+        seen = set()
+        pending = []
+        for i in self.instructions:
+            if isinstance(i, LiteralPool):
+                i.entries.extend(pending)
+                pending = []
+                continue
+            for a in i.args or []:
+                if isinstance(a, LiteralLabel) and a.name not in seen:
+                    seen.add(a.name)
+                    pending.append(a)
+        if pending:
+            pool = LiteralPool(mask=False, pos=self.instructions[-1].pos)
+            pool.entries = pending
+            self.instructions.append(pool)
     def __repr__(self):
         name=""
         if len(self.instructions) > 0:
@@ -28,11 +57,22 @@ class Block(object):
     def mask(self):
         return self._mask
     def getSize(self):
-        " Returns overall size of block's instructions "
-        # FIXME: will this work before binding?
-        # Replace with maxsize?
-        return sum([i.getSize() for i in self.instructions])
-    def getPosition(self, binary=None, ranges=None):
+        """
+        Returns overall size of block's instructions.
+        Before binding, returns maximum of possible sizes.
+        """
+        if self.addr is None:
+            return max([self.sizeAt(addr) for addr in range(4)])
+        return self.sizeAt(self.addr)
+    def sizeAt(self, addr):
+        """
+        Returns exact size this block will have at given address.
+        """
+        start = addr
+        for i in self.instructions:
+            addr += i.sizeAt(addr)
+        return addr - start
+    def getPosition(self, binary=None, ranges=None, codebase=0x8004000):
         """
         Returns position of this block's mask in given binary file.
         Will cache its result.
@@ -42,7 +82,7 @@ class Block(object):
             if self.mask.floating:
                 if ranges == None:
                     raise ValueError("No ranges provided for floating block")
-                r = ranges.find(self.getSize())
+                r = ranges.find(lambda pos: self.sizeAt(pos + codebase))
                 self.position = r[0]
                 self.mask.size = r[1]-r[0]
             else:
@@ -50,6 +90,21 @@ class Block(object):
                     raise ValueError("No saved position and binary not provided")
                 self.position = self.mask.match(binary)
         return self.position
+    def reserve(self, ranges, codebase=0x8004000):
+        """
+        Takes preferred position of floating block from ranges, if it is
+        still free and large enough; otherwise block will get
+        some other position on getPosition().
+        Returns True if preferred position was taken.
+        """
+        if self.preferred is None or not self.mask.floating:
+            return False
+        size = self.sizeAt(self.preferred + codebase)
+        if not ranges.reserve(self.preferred, self.preferred + size):
+            return False
+        self.position = self.preferred
+        self.mask.size = size
+        return True
     def bind(self, addr, codebase):
         """
         This method is called once after construction.
@@ -62,6 +117,16 @@ class Block(object):
             i.setAddr(addr)
             addr += i.getSize()
             i.setBlock(self) # it may in return update our context, so call after setAddr
+    def unbind(self):
+        """
+        Reverts bind(), so that block may be bound again
+        (e.g. after its instructions changed their sizes).
+        Floating block will also forget its position.
+        """
+        self._context = {}
+        self.addr = None
+        if self.mask.floating:
+            self.position = None
     def getCode(self):
         """
         Calculstes and returns binary code of this whole block.
@@ -0,0 +1,199 @@
+# This module splits firmware binary into functions
+# and finds which of them call which.
+#
+# Function starts are BL targets and PUSH {..., LR} prologues
+# following code which doesn't fall through;
+# function ends after its last BX LR or POP {..., PC} epilogue
+# before the next function start.
+
+import hashlib
+import os
+
+import numpy as np
+
+from . import disasm
+
+__all__ = ['analyze', 'CallGraph']
+
+# bump when analysis changes, so that cached graphs are rebuilt
+VERSION = 2
+
+
+def _opcodes(d, names):
+    " Returns mask of instructions of d having one of given opcodes "
+    table = disasm._getTable()
+    match = np.array([e.opcode in names for e in table] + [False])
+    return match[d.entry]
+
+def _analyze(data, codebase):
+    " Returns (starts, ends, call sources, call targets) arrays "
+    d = disasm.disassemble(data, codebase)
+    code = d.code.astype(np.int64)
+    narrow = d.size == 2
+    imgEnd = codebase + len(data)
+
+    prologue = np.where(narrow, code & 0xFF00 == 0xB500,
+                        code & 0xFFFF4000 == 0xE92D4000)
+    epilogue = np.where(narrow,
+                        (code & 0xFF00 == 0xBD00) | (code == 0x4770),
+                        (code & 0xFFFF8000 == 0xE8BD8000) |
+                        (code == 0xF85DFB04))  # LDR.W PC, [SP], 4
+    # instructions after which next one is not reached from them
+    noreturn = (epilogue | _opcodes(d, ('B', 'B.W')) | (d.entry < 0) |
+                narrow & ((code == 0x46C0) | (code == 0xBF00)))  # padding
+    after = np.ones(len(d), bool) # nothing falls through to the first one
+    after[1:] = noreturn[:-1]
+
+    bl = np.nonzero(_opcodes(d, ('BL',)) &
+                    (d.target >= codebase) & (d.target < imgEnd))[0]
+    starts = np.union1d(d.target[bl], d.addr[prologue & after])
+
+    nexts = np.append(starts[1:], imgEnd)
+    epiEnds = (d.addr + d.size)[epilogue]
+    j = np.searchsorted(epiEnds, nexts, 'right') - 1
+    last = epiEnds[np.maximum(j, 0)]
+    ends = np.where((j >= 0) & (last > starts), last, nexts)
+    return starts, ends, d.addr[bl], d.target[bl]
+
+
+class CallGraph(object):
+    """
+    Functions of a binary (sorted starts and ends arrays)
+    and BL calls between them (call sources and targets arrays).
+    Calls made outside of any found function are kept too,
+    they just have no caller.
+    """
+
+    def __init__(self, starts, ends, callSrc, callDst):
+        self.starts = starts
+        self.ends = ends
+        self.callSrc = callSrc
+        self.callDst = callDst
+        self.callFrom = self._owners(callSrc)
+        # calls sorted by target, for callers()
+        self._byDst = np.argsort(callDst, kind='stable')
+        self._dsts = callDst[self._byDst]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return "<call graph: %d functions, %d calls>" % (
+            len(self), len(self.callSrc))
+
+    def _owners(self, addrs):
+        " Returns starts of functions containing given addresses, or -1 "
+        n = np.searchsorted(self.starts, addrs, 'right') - 1
+        inside = (n >= 0) & (addrs < self.ends[np.maximum(n, 0)])
+        return np.where(inside, self.starts[np.maximum(n, 0)], -1)
+
+    def function(self, addr):
+        """
+        Returns (start, end) of function containing given address
+        (thumb bit is ignored) or None.
+        """
+        owner = int(self._owners(np.array([addr & ~1]))[0])
+        if owner < 0:
+            return None
+        return owner, int(self.ends[np.searchsorted(self.starts, owner)])
+
+    def callSites(self, func):
+        " Returns sorted list of addresses of BL instructions calling func "
+        func &= ~1
+        a = np.searchsorted(self._dsts, func, 'left')
+        b = np.searchsorted(self._dsts, func, 'right')
+        return sorted(self.callSrc[self._byDst[a:b]].tolist())
+
+    def callers(self, func):
+        " Returns sorted list of starts of functions calling func "
+        func &= ~1
+        a = np.searchsorted(self._dsts, func, 'left')
+        b = np.searchsorted(self._dsts, func, 'right')
+        owners = self.callFrom[self._byDst[a:b]]
+        return np.unique(owners[owners >= 0]).tolist()
+
+    def callees(self, func):
+        " Returns sorted list of functions called by func "
+        func &= ~1
+        return np.unique(self.callDst[self.callFrom == func]).tolist()
+
+    def affected(self, func, depth=None):
+        """
+        Returns dict {caller: distance} of functions which
+        (directly, at distance 1, or through other functions)
+        call func, i.e. which are affected when func is hooked.
+        Depth limits the distance.
+        """
+        func &= ~1
+        ret = {}
+        level = [func]
+        dist = 0
+        while level and (depth is None or dist < depth):
+            dist += 1
+            found = []
+            for f in level:
+                for c in self.callers(f):
+                    if c not in ret and c != func:
+                        ret[c] = dist
+                        found.append(c)
+            level = found
+        return ret
+
+    def toJSON(self):
+        " Returns graph as dict, ready for json.dump "
+        calls = {}
+        for owner, dst in zip(self.callFrom.tolist(), self.callDst.tolist()):
+            if owner >= 0:
+                calls.setdefault(owner, set()).add(dst)
+        return {'functions': [
+            {'start': s, 'end': e, 'calls': sorted(calls.get(s, ()))}
+            for s, e in zip(self.starts.tolist(), self.ends.tolist())]}
+
+    def writeDot(self, f):
+        " Writes graph in Graphviz format to given file "
+        f.write("digraph callgraph {\n")
+        edges = set()
+        for owner, dst in zip(self.callFrom.tolist(), self.callDst.tolist()):
+            if owner >= 0:
+                edges.add((owner, dst))
+        for s in self.starts.tolist():
+            f.write('  "%08X";\n' % s)
+        for owner, dst in sorted(edges):
+            f.write('  "%08X" -> "%08X";\n' % (owner, dst))
+        f.write("}\n")
+
+    def save(self, filename):
+        np.savez_compressed(filename, version=VERSION,
+                            starts=self.starts, ends=self.ends,
+                            callSrc=self.callSrc, callDst=self.callDst)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads graph saved by save().
+        Returns None if it was made by other version of analysis.
+        """
+        with np.load(filename) as f:
+            if int(f['version']) != VERSION:
+                return None
+            return cls(f['starts'], f['ends'], f['callSrc'], f['callDst'])
+
+
+def analyze(data, codebase=0x8004000, cachedir=None):
+    """
+    Builds call graph of given binary loaded at codebase.
+    Result is cached in cachedir (if given) as .npz file
+    named after binary's hash.
+    """
+    filename = None
+    if cachedir is not None:
+        filename = os.path.join(cachedir, '%s-%X.callgraph.npz' % (
+            hashlib.sha1(data).hexdigest(), codebase))
+        if os.path.exists(filename):
+            ret = CallGraph.load(filename)
+            if ret is not None:
+                return ret
+    ret = CallGraph(*_analyze(data, codebase))
+    if filename:
+        ret.save(filename)
+    return ret
@@ -0,0 +1,196 @@
+# This module estimates how many cycles patch blocks take,
+# using Cortex-M3/M4 instruction timings.
+# These are estimates only: wait states of flash and bus contention
+# are not taken into account, and called functions are not counted.
+import json
+from collections import namedtuple
+
+from . import disasm
+from .asm import DCB, ALIGN, LiteralPool
+
+__all__ = ['BlockStats', 'cycles', 'blockStats', 'patchStats', 'writeStats',
+           'loadBaseline', 'saveBaseline', 'regressions']
+
+# pipeline refill after taken branch; 1 to 3 cycles, depending on
+# alignment and width of target instruction
+P = 2
+
+_conds = set(['EQ', 'NE', 'CS', 'CC', 'MI', 'PL', 'VS', 'VC',
+              'HI', 'LS', 'GE', 'LT', 'GT', 'LE'])
+
+# cycles of instructions which are not branches, loads or stores;
+# anything not listed takes 1 cycle
+_timings = {
+    'MLA': 2, 'MLS': 2, 'UMULL': 3, 'SMULL': 3,
+    'UDIV': 7, 'SDIV': 7,  # 2 to 12, depending on operands
+}
+
+BlockStats = namedtuple('BlockStats',
+                        'name size count min max loops')
+BlockStats.__doc__ = """
+Cycle estimates of one block:
+count of instructions, cycles of the shortest and the longest
+path through the block (backward branches are not followed)
+and whether block has such branches, i.e. loops.
+"""
+
+def _base(mnemonic):
+    " Returns mnemonic without width suffix "
+    return mnemonic[:-2] if mnemonic.endswith('.W') else mnemonic
+
+def _isCondBranch(base):
+    return base[0] == 'B' and base[1:] in _conds
+
+def _isLoadStore(base):
+    return base[:3] in ('LDR', 'STR')
+
+def _writesPC(d):
+    " True for POP {...,PC} and LDR PC, ... "
+    base = _base(d.mnemonic)
+    if base == 'POP':
+        return 'PC' in [repr(r) for r in d.operands[0]]
+    return (_isLoadStore(base) and d.operands and
+            repr(d.operands[0]) == 'PC')
+
+def cycles(d, prev=None, taken=False):
+    """
+    Returns cycles for given Decoded instruction.
+    prev is instruction executed before it,
+    as neighbouring loads and stores are pipelined.
+    taken tells whether conditional branch is taken.
+    """
+    base = _base(d.mnemonic)
+    if base in ('B', 'BL', 'BX', 'BLX'):
+        return 1 + P
+    if _isCondBranch(base) or base in ('CBZ', 'CBNZ'):
+        return 1 + P if taken else 1
+    if base in ('PUSH', 'POP'):
+        n = len(d.operands[0])
+        return 1 + n + (P if _writesPC(d) else 0)
+    if _isLoadStore(base):
+        if _writesPC(d):
+            return 2 + P
+        if prev is not None and _isLoadStore(_base(prev.mnemonic)):
+            return 1
+        return 2
+    return _timings.get(base, 1)
+
+def _successors(instrs, n, index):
+    """
+    Returns list of (next index or None for exit, taken) pairs
+    for n'th instruction of block.
+    Backward branches are not followed, so that loops are counted once.
+    """
+    d = instrs[n]
+    base = _base(d.mnemonic)
+    # falling through to data leaves the code we know about
+    following = index.get(d.addr + d.size)
+    inside = index.get(d.target)
+    backward = inside is not None and inside <= n
+    if base in ('B', 'BX') or _writesPC(d):
+        return [(None if backward else inside, True)]
+    if _isCondBranch(base) or base in ('CBZ', 'CBNZ'):
+        if backward:
+            return [(following, False)]
+        return [(following, False), (inside, True)]
+    return [(following, False)]
+
+def _name(block):
+    """
+    Name of block which doesn't change when it is placed elsewhere:
+    its first global label, or its number in patch
+    """
+    for i in block.instructions:
+        if getattr(i, 'glob', False):
+            return i.name
+    return "#%d" % block.patch.blocks.index(block)
+
+def _isData(i):
+    " Literal pools, alignment and DCB/DCW/DCD are not executed "
+    return (isinstance(i, (LiteralPool, DCB, ALIGN)) or
+            i.opcode in ('DCW', 'DCD'))
+
+def blockStats(block):
+    """
+    Estimates cycles for given bound block.
+    Returns BlockStats.
+    """
+    code = block.getCode()
+    instrs = []
+    for i in block.instructions:
+        if _isData(i):
+            continue
+        # decode instruction's own bytes only
+        addr = i.getAddr()
+        end = addr + i.getSize()
+        while end - addr >= 2:
+            off = addr - block.addr
+            hw1 = code[off] | code[off + 1] << 8
+            hw2 = None
+            if end - addr >= 4:
+                hw2 = code[off + 2] | code[off + 3] << 8
+            d = disasm.decode(hw1, hw2, addr)
+            instrs.append(d)
+            addr += d.size
+    if not instrs:
+        return BlockStats(_name(block), len(code), 0, 0, 0, False)
+    index = dict([(d.addr, n) for n, d in enumerate(instrs)])
+    loops = any([d.target is not None and d.target in index and
+                 d.target <= d.addr for d in instrs])
+    # longest and shortest paths to exit, from the end
+    best = [None] * len(instrs)
+    for n in range(len(instrs) - 1, -1, -1):
+        prev = instrs[n - 1] if n else None
+        lo = hi = None
+        for succ, taken in _successors(instrs, n, index):
+            c = cycles(instrs[n], prev, taken)
+            slo, shi = best[succ] if succ is not None else (0, 0)
+            lo = c + slo if lo is None else min(lo, c + slo)
+            hi = c + shi if hi is None else max(hi, c + shi)
+        best[n] = (lo, hi)
+    return BlockStats(_name(block), len(code), len(instrs),
+                      best[0][0], best[0][1], loops)
+
+def patchStats(patches):
+    """
+    Returns dict of patch name -> list of BlockStats
+    for all blocks of given bound patches.
+    """
+    return dict([(p.name, [blockStats(b) for b in p.blocks])
+                 for p in patches if p.blocks])
+
+def writeStats(stats, f, regressed=()):
+    """
+    Writes table of stats to given text file;
+    blocks listed in regressed are marked.
+    """
+    for patch in sorted(stats):
+        f.write("%s:\n" % patch)
+        for s in stats[patch]:
+            f.write("  %-24s %5d bytes %4d instrs %5d-%d cycles%s%s\n" % (
+                s.name, s.size, s.count, s.min, s.max,
+                " (loops)" if s.loops else "",
+                " REGRESSED" if (patch, s.name) in regressed else ""))
+
+def saveBaseline(stats, f):
+    " Stores stats to JSON file to compare with later "
+    json.dump(dict([(patch, dict([(s.name, [s.min, s.max])
+                                  for s in stats[patch]]))
+                    for patch in stats]), f, indent=1, sort_keys=True)
+
+def loadBaseline(f):
+    return json.load(f)
+
+def regressions(stats, baseline):
+    """
+    Returns list of (patch name, block name, old, new) tuples
+    for blocks whose longest path became longer than in baseline.
+    Blocks missing from baseline are not reported.
+    """
+    ret = []
+    for patch in sorted(stats):
+        old = baseline.get(patch, {})
+        for s in stats[patch]:
+            if s.name in old and s.max > old[s.name][1]:
+                ret.append((patch, s.name, old[s.name][1], s.max))
+    return ret
@@ -0,0 +1,627 @@
+# This module disassembles Thumb/Thumb-2 code
+# using the same instruction definitions as asm module.
+#
+# Decoding tables are not written by hand: each definition's encoder
+# is probed with operand values having one bit set,
+# which shows where each operand bit goes in the instruction word.
+# All other bits of the encoding are fixed, which gives (mask, value) pair
+# to match instruction words against.
+
+import hashlib
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from . import asm, thumbimm
+from .asm import Num, Reg, List, RegList, Label, LabelError
+from .block import Block
+from .patch import Patch
+
+__all__ = ['disassemble', 'decode', 'Disassembly', 'Decoded']
+
+# names for register numbers, as they are printed
+_REGNAMES = ['R%d' % r for r in range(13)] + ['SP', 'LR', 'PC']
+
+
+class Decoded(namedtuple('Decoded',
+                         'addr size mnemonic operands target')):
+    """
+    One decoded instruction.
+    Operands are asm argument objects (Reg, Num, List, RegList);
+    label operands are given as Num holding target address.
+    Target is branch/literal target address or None.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        if not self.operands:
+            return self.mnemonic
+        return "%s %s" % (self.mnemonic,
+                          ', '.join([repr(o) for o in self.operands]))
+
+
+class _Field(object):
+    """
+    Operand field of instruction encoding.
+    bits is a list of (value bit, [instruction word bits]);
+    one value bit may be stored in several places (e.g. Rdn),
+    then all of them must be equal.
+    Signed values are either two's complement (signed)
+    or magnitude with separate bits telling it is negative
+    (negmask, negval: e.g. U bit of LDR.W).
+    """
+    __slots__ = ('kind', 'bits', 'width', 'signed', 'align',
+                 'negmask', 'negval')
+
+    def __init__(self, kind):
+        self.kind = kind  # reg, num, imm (ThumbExpandable), reglist, label
+        self.bits = []
+        self.width = 0
+        self.signed = False
+        self.align = False
+        self.negmask = 0
+        self.negval = 0
+
+    def __repr__(self):
+        return "%s%s" % (self.kind, self.bits)
+
+    def probes(self):
+        """
+        Yields (value bit, value, base value) triples
+        for encoder probing.
+        """
+        if self.kind == 'reg':
+            for j in range(4):
+                yield j, 1 << j, 0
+        elif self.kind == 'num':
+            for j in range(32):
+                yield j, 1 << j, 0
+        elif self.kind == 'imm':
+            for j in range(12):
+                # imm12 values 0x100 and 0x200 are unpredictable,
+                # so probe these bits with nonzero imm8
+                if j in (8, 9):
+                    yield j, (1 << j) | 1, 1
+                else:
+                    yield j, 1 << j, 0
+        elif self.kind == 'reglist':
+            for j in range(16):
+                yield j, 1 << j, 0
+        elif self.kind == 'label':
+            for j in range(32):
+                yield j, 1 << j, 0
+
+    def extract(self, key):
+        """
+        Returns value of this field in given instruction word,
+        or None if it is not consistent.
+        """
+        v = 0
+        for j, outs in self.bits:
+            b = (key >> outs[0]) & 1
+            for o in outs[1:]:
+                if (key >> o) & 1 != b:
+                    return None
+            v |= b << j
+        if self.signed and v >> (self.width - 1):
+            v -= 1 << self.width
+        if self.negmask and key & self.negmask == self.negval:
+            v = -v
+        if self.kind == 'imm':
+            try:
+                thumbimm.decode(v)
+            except ValueError:
+                return None
+        return v
+
+    def extractAll(self, keys):
+        """
+        Vectorized version of extract().
+        Returns values array and boolean array of valid ones.
+        """
+        v = np.zeros(len(keys), np.int64)
+        ok = np.ones(len(keys), bool)
+        keys = keys.astype(np.int64)
+        for j, outs in self.bits:
+            b = (keys >> outs[0]) & 1
+            for o in outs[1:]:
+                ok &= ((keys >> o) & 1) == b
+            v |= b << j
+        if self.signed:
+            sign = 1 << (self.width - 1)
+            v = (v ^ sign) - sign
+        if self.negmask:
+            v = np.where((keys & self.negmask) == self.negval, -v, v)
+        if self.kind == 'imm':
+            # see thumbimm.decode
+            ok &= ~(((v >> 10) == 0) & (((v >> 8) & 3) != 0) &
+                    ((v & 0xFF) == 0))
+        return v, ok
+
+
+class _Entry(object):
+    """
+    Decoding table entry, made from one instruction definition,
+    one of its opcodes and one of its argument alternatives.
+    """
+    __slots__ = ('opcode', 'size', 'mask', 'value', 'template', 'fields',
+                 'order')
+
+    def __init__(self, opcode, size, mask, value, template, fields, order):
+        self.opcode = opcode
+        self.size = size
+        self.mask = mask
+        self.value = value
+        self.template = template
+        self.fields = fields
+        self.order = order
+
+    def __repr__(self):
+        return "<%s %d %08X/%08X %s>" % (self.opcode, self.size,
+                                         self.value, self.mask, self.fields)
+
+    def signature(self):
+        return (self.size, self.mask, self.value,
+                repr(self.template), repr(self.fields))
+
+    def operands(self, values, target):
+        def build(template):
+            ret = []
+            for t in template:
+                if isinstance(t, list):
+                    ret.append(List(build(t)))
+                elif isinstance(t, _Field):
+                    ret.append(_operand(t, values[self.fields.index(t)],
+                                        target))
+                else:  # constant
+                    ret.append(t)
+            return ret
+        return build(self.template)
+
+
+def _number(v):
+    return Num(v, ('0x%X' % v) if v > 9 else str(v))
+
+
+def _operand(field, v, target=None):
+    " Returns asm argument object for given field value "
+    if field.kind == 'reg':
+        return Reg(_REGNAMES[v])
+    if field.kind == 'num':
+        return _number(v)
+    if field.kind == 'imm':
+        return _number(thumbimm.decode(v))
+    if field.kind == 'reglist':
+        ret = RegList()
+        for r in range(16):
+            if v & (1 << r):
+                ret.append(_REGNAMES[r], None)
+        return ret
+    if field.kind == 'label':
+        if target is None:  # probing
+            return Label('target')
+        return Num(target, '0x%X' % target)
+    raise ValueError(field.kind)
+
+
+def _variants(args):
+    " Yields argument lists with all alternatives (tuples) resolved "
+    if not args:
+        yield []
+        return
+    head, rest = args[0], args[1:]
+    for h in (head if isinstance(head, tuple) else (head,)):
+        if type(h) is List:
+            heads = [List(v) for v in _variants(list(h))]
+        else:
+            heads = [h]
+        for h1 in heads:
+            for r in _variants(rest):
+                yield [h1] + r
+
+
+def _template(args, fields):
+    """
+    Replaces mask arguments with _Field objects, appending them to fields.
+    Returns None if there are unsupported arguments.
+    """
+    ret = []
+    for a in args:
+        if isinstance(a, RegList):
+            f = _Field('reglist')
+        elif isinstance(a, List):
+            sub = _template(a, fields)
+            if sub is None:
+                return None
+            ret.append(sub)
+            continue
+        elif isinstance(a, Reg):
+            if a.mask is None:  # concrete register, like SP
+                ret.append(a)
+                continue
+            f = _Field('reg')
+        elif isinstance(a, Num.ThumbExpandable):
+            f = _Field('imm')
+        elif isinstance(a, Num):
+            if a.bits is None:  # concrete number
+                ret.append(a)
+                continue
+            f = _Field('num')
+        elif isinstance(a, Label):
+            f = _Field('label')
+        else:
+            return None
+        fields.append(f)
+        ret.append(f)
+    return ret
+
+
+_PROBE_ADDR = 0x8004000
+_probePatch = Patch('#disasm', binary=b'\0')
+
+
+class _Prober(object):
+    " Calls definition encoder with given field values "
+
+    def __init__(self, definition, opcode, template, fields):
+        self.definition = definition
+        self.opcode = opcode
+        self.template = template
+        self.fields = fields
+
+    def encode(self, values, addr=_PROBE_ADDR, target=None):
+        """
+        Returns instruction word for given field values,
+        or None if definition doesn't accept them.
+        For label fields, values are offsets from PC.
+        """
+        d = self.definition
+
+        def build(template):
+            ret = []
+            for t in template:
+                if isinstance(t, list):
+                    ret.append(List(build(t)))
+                elif isinstance(t, _Field):
+                    ret.append(_operand(t, values[self.fields.index(t)]))
+                else:
+                    ret.append(t)
+            return ret
+        try:
+            args = build(self.template)
+        except (ValueError, IndexError):
+            return None
+        if not d.match(self.opcode, args):
+            return None
+        instr = d.instantiate(self.opcode, args, None)
+        block = Block(_probePatch, None, [instr])
+        block.bind(addr, _PROBE_ADDR)
+        if target is None:
+            for f, v in zip(self.fields, values):
+                if f.kind == 'label':
+                    target = addr + 4 + v
+        block.context['target'] = target
+        try:
+            code = d.proc(instr, *instr.args) if callable(d.proc) else d.proc
+        except (LabelError, ValueError):
+            return None
+        if isinstance(code, int) and d.size == 2 and 0 <= code <= 0xFFFF:
+            return code
+        if (isinstance(code, tuple) and d.size == 4 and
+                0 <= code[0] <= 0xFFFF and 0 <= code[1] <= 0xFFFF):
+            return (code[0] << 16) | code[1]
+        return None  # data definitions and alike
+
+
+def _probe(definition, order):
+    " Yields decoding table entries for given instruction definition "
+    if type(definition) is not asm.Instruction or definition.size not in (2, 4):
+        return  # custom classes, e.g. labels and DCB
+    opcodes = ([definition.opcode] if isinstance(definition.opcode, str)
+               else definition.opcode)
+    for args in _variants(definition.args):
+        for opcode in opcodes:
+            fields = []
+            template = _template(args, fields)
+            if template is None:
+                continue
+            prober = _Prober(definition, opcode, template, fields)
+            zeros = [0] * len(fields)
+            base = prober.encode(zeros)
+            if base is None:
+                continue
+            used = 0
+            for n, f in enumerate(fields):
+                for j, val, bval in f.probes():
+                    values = list(zeros)
+                    values[n] = val
+                    code = prober.encode(values)
+                    if code is None:
+                        continue
+                    values[n] = bval
+                    diff = code ^ prober.encode(values)
+                    if not diff:  # e.g. low bits of aligned offset
+                        continue
+                    outs = [o for o in range(32) if diff & (1 << o)]
+                    f.bits.append((j, outs))
+                    f.width = j + 1
+                    used |= diff
+                if f.kind in ('num', 'label'):
+                    values = list(zeros)
+                    values[n] = 4
+                    pos = prober.encode(values)
+                    values[n] = -4
+                    neg = prober.encode(values)
+                    own = sum([1 << o for j, outs in f.bits for o in outs])
+                    if (pos is not None and neg is not None and
+                            pos != neg and not (pos ^ neg) & own):
+                        # only sign changed: magnitude and sign bits
+                        f.negmask = pos ^ neg
+                        f.negval = neg & f.negmask
+                        used |= f.negmask
+                    elif f.kind == 'label':
+                        f.signed = neg is not None
+                if f.kind == 'label':
+                    values = list(zeros)
+                    if f.signed and f.width:
+                        # sign bit may be stored separately,
+                        # out of reach for positive offsets
+                        values[n] = -(1 << (f.width - 1))
+                        code = prober.encode(values)
+                        diff = ((code ^ base) & ~used if code is not None
+                                else 0)
+                        if diff:
+                            f.bits.append((f.width, [o for o in range(32)
+                                                     if diff & (1 << o)]))
+                            f.width += 1
+                            used |= diff
+                    # does it use PC aligned by 4?
+                    values[n] = 8
+                    f.align = (prober.encode(values) ==
+                               prober.encode(values, _PROBE_ADDR + 2,
+                                             _PROBE_ADDR + 4 + 8))
+            full = 0xFFFF if definition.size == 2 else 0xFFFFFFFF
+            mask = full & ~used
+            yield _Entry(opcode, definition.size, mask, base & mask,
+                         template, fields, order)
+
+
+_table = None
+_tableHash = None
+
+
+def _getTable():
+    """
+    Returns decoding table, building it on first call.
+    Entries are ordered by count of fixed bits, most specific first,
+    then by order of definition.
+    For 32-bit instructions, first halfword (which holds opcode and Rn)
+    is compared first, so e.g. LDR.W literal wins over LDR.W [Rn, Rm]
+    for Rn=PC.
+    """
+    global _table, _tableHash
+    if _table is None:
+        entries = []
+        seen = set()
+        for order, d in enumerate(asm._instructions):
+            for e in _probe(d, order):
+                sig = e.signature()
+                if sig not in seen:  # e.g. ADD and ADD.W
+                    seen.add(sig)
+                    entries.append(e)
+        entries.sort(key=lambda e: (-bin(e.mask >> 16).count('1'),
+                                    -bin(e.mask).count('1'), e.order))
+        _table = entries
+        _tableHash = hashlib.sha1(repr(
+            [(e.opcode, e.signature()) for e in entries]
+        ).encode()).hexdigest()
+    return _table
+
+
+def _isPrefix(hw):
+    " Checks whether halfword starts 32-bit instruction "
+    return (hw & 0xF800) >= 0xE800
+
+
+def _target(field, v, addr):
+    pc = addr + 4
+    if field.align:
+        pc &= ~3
+    return pc + v
+
+
+def decode(hw1, hw2=None, addr=0):
+    """
+    Decodes single instruction at given address
+    from its first and (for 32-bit instructions) second halfword.
+    Unknown instructions are returned as DCW.
+    """
+    if _isPrefix(hw1) and hw2 is not None:
+        size, key = 4, (hw1 << 16) | hw2
+    else:
+        size, key = 2, hw1
+    for e in _getTable():
+        if e.size != size or key & e.mask != e.value:
+            continue
+        values = [f.extract(key) for f in e.fields]
+        if None in values:
+            continue
+        target = None
+        for f, v in zip(e.fields, values):
+            if f.kind == 'label':
+                target = _target(f, v, addr)
+        return Decoded(addr, size, e.opcode, e.operands(values, target),
+                       target)
+    return Decoded(addr, size, 'DCW',
+                   [_number(h) for h in ((hw1, hw2) if size == 4 else (hw1,))],
+                   None)
+
+
+class Disassembly(object):
+    """
+    Linear-sweep disassembly of a binary,
+    stored as arrays indexed by instruction number:
+    addr, size, entry (index in decoding table or -1 for unknown),
+    code (instruction word), fields (operand field values)
+    and target (branch or literal target address or -1).
+    """
+
+    def __init__(self, addr, size, entry, code, fields, target):
+        self.addr = addr
+        self.size = size
+        self.entry = entry
+        self.code = code
+        self.fields = fields
+        self.target = target
+
+    def __len__(self):
+        return len(self.addr)
+
+    def __repr__(self):
+        return "<disassembly: %d instructions, %d unknown>" % (
+            len(self), np.count_nonzero(self.entry < 0))
+
+    def __getitem__(self, n):
+        addr = int(self.addr[n])
+        size = int(self.size[n])
+        code = int(self.code[n])
+        if self.entry[n] < 0:
+            hws = (code >> 16, code & 0xFFFF) if size == 4 else (code,)
+            return Decoded(addr, size, 'DCW', [_number(h) for h in hws], None)
+        e = _getTable()[self.entry[n]]
+        target = int(self.target[n]) if self.target[n] >= 0 else None
+        values = [int(v) for v in self.fields[n, :len(e.fields)]]
+        return Decoded(addr, size, e.opcode, e.operands(values, target),
+                       target)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def index(self, addr):
+        " Returns number of instruction which covers given address "
+        n = int(np.searchsorted(self.addr, addr, 'right')) - 1
+        if n < 0 or addr >= self.addr[n] + self.size[n]:
+            raise IndexError("Address out of range: 0x%X" % addr)
+        return n
+
+    def at(self, addr):
+        " Returns instruction which covers given address "
+        return self[self.index(addr)]
+
+    def between(self, start, end):
+        " Returns list of instructions starting in start..end range "
+        a = int(np.searchsorted(self.addr, start))
+        b = int(np.searchsorted(self.addr, end))
+        return [self[n] for n in range(a, b)]
+
+    def refsTo(self, addr):
+        """
+        Returns list of instructions which branch to
+        or load literal from given address.
+        Thumb bit of address is ignored.
+        """
+        found = np.nonzero(self.target == (addr & ~1))[0]
+        return [self[int(n)] for n in found]
+
+    def save(self, filename):
+        np.savez_compressed(filename, table=np.array(_tableHash),
+                            addr=self.addr, size=self.size,
+                            entry=self.entry, code=self.code,
+                            fields=self.fields, target=self.target)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads disassembly saved by save().
+        Returns None if it was made with other decoding table.
+        """
+        _getTable()
+        with np.load(filename) as f:
+            if str(f['table']) != _tableHash:
+                return None
+            return cls(f['addr'], f['size'], f['entry'], f['code'],
+                       f['fields'], f['target'])
+
+
+def _sweep(data, codebase):
+    " Decodes whole binary, returns Disassembly "
+    table = _getTable()
+    hw = np.frombuffer(data, '<u2', len(data) // 2).astype(np.uint32)
+    n = len(hw)
+    prefix = _isPrefix(hw)
+    # Halfword starts an instruction
+    # if count of 32-bit prefixes right before it is even:
+    # each pair is one 32-bit instruction (prefix and its second half),
+    # which is exactly how linear sweep from the start would go.
+    idx = np.arange(n)
+    lastplain = np.maximum.accumulate(np.where(prefix, -1, idx))
+    run = np.zeros(n, np.int64)
+    run[1:] = idx[1:] - 1 - lastplain[:-1]
+    starts = np.nonzero(run % 2 == 0)[0]
+    is32 = prefix[starts] & (starts + 1 < n)
+    code = hw[starts].copy()
+    code[is32] = (code[is32] << 16) | hw[starts[is32] + 1]
+    size = np.where(is32, 4, 2).astype(np.uint8)
+    addr = (starts * 2 + codebase).astype(np.int64)
+
+    count = len(starts)
+    entry = np.full(count, -1, np.int16)
+    nfields = max([len(e.fields) for e in table] + [1])
+    fields = np.zeros((count, nfields), np.int64)
+    target = np.full(count, -1, np.int64)
+    pending = {2: np.nonzero(~is32)[0], 4: np.nonzero(is32)[0]}
+    for num, e in enumerate(table):
+        cand = pending[e.size]
+        if not len(cand):
+            continue
+        keys = code[cand]
+        hit = (keys & e.mask) == e.value
+        sel = cand[hit]
+        if not len(sel):
+            continue
+        ok = np.ones(len(sel), bool)
+        values = []
+        for f in e.fields:
+            v, fok = f.extractAll(code[sel])
+            ok &= fok
+            values.append(v)
+        sel = sel[ok]
+        entry[sel] = num
+        for k, (f, v) in enumerate(zip(e.fields, values)):
+            v = v[ok]
+            fields[sel, k] = v
+            if f.kind == 'label':
+                pc = addr[sel] + 4
+                if f.align:
+                    pc &= ~3
+                target[sel] = pc + v
+        pending[e.size] = np.setdiff1d(cand, sel, assume_unique=True)
+    return Disassembly(addr, size, entry, code, fields, target)
+
+
+_cache = {}
+
+
+def disassemble(data, codebase=0x8004000, cachedir=None):
+    """
+    Disassembles given binary data loaded at codebase.
+    Result is cached in memory by data hash,
+    and in cachedir (if given) as .npz file named after that hash.
+    """
+    key = (hashlib.sha1(data).hexdigest(), codebase)
+    if key in _cache:
+        return _cache[key]
+    filename = None
+    ret = None
+    if cachedir is not None:
+        filename = os.path.join(cachedir, '%s-%X.disasm.npz' % key)
+        if os.path.exists(filename):
+            ret = Disassembly.load(filename)
+    if ret is None:
+        ret = _sweep(data, codebase)
+        if filename:
+            ret.save(filename)
+    _cache[key] = ret
+    return ret
@@ -0,0 +1,405 @@
+# This module executes Thumb code of patched firmware offline,
+# counting cycles and memory accesses.
+# Instructions are decoded with disasm, so it knows (at least)
+# everything patcher can assemble; there is no IT block support.
+from struct import pack, unpack
+
+from . import cycles, disasm
+from .asm import Reg
+
+__all__ = ['EmulatorError', 'Emulator']
+
+_M = 0xFFFFFFFF
+
+class EmulatorError(Exception):
+    """
+    This is raised on unsupported instruction or bad memory access.
+    """
+
+def _signed(x):
+    return x - 0x100000000 if x & 0x80000000 else x
+
+def _addWithCarry(x, y, carry):
+    " Returns result, carry and overflow as ARM ARM defines them "
+    usum = x + y + carry
+    result = usum & _M
+    return (result, usum > _M,
+            _signed(result) != _signed(x) + _signed(y) + carry)
+
+# ops of 16-bit data processing instructions (010000 op Rm Rdn)
+_dp16 = ['AND', 'EOR', 'LSL', 'LSR', 'ASR', 'ADC', 'SBC', 'ROR',
+         'TST', 'RSB', 'CMP', 'CMN', 'ORR', 'MUL', 'BIC', 'MVN']
+_compares = set(['CMP', 'CMN', 'TST', 'TEQ'])
+_extends = set(['UXTB', 'UXTH', 'SXTB', 'SXTH'])
+_moves = set(['MOV', 'MVN']) | _extends
+_dataOps = set(_dp16) | _compares | _moves | set(['ADD', 'SUB'])
+
+_conds = {
+    'EQ': lambda e: e.z, 'NE': lambda e: not e.z,
+    'CS': lambda e: e.c, 'CC': lambda e: not e.c,
+    'MI': lambda e: e.n, 'PL': lambda e: not e.n,
+    'VS': lambda e: e.v, 'VC': lambda e: not e.v,
+    'HI': lambda e: e.c and not e.z, 'LS': lambda e: not e.c or e.z,
+    'GE': lambda e: e.n == e.v, 'LT': lambda e: e.n != e.v,
+    'GT': lambda e: not e.z and e.n == e.v,
+    'LE': lambda e: e.z or e.n != e.v,
+}
+
+_loads = {'LDR': '<I', 'LDRH': '<H', 'LDRB': '<B',
+          'LDRSH': '<h', 'LDRSB': '<b'}
+_stores = {'STR': '<I', 'STRH': '<H', 'STRB': '<B'}
+
+def _setsFlags(hw1, size, operands):
+    " Whether data processing instruction updates flags "
+    if size == 2:
+        # outside IT blocks, all 16-bit ones do
+        # except for high register and SP forms
+        return hw1 & 0xFC00 != 0x4400 and Reg('SP') not in operands
+    # modified immediate and shifted register forms have S bit
+    if hw1 & 0xFA00 == 0xF000 or hw1 & 0xFE00 == 0xEA00:
+        return bool(hw1 & 0x10)
+    return False
+
+
+class Emulator(object):
+    """
+    Thumb-2 emulator with firmware image mapped at codebase (read-only)
+    and RAM at ramBase; stack is at the end of RAM.
+    Functions are called with call();
+    calls to addresses registered with stub() run Python code instead.
+    """
+    # return address for call(); execution stops when it is reached
+    RETURN = 0xFFFFFFFE
+
+    def __init__(self, binary, codebase=0x8004000,
+                 ramBase=0x20000000, ramSize=0x30000):
+        self.regions = []  # (start, end, data, writable)
+        self.mapRegion(codebase, bytes(binary), False)
+        self.ram = self.mapRegion(ramBase, bytearray(ramSize))
+        self.ramBase = ramBase
+        self.stack = ramBase + ramSize
+        self.regs = [0] * 16
+        self.n = self.z = self.c = self.v = False
+        self.stubs = {}
+        self._heap = ramBase
+        self._decoded = {}
+        self.resetCounters()
+
+    def mapRegion(self, start, data, writable=True):
+        """
+        Maps given bytes (or bytearray, if writable) at given address,
+        e.g. for peripherals which code under test accesses.
+        Returns data.
+        """
+        self.regions.append((start, start + len(data), data, writable))
+        return data
+
+    def resetCounters(self):
+        " Resets cycles, steps, reads and writes counters "
+        self.cycles = 0
+        self.steps = 0
+        self.reads = 0
+        self.writes = 0
+
+    def stub(self, addr, func=None):
+        """
+        Makes calls to given address run func(emulator) instead;
+        its result, if not None, is returned in R0.
+        Without func, such calls just return 0.
+        """
+        self.stubs[addr & ~1] = func or (lambda emu: 0)
+
+    def _region(self, addr, size, write=False):
+        for start, end, data, writable in self.regions:
+            if start <= addr and addr + size <= end:
+                if write and not writable:
+                    break
+                return data, addr - start
+        raise EmulatorError("Bad memory %s at %08X from %08X" % (
+            "write" if write else "read", addr, self.regs[15]))
+
+    def read(self, addr, size):
+        " Returns bytes at given address, without counting access "
+        data, off = self._region(addr, size)
+        return bytes(data[off:off + size])
+
+    def write(self, addr, value):
+        " Writes bytes to given address, without counting access "
+        data, off = self._region(addr, len(value), True)
+        data[off:off + len(value)] = value
+
+    def alloc(self, value):
+        """
+        Stores given bytes (str is stored as zero-terminated utf-8)
+        in RAM below stack and returns their address.
+        Memory is freed with free().
+        """
+        if isinstance(value, str):
+            value = value.encode('utf-8') + b'\0'
+        addr = self._heap
+        self._heap += (len(value) + 3) & ~3
+        self.write(addr, value)
+        return addr
+
+    def free(self):
+        " Frees everything allocated with alloc() "
+        self._heap = self.ramBase
+
+    def _load(self, addr, fmt):
+        self.reads += 1
+        size = {'I': 4, 'H': 2, 'h': 2}.get(fmt[1], 1)
+        data, off = self._region(addr, size)
+        return unpack(fmt, bytes(data[off:off + size]))[0] & _M
+
+    def _store(self, addr, fmt, value):
+        self.writes += 1
+        mask = {'I': _M, 'H': 0xFFFF}.get(fmt[1], 0xFF)
+        self.write(addr, pack(fmt, value & mask))
+
+    def _decode(self, addr):
+        d = self._decoded.get(addr)
+        if d is None:
+            hw1 = unpack('<H', self.read(addr, 2))[0]
+            hw2 = None
+            if hw1 >> 11 in (0b11101, 0b11110, 0b11111):
+                hw2 = unpack('<H', self.read(addr + 2, 2))[0]
+            d = (disasm.decode(hw1, hw2, addr), hw1)
+            if not isinstance(self._region(addr, d[0].size)[0], bytearray):
+                self._decoded[addr] = d  # only cache read-only code
+        return d
+
+    def _get(self, r):
+        " Returns value of register, or of number as is "
+        if not isinstance(r, Reg):
+            return int(r) & _M
+        if r == 15:
+            return (self._pc + 4) & _M
+        return self.regs[r]
+
+    def call(self, addr, *args, maxSteps=10 ** 6):
+        """
+        Calls function at given address (with or without thumb bit)
+        with up to 4 arguments in R0-R3;
+        str and bytes arguments are stored with alloc().
+        maxSteps (default 10**6) limits instruction count.
+        Returns R0. Counters are not reset between calls.
+        """
+        if len(args) > 4:
+            raise EmulatorError("Only 4 arguments are supported")
+        for n, a in enumerate(args):
+            if isinstance(a, (str, bytes)):
+                a = self.alloc(a)
+            self.regs[n] = a & _M
+        self.regs[13] = self.stack
+        self.regs[14] = self.RETURN | 1
+        self.regs[15] = addr & ~1
+        steps = 0
+        prev = None
+        while self.regs[15] != self.RETURN:
+            if steps >= maxSteps:
+                raise EmulatorError("Too many steps, stopped at %08X" %
+                                    self.regs[15])
+            prev = self.step(prev)
+            steps += 1
+        return self.regs[0]
+
+    def step(self, prev=None):
+        """
+        Executes one instruction.
+        prev is previously executed instruction, for cycle counting.
+        Returns executed instruction (as disasm.Decoded).
+        """
+        self._pc = pc = self.regs[15]
+        d, hw1 = self._decode(pc)
+        self.regs[15] = pc + d.size
+        taken = self._execute(d, hw1)
+        self.cycles += cycles.cycles(d, prev, taken)
+        self.steps += 1
+        return d
+
+    def _branch(self, addr):
+        self.regs[15] = addr & ~1 & _M
+
+    def _call(self, addr):
+        self.regs[14] = self.regs[15] | 1
+        func = self.stubs.get(addr & ~1)
+        if func is None:
+            self._branch(addr)
+            return
+        ret = func(self)
+        if ret is not None:
+            self.regs[0] = ret & _M
+
+    def _execute(self, d, hw1):
+        " Returns True for taken branches "
+        base = d.mnemonic[:-2] if d.mnemonic.endswith('.W') else d.mnemonic
+        ops = d.operands
+        if base in ('B', 'BL') or base[0] == 'B' and base[1:] in _conds:
+            if base == 'BL':
+                self._call(d.target)
+            elif base == 'B' or _conds[base[1:]](self):
+                self._branch(d.target)
+            else:
+                return False
+            return True
+        if base in ('BX', 'BLX'):
+            if base == 'BLX':
+                self._call(self._get(ops[0]))
+            else:
+                self._branch(self._get(ops[0]))
+            return True
+        if base in ('CBZ', 'CBNZ'):
+            if (self._get(ops[0]) == 0) == (base == 'CBZ'):
+                self._branch(d.target)
+                return True
+            return False
+        if base == 'NOP':
+            return False
+        if base == 'ADR':
+            self.regs[ops[0]] = d.target
+            return False
+        if base in ('PUSH', 'POP'):
+            return self._pushPop(base, ops[0])
+        if base in _loads or base in _stores:
+            return self._loadStore(base, ops)
+        if hw1 >> 10 == 0b010000 and d.size == 2:
+            # take op from encoding
+            op = _dp16[(hw1 >> 6) & 0xF]
+            rdn, rm = Reg('R%d' % (hw1 & 7)), Reg('R%d' % ((hw1 >> 3) & 7))
+            if op in _compares or op == 'MVN':
+                ops = [rdn, rm]
+            else:
+                ops = {'RSB': [rdn, rm, 0],
+                       'MUL': [rdn, rm, rdn]}.get(op, [rdn, rdn, rm])
+        else:
+            op = base[:-1] if base[-1] == 'S' and base[:-1] in _dataOps \
+                else base
+        if op not in _dataOps:
+            raise EmulatorError("Unsupported instruction at %08X: %s" %
+                                (d.addr, d))
+        self._dataOp(op, ops, op not in _extends and
+                     _setsFlags(hw1, d.size, ops))
+        return False
+
+    def _dataOp(self, op, ops, setflags):
+        carry, overflow = self.c, self.v
+        if op in _compares:
+            a, b = self._get(ops[0]), self._get(ops[1])
+        elif op in _moves:
+            a = b = self._get(ops[1])
+        elif len(ops) == 2:
+            a, b = self._get(ops[0]), self._get(ops[1])
+        else:
+            a, b = self._get(ops[1]), self._get(ops[2])
+        if op in ('ADD', 'CMN'):
+            result, carry, overflow = _addWithCarry(a, b, 0)
+        elif op in ('SUB', 'CMP'):
+            result, carry, overflow = _addWithCarry(a, ~b & _M, 1)
+        elif op == 'RSB':
+            result, carry, overflow = _addWithCarry(~a & _M, b, 1)
+        elif op == 'ADC':
+            result, carry, overflow = _addWithCarry(a, b, self.c)
+        elif op == 'SBC':
+            result, carry, overflow = _addWithCarry(a, ~b & _M, self.c)
+        elif op in ('AND', 'TST'):
+            result = a & b
+        elif op in ('EOR', 'TEQ'):
+            result = a ^ b
+        elif op == 'ORR':
+            result = a | b
+        elif op == 'BIC':
+            result = a & ~b & _M
+        elif op == 'MOV':
+            result = b
+        elif op == 'MVN':
+            result = ~b & _M
+        elif op == 'MUL':
+            result = (a * b) & _M
+        elif op in ('UXTB', 'UXTH'):
+            result = b & (0xFF if op == 'UXTB' else 0xFFFF)
+        elif op in ('SXTB', 'SXTH'):
+            bits = 8 if op == 'SXTB' else 16
+            result = b & ((1 << bits) - 1)
+            if result >> (bits - 1):
+                result = (result - (1 << bits)) & _M
+        else:  # shifts
+            n = b & 0xFF
+            if n == 0:
+                result = a
+            elif op == 'LSL':
+                result = (a << n) & _M
+                carry = n <= 32 and bool((a >> (32 - n)) & 1)
+            elif op == 'LSR':
+                result = a >> n if n < 32 else 0
+                carry = n <= 32 and bool((a >> (n - 1)) & 1)
+            elif op == 'ASR':
+                result = (_signed(a) >> min(n, 32)) & _M
+                carry = bool((_signed(a) >> min(n - 1, 31)) & 1)
+            else:  # ROR
+                n %= 32
+                result = ((a >> n) | (a << (32 - n))) & _M
+                carry = bool(result >> 31)
+        if setflags or op in _compares:
+            self.n = bool(result >> 31)
+            self.z = result == 0
+            self.c, self.v = carry, overflow
+        if op not in _compares:
+            if ops[0] == 15:
+                self._branch(result)
+            else:
+                self.regs[ops[0]] = result
+
+    def _address(self, mem):
+        " Returns address for memory operand: [Rn, offset, shift] or number "
+        if not isinstance(mem, list):
+            return int(mem)  # literal, resolved by decoder
+        addr = self._get(mem[0])
+        if mem[0] == 15:
+            addr &= ~3
+        if len(mem) > 1:
+            off = self._get(mem[1]) if isinstance(mem[1], Reg) else int(mem[1])
+            if len(mem) > 2:
+                off <<= int(mem[2])
+            addr += off
+        return addr & _M
+
+    def _loadStore(self, base, ops):
+        addr = self._address(ops[1])
+        if base in _stores:
+            self._store(addr, _stores[base], self._get(ops[0]))
+            self._writeback(addr, ops)
+            return False
+        value = self._load(addr, _loads[base])
+        self._writeback(addr, ops)
+        if ops[0] == 15:
+            self._branch(value)
+            return True
+        self.regs[ops[0]] = value
+        return False
+
+    def _writeback(self, addr, ops):
+        " Post-indexed [Rn], offset: adds offset to Rn after access "
+        if len(ops) > 2:
+            self.regs[ops[1][0]] = (addr + int(ops[2])) & _M
+
+    def _pushPop(self, base, regs):
+        regs = sorted(regs)
+        sp = self.regs[13]
+        if base == 'PUSH':
+            sp -= 4 * len(regs)
+            self.regs[13] = sp
+            for r in regs:
+                self._store(sp, '<I', self.regs[r])
+                sp += 4
+            return False
+        taken = False
+        for r in regs:
+            value = self._load(sp, '<I')
+            sp += 4
+            if r == 15:
+                self._branch(value)
+                taken = True
+            else:
+                self.regs[r] = value
+        self.regs[13] = sp
+        return taken
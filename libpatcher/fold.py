@@ -0,0 +1,119 @@
+# This module merges identical floating blocks
+# (identical code folding, as linkers do it).
+from .asm import Label, LiteralLabel, LabelInstruction, LiteralPool
+
+__all__ = ['foldIdentical']
+
+def _isGlobalLabel(i):
+    return isinstance(i, LabelInstruction) and i.glob
+
+def _globals(patches):
+    """
+    Returns dict (patch, name) -> (block, n) for global labels,
+    where n is count of other instructions before the label.
+    """
+    ret = {}
+    for p in patches:
+        for block in p.blocks:
+            n = 0
+            for i in block.instructions:
+                if _isGlobalLabel(i):
+                    ret[(i.owner or p, i.name)] = (block, n)
+                else:
+                    n += 1
+    return ret
+
+def _key(block, globs):
+    """
+    Returns hashable description of block contents
+    which is equal for blocks producing the same code
+    when placed at the same address.
+    Global labels defined by block are not included,
+    and referenced ones are described by their location.
+    """
+    local = {}
+    for n, i in enumerate(block.instructions):
+        if isinstance(i, LabelInstruction) and not i.glob:
+            local[i.name] = n
+
+    def arg(a):
+        if isinstance(a, LiteralLabel):
+            return ('=', arg(a.value))
+        if isinstance(a, Label):
+            if a.name in local:
+                return ('local', local[a.name], a.shift)
+            for p in (block.patch, block.patch.library):
+                if (p, a.name) in globs:
+                    return ('global', globs[(p, a.name)], a.shift)
+            return ('undefined', block.patch, a.name)
+        if isinstance(a, list):
+            return tuple([arg(x) for x in a])
+        return (type(a).__name__, repr(a))
+
+    ret = []
+    for i in block.instructions:
+        if _isGlobalLabel(i):
+            continue
+        if isinstance(i, LabelInstruction):
+            ret.append(('label',))
+        elif isinstance(i, LiteralPool):
+            ret.append(('pool', tuple([arg(e.value) for e in i.entries])))
+        else:
+            ret.append((type(i).__name__, i.opcode, i.original,
+                        arg(i.args or [])))
+    return tuple(ret)
+
+def _merge(kept, dup):
+    """
+    Moves global labels of dup block to corresponding places of kept block,
+    so that they keep belonging to dup's patch.
+    """
+    moved = []
+    n = 0
+    for i in dup.instructions:
+        if _isGlobalLabel(i):
+            i.owner = i.owner or dup.patch
+            moved.append((n, i))
+        else:
+            n += 1
+    instrs = []
+    n = 0
+    for i in kept.instructions:
+        if not _isGlobalLabel(i):
+            while moved and moved[0][0] == n:
+                instrs.append(moved.pop(0)[1])
+            n += 1
+        instrs.append(i)
+    instrs.extend([i for n, i in moved])
+    kept.instructions[:] = instrs
+
+def foldIdentical(patches):
+    """
+    Finds floating blocks with identical contents,
+    keeps only the first one of each group and moves labels
+    of the others to it, so that they are placed once.
+    Blocks which differ only in references to already folded blocks
+    are folded too.
+    Should be called on unbound patches, library first.
+    Returns list of (kept, removed) block pairs.
+    """
+    folded = []
+    while True:
+        globs = _globals(patches)
+        seen = {}
+        pairs = []
+        for p in patches:
+            for block in p.blocks:
+                if not block.mask or not block.mask.floating:
+                    continue
+                key = _key(block, globs)
+                if key in seen:
+                    pairs.append((seen[key], block))
+                else:
+                    seen[key] = block
+        if not pairs:
+            return folded
+        for kept, dup in pairs:
+            _merge(kept, dup)
+            dup.patch.blocks.remove(dup)
+        folded.extend(pairs)
@@ -0,0 +1,47 @@
+# This module lays patches out in binary,
+# choosing instruction encodings as it goes.
+from .asm import LabelError, OffsetError
+from .symbols import SymbolTable
+
+__all__ = ['layout']
+
+def layout(patches, binary, ranges, codebase=0x8004000):
+    """
+    Binds all blocks of given patches (library should go first)
+    to addresses in binary, like bindall() does.
+    Each instruction starts with its shortest encoding;
+    those which cannot reach their labels are widened,
+    and all patches are bound again, until nothing changes.
+    As instructions only grow, this always ends.
+    Labels are resolved with SymbolTable on each pass,
+    which raises SymbolError for duplicate or undefined ones.
+    Returns count of passes made.
+    """
+    state = ranges.save()
+    passes = 0
+    while True:
+        passes += 1
+        # blocks with preferred positions go first,
+        # before other blocks take their space
+        for p in patches:
+            for block in p.blocks:
+                block.reserve(ranges, codebase)
+        for p in patches:
+            p.bindall(binary, ranges, codebase)
+        SymbolTable(patches).resolve()
+        widened = False
+        for p in patches:
+            for block in p.blocks:
+                for i in block.instructions:
+                    try:
+                        i.getCode()
+                    except OffsetError:
+                        if i.widen():
+                            widened = True
+                    except LabelError:
+                        pass # will be reported by apply()
+        if not widened:
+            return passes
+        ranges.restore(state)
+        for p in patches:
+            p.unbind()
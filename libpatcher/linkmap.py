@@ -0,0 +1,104 @@
+# This module writes and reads linker map:
+# where each block and global label was placed.
+import json
+from hashlib import sha1
+
+from .asm import Label, LabelInstruction
+
+__all__ = ['blockHash', 'makeMap', 'writeMap', 'loadMap', 'reuseMap']
+
+def _describe(arg):
+    " repr of argument which includes shift of labels (e.g. DCD f+1) "
+    if isinstance(arg, Label):
+        return "%r%+d" % (arg, arg.shift)
+    if isinstance(arg, list):
+        return "%s[%s]" % (type(arg).__name__,
+                           ', '.join([_describe(a) for a in arg]))
+    return repr(arg)
+
+def blockHash(block):
+    """
+    Returns hash of block's contents, which doesn't depend
+    on its placement and on positions in patch file.
+    """
+    h = sha1()
+    for i in block.instructions:
+        if i.opcode is None:  # labels, pools
+            desc = repr(i)
+        else:
+            desc = "%s %s" % (i.opcode, _describe(i.args))
+        h.update(desc.encode('utf-8') + b'\n')
+    return h.hexdigest()
+
+def _source(block):
+    if not block.mask.floating:
+        return 'mask'
+    if block.preferred is not None and block.position == block.preferred:
+        return 'map'
+    return 'ranges'
+
+def makeMap(patches, codebase=0x8004000):
+    """
+    Returns map of bound patches as a dict
+    with list of blocks and list of global symbols.
+    """
+    blocks = []
+    symbols = []
+    for p in patches:
+        for block in p.blocks:
+            blocks.append({
+                'patch': p.name,
+                'mask': repr(block.mask),
+                'addr': block.addr,
+                'size': block.getSize(),
+                'source': _source(block),
+                'hash': blockHash(block),
+            })
+            for i in block.instructions:
+                if isinstance(i, LabelInstruction) and i.glob:
+                    symbols.append({
+                        'patch': (i.owner or p).name,
+                        'name': i.name,
+                        'addr': i.getAddr(),
+                    })
+    return {'codebase': codebase, 'blocks': blocks, 'symbols': symbols}
+
+def writeMap(linkmap, f):
+    """
+    Writes human-readable form of map to given text file.
+    """
+    f.write("Blocks:\n")
+    f.write("%-8s %6s %-6s %s\n" % ("Address", "Size", "Source", "Patch"))
+    for b in sorted(linkmap['blocks'], key=lambda b: b['addr']):
+        f.write("%08X %6X %-6s %s: %s\n" % (
+            b['addr'], b['size'], b['source'], b['patch'], b['mask']))
+    f.write("\nSymbols:\n")
+    for s in sorted(linkmap['symbols'], key=lambda s: s['addr']):
+        f.write("%08X %s (%s)\n" % (s['addr'], s['name'], s['patch']))
+
+def loadMap(f):
+    " Reads map previously saved as JSON "
+    return json.load(f)
+
+def reuseMap(patches, linkmap):
+    """
+    Sets preferred position for floating blocks of given unbound patches
+    which have not changed since given map was made,
+    so that layout() will place them at the same addresses.
+    Returns count of such blocks.
+    """
+    placed = {}  # (patch, hash) -> positions
+    for b in linkmap['blocks']:
+        if b['source'] != 'mask':
+            placed.setdefault((b['patch'], b['hash']), []).append(
+                b['addr'] - linkmap['codebase'])
+    count = 0
+    for p in patches:
+        for block in p.blocks:
+            if not block.mask.floating:
+                continue
+            positions = placed.get((p.name, blockHash(block)))
+            if positions:
+                block.preferred = positions.pop(0)
+                count += 1
+    return count
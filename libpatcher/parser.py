@@ -1,14 +1,21 @@
 # This is a parser for assembler listings (?)
 
+import sys
+from bisect import bisect_left
+
 from . import asm
 from .mask import Mask
 from .block import Block
 from .patch import Patch
 
-__all__ = ['parseFile', 'ParseError', 'FilePos']
+__all__ = ['parseFile', 'parseFiles', 'iterBlocks',
+           'ParseError', 'ParseErrors', 'FilePos']
 
 class FilePos:
     " This holds current line info (filename, line text, line number) "
+    # every instruction holds a clone, so keep them small
+    __slots__ = ('filename', 'lnum', 'line')
+
     def __init__(self, filename, lnum=-1, line=''):
         self.filename = filename
         self.lnum = lnum
@@ -34,14 +41,64 @@ class FilePos:
     def __str__(self):
         return "%s, line %s" % (self.filename, self.lnum+1)
 
+class SourceFile(object):
+    """
+    This holds lines of patch file being parsed,
+    along with index of its #command lines.
+    The latter allows to skip disabled #ifdef regions
+    without looking at their contents.
+    Iterating over it yields (lnum, line) tuples.
+    """
+    def __init__(self, f):
+        self.name = f.name
+        self.lines = f.readlines()
+        # only #commands can change if_state, so remember where they are
+        self.directives = [lnum for lnum, line in enumerate(self.lines)
+                           if line.lstrip().startswith('#')]
+        self.lnum = 0  # next line to be read
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        lnum = self.lnum
+        if lnum >= len(self.lines):
+            raise StopIteration
+        self.lnum += 1
+        return lnum, self.lines[lnum]
+
+    def skipToDirective(self):
+        " Moves to the next #command line, or to EOF if there are no more "
+        idx = bisect_left(self.directives, self.lnum)
+        if idx < len(self.directives):
+            self.lnum = self.directives[idx]
+        else:
+            self.lnum = len(self.lines)
+
 class ParseError(Exception):
     def __init__(self, msg, pos):
+        # pass args to base class to keep this exception picklable
+        super(ParseError, self).__init__(msg, pos)
         self.msg = msg
         self.pos = pos
 
     def __str__(self):
         return "%s: %s\n%s" % (str(self.pos), self.msg, self.pos.getLine())
 
+class ParseErrors(ParseError):
+    " This holds all errors found while parsing "
+    def __init__(self, errors):
+        super(ParseErrors, self).__init__(
+            "%d error(s)" % len(errors), errors[0].pos)
+        self.errors = errors
+
+    def __reduce__(self):
+        return (ParseErrors, (self.errors,))
+
+    def __str__(self):
+        return "%d parse error(s):\n%s" % (
+            len(self.errors), '\n'.join([str(e) for e in self.errors]))
+
 def uncomment(line):
     """ Removes comment, if any, from line. Also strips line """
     linewoc = ''  # line without comment
@@ -68,6 +125,7 @@ def parseInstruction(line, pos):
     except ValueError:  # only one token
         opcode = line
         arg = ''
+    opcode = sys.intern(opcode)  # to be shared by all such instructions
 
     # now parse args
     args = asm.List()
@@ -146,7 +204,7 @@ def parseInstruction(line, pos):
                     if asm.Reg.is_reg(s):
                         a = asm.Reg(s)
                     else:
-                        a = asm.Label(s)
+                        a = asm.Label(sys.intern(s))
                     args.append(a)
                 s = ''
                 t = None
@@ -196,6 +254,8 @@ def parseInstruction(line, pos):
                 gargs.append(args)
                 args = gargs
                 br = False
+            elif c == '=':  # literal, as in LDR R0, =value
+                args.append(asm.Literal())
             elif c == '{':
                 if rl:
                     raise ParseError("Already in register list", pos)
@@ -216,6 +276,13 @@ def parseInstruction(line, pos):
         raise ParseError("Unterminated string? %c" % t, pos)
     if br:
         raise ParseError("Unmatched '['", pos)
+    # attach values to literals
+    for n, a in enumerate(args):
+        if isinstance(a, asm.Literal):
+            if (n + 1 >= len(args) or
+                    not isinstance(args[n + 1], (asm.Num, asm.Label))):
+                raise ParseError("Number or label expected after '='", pos)
+            a.value = args.pop(n + 1)
 
     try:
         return asm.findInstruction(opcode, args, pos)
@@ -223,10 +290,92 @@ def parseInstruction(line, pos):
         raise ParseError("Unknown instruction: %s %s" %
                          (opcode, ','.join([repr(x) for x in args])), pos)
 
-def parseBlock(f, pos, definitions, if_state, patch):
+def parseDirective(line, pos, definitions, if_state, include):
+    """
+    Handles one #command line (already uncommented).
+    Updates definitions and if_state;
+    for #include, calls include() with path to the included file.
+    """
+    tokens = line.split()
+    cmd, args = tokens[0], tokens[1:]
+    # these will not depend on if_state...
+    if cmd in ["#ifdef", "#ifndef", "#ifval", "#ifnval"]:
+        if not args:
+            raise ParseError("%s requires at least one argument" % cmd,
+                             pos)
+        newstate = 'n' in cmd  # False for 'ifdef', etc.
+        if "val" in cmd:
+            vals = list(definitions.values())
+        # "OR" logic, as one can implement "AND" with nested #ifdef's
+        # so any matched arg stops checking
+        for a in args:
+            if(("def" in cmd and a in definitions) or
+               ("val" in cmd and a in vals)):
+                newstate = not newstate
+                break
+        if_state.append(newstate)
+        return
+    elif cmd == "#else":
+        if len(if_state) <= 1:
+            raise ParseError("Unexpected #else", pos)
+        if_state[-1] = not if_state[-1]
+        return
+    elif cmd == "#endif":
+        if len(if_state) <= 1:
+            raise ParseError("Unmatched #endif", pos)
+        if_state.pop()  # remove latest state
+        return
+    elif cmd == "#ver":  # desired FW version
+        # FIXME: don't bail out on invalid values, just warn
+        if not args:
+            raise ParseError(
+                "At least one argument required for #ver", pos)
+        lo = int(args[0])
+        if args[1:]:
+            hi = int(args[1])
+        else:
+            hi = 65535  # max version
+        # for now just store that version as a variable
+        definitions['ver'] = str(lo)
+        # TODO: perform some tests for this patch version
+        return
+    # ...now check if_state...
+    if False in if_state:
+        return  # #define must only work if this is met
+    # ...and following will depend on it
+    if cmd in ["#define", "#default"]:
+        # default is like define but will not override already set value
+        if not args:
+            raise ParseError(
+                "At least one argument required for #define", pos)
+        name = args[0]
+        val = True
+        if args[1:]:
+            val = line.split(None, 2)[2]  # remaining args as string
+        # always set for #define,
+        # and only if unset / just True if #default
+        if cmd == "#define" \
+                or name not in definitions \
+                or definitions[name] == True:
+            definitions[name] = val
+    elif cmd == "#include":
+        if not args:
+            raise ParseError("#include requires an argument", pos)
+        arg = line.split(None, 1)[1]  # all args as a string
+        import os.path
+        if not os.path.isabs(arg):
+            arg = os.path.join(os.path.dirname(pos.filename), arg)
+        include(arg)
+    else:
+        raise ParseError("Unknown command: %s" % cmd, pos)
+
+def parseBlock(src, pos, definitions, if_state, patch, errors=None):
     """
-    Parses one mask from patch file.
-    Returns results (mask and block contents) as tuple
+    Parses one mask with its block from patch file (given as SourceFile).
+    Returns Block, or None on end of file.
+    If errors list is provided, ParseErrors are appended to it
+    instead of being raised; in such case False is returned
+    for a block which contained errors.
     """
 
     # mask's starting position
@@ -243,207 +392,199 @@ def parseBlock(f, pos, definitions, if_state, patch):
     # and to be used when in block:
     instructions = None
 
-    for lnum, line in enumerate(f, pos.getLnum()+1):
+    # error recovery state: whether this block had errors,
+    # and whether we are skipping the rest of it
+    broken = False
+    skipping = False
+
+    def include(path):
+        # parse this file into this patch's library patch.
+        # If this is already library patch,
+        # its library property will return itself.
+        with open(path, 'r') as newf:
+            parseFile(newf, definitions, patch=patch.library, errors=errors)
+
+    for lnum, line in src:
         pos.setLine(lnum, line.strip())
         line = uncomment(line)
         if not line:  # skip empty lines
             continue
 
-        if line[0] == '#':
-            tokens = line.split()
-            cmd, args = tokens[0], tokens[1:]
-            # these will not depend on if_state...
-            if cmd in ["#ifdef", "#ifndef", "#ifval", "#ifnval"]:
-                if not args:
-                    raise ParseError("%s requires at least one argument" % cmd,
-                                     pos)
-                newstate = 'n' in cmd  # False for 'ifdef', etc.
-                if "val" in cmd:
-                    vals = list(definitions.values())
-                # "OR" logic, as one can implement "AND" with nested #ifdef's
-                # so any matched arg stops checking
-                for a in args:
-                    if(("def" in cmd and a in definitions) or
-                       ("val" in cmd and a in vals)):
-                        newstate = not newstate
-                        break
-                if_state.append(newstate)
-                continue
-            elif cmd == "#else":
-                if len(if_state) <= 1:
-                    raise ParseError("Unexpected #else", pos)
-                if_state[-1] = not if_state[-1]
-                continue
-            elif cmd == "#endif":
-                if_state.pop()  # remove latest state
-                if not if_state:
-                    raise ParseError("Unmatched #endif", pos)
-                continue
-            elif cmd == "#ver":  # desired FW version
-                # FIXME: don't bail out on invalid values, just warn
-                if not args:
-                    raise ParseError(
-                        "At least one argument required for #ver", pos)
-                lo = int(args[0])
-                if args[1:]:
-                    hi = int(args[1])
-                else:
-                    hi = 65535  # max version
-                # for now just store that version as a variable
-                definitions['ver'] = str(lo)
-                # TODO: perform some tests for this patch version
-                continue
-            # ...now check if_state...
+        try:
+            if line[0] == '#':
+                parseDirective(line, pos, definitions, if_state, include)
+                if False in if_state:
+                    # nothing but #commands matter until condition is met
+                    src.skipToDirective()
+                continue  # to next line
+
+            # and now for non-# lines
             if False in if_state:
-                continue  # #define must only work if this is met
-            # ...and following will depend on it
-            if cmd in ["#define", "#default"]:
-                # default is like define but will not override already set value
-                if not args:
-                    raise ParseError(
-                        "At least one argument required for #define", pos)
-                name = args[0]
-                val = True
-                if args[1:]:
-                    val = line.split(None, 2)[2]  # remaining args as string
-                # always set for #define,
-                # and only if unset / just True if #default
-                if cmd == "#define" \
-                        or name not in definitions \
-                        or definitions[name] == True:
-                    definitions[name] = val
-            elif cmd == "#include":
-                if not args:
-                    raise ParseError("#include requires an argument", pos)
-                arg = line.split(None, 1)[1]  # all args as a string
-                import os.path
-                if not os.path.isabs(arg):
-                    arg = os.path.join(os.path.dirname(f.name), arg)
-                newf = open(arg, 'r')
-                # parse this file into this patch's library patch.
-                # If this is already library patch,
-                # its library property will return itself.
-                parseFile(newf, definitions, patch=patch.library)
-            else:
-                raise ParseError("Unknown command: %s" % cmd, pos)
-            continue  # to next line
-
-        # and now for non-# lines
-        if False in if_state:
-            continue  # skip any code if current condition is not met
-
-        # process ${definitions} everywhere
-        for d, v in definitions.items():
-            if isinstance(v, str) and '${'+d+'}' in line:
-                line = line.replace('${'+d+'}', v)
-
-        if instructions is None:  # not in block, reading mask
-            # read mask: it consists of 00 f7 items, ? ?4 items, and "strings"
-            tokens = line.split('"')
-            if len(tokens) % 2 == 0:
-                raise ParseError("Unterminated string", pos)
-            if not mpos:
-                mpos = pos.clone()  # save starting position of mask
-            is_str = False
-            for tokennum, token in enumerate(tokens):
-                if is_str:
-                    if bskip:
-                        mask.append(bskip)
-                        bskip = 0
-                    bstr += token.encode()
-                else:
-                    # process $definitions only outside of "strings" and
-                    # outside of {blocks}
-                    # FIXME: $definitions inside of {blocks} [and in "strings"?]
-                    for d, v in list(definitions.items()):
-                        if isinstance(v, str) and '$'+d in token:
-                            # ^^ FIXME: $var and $variable
-                            token = token.replace('$'+d, v)
-
-                    ts = token.split()
-                    for t in ts:
-                        if len(t) == 2 and t.isalnum():
-                            if bskip:
-                                mask.append(bskip)
-                                bskip = 0
-                            try:
-                                # convert '65' to b'A'
-                                c = bytes(bytearray([int(t, 16)]))
-                            except ValueError:
-                                raise ParseError("Bad token: %s" % t, pos)
-                            bstr += c
-                        elif t[0] == '?':
-                            if len(t) == 1:
-                                count = 1
-                            else:
+                continue  # skip any code if current condition is not met
+
+            if skipping:
+                # recovering from broken mask: wait for end of its block
+                if line.startswith('}'):
+                    return False
+                continue
+
+            # process ${definitions} everywhere
+            for d, v in definitions.items():
+                if isinstance(v, str) and '${'+d+'}' in line:
+                    line = line.replace('${'+d+'}', v)
+
+            if instructions is None:  # not in block, reading mask
+                # read mask: it consists of 00 f7 items, ? ?4 items, and "strings"
+                tokens = line.split('"')
+                if len(tokens) % 2 == 0:
+                    raise ParseError("Unterminated string", pos)
+                if not mpos:
+                    mpos = pos.clone()  # save starting position of mask
+                is_str = False
+                for tokennum, token in enumerate(tokens):
+                    if is_str:
+                        if bskip:
+                            mask.append(bskip)
+                            bskip = 0
+                        bstr += token.encode()
+                    else:
+                        # process $definitions only outside of "strings" and
+                        # outside of {blocks}
+                        # FIXME: $definitions inside of {blocks} [and in "strings"?]
+                        for d, v in list(definitions.items()):
+                            if isinstance(v, str) and '$'+d in token:
+                                # ^^ FIXME: $var and $variable
+                                token = token.replace('$'+d, v)
+
+                        ts = token.split()
+                        for t in ts:
+                            if len(t) == 2 and t.isalnum():
+                                if bskip:
+                                    mask.append(bskip)
+                                    bskip = 0
                                 try:
-                                    count = int(t[1:])
+                                    # convert '65' to b'A'
+                                    c = bytes(bytearray([int(t, 16)]))
                                 except ValueError:
                                     raise ParseError("Bad token: %s" % t, pos)
-                            if bstr:
-                                mask.append(bstr)
-                                bstr = b''
-                            bskip += count
-                        elif t == '@':
-                            if mofs:
-                                raise ParseError("Duplicate '@'", pos)
-                            mofs = sum([
-                                len(x) if isinstance(x, bytes) else x
-                                for x in mask
-                            ]) + len(bstr) + bskip
-                        elif t == '{':
-                            if bstr:
-                                mask.append(bstr)
-                                bstr = b''
+                                bstr += c
+                            elif t[0] == '?':
+                                if len(t) == 1:
+                                    count = 1
+                                else:
+                                    try:
+                                        count = int(t[1:])
+                                    except ValueError:
+                                        raise ParseError("Bad token: %s" % t, pos)
+                                if bstr:
+                                    mask.append(bstr)
+                                    bstr = b''
+                                bskip += count
+                            elif t == '@':
+                                if mofs:
+                                    raise ParseError("Duplicate '@'", pos)
+                                mofs = sum([
+                                    len(x) if isinstance(x, bytes) else x
+                                    for x in mask
+                                ]) + len(bstr) + bskip
+                            elif t == '{':
+                                if bstr:
+                                    mask.append(bstr)
+                                    bstr = b''
+                                    if bskip:
+                                        print(mask, bstr, bskip)
+                                        raise ParseError(
+                                            "Internal error: "
+                                            "both bstr and bskip used", pos)
                                 if bskip:
-                                    print(mask, bstr, bskip)
-                                    raise ParseError(
-                                        "Internal error: "
-                                        "both bstr and bskip used", pos)
-                            if bskip:
-                                mask.append(bskip)
-                                bskip = 0
-                            line = '"'.join(tokens[tokennum+1:])
-                            # prepare remainder for next if
-                            instructions = []  # this will also break for's
-                        else:
-                            raise ParseError("Bad token: %s" % t, pos)
-                        if instructions is not None:  # if entered block
-                            break
-                is_str = not is_str
-                if instructions is not None:  # if entered block
-                    break
-        # mask read finished. Now read block content, if in block
-        if instructions is not None and line:
-            # still have something in current line
-            if line.startswith('}'):
-                # FIXME: what to do with remainder?
-                remainder = line[1:]
-                if remainder:
-                    print("Warning: spare characters after '}', "
-                          "will ignore: %s" % remainder)
-                return Block(patch, Mask(mask, mofs, mpos), instructions)
-
-            # plain labels:
-            label = line.split(None, 1)[0]
-            if label.endswith(':'):  # really label
-                line = line.replace(label, '', 1).strip()  # remove it
-                instructions.append(asm.LabelInstruction(label[:-1], pos))
-            if not line:  # had only the label
-                continue
-
-            instr = parseInstruction(line, pos)
-            instructions.append(instr)
-    if mask or bstr or bskip:
-        raise ParseError("Unexpected end of file", pos)
+                                    mask.append(bskip)
+                                    bskip = 0
+                                line = '"'.join(tokens[tokennum+1:])
+                                # prepare remainder for next if
+                                instructions = []  # this will also break for's
+                            else:
+                                raise ParseError("Bad token: %s" % t, pos)
+                            if instructions is not None:  # if entered block
+                                break
+                    is_str = not is_str
+                    if instructions is not None:  # if entered block
+                        break
+            # mask read finished. Now read block content, if in block
+            if instructions is not None and line:
+                # still have something in current line
+                if line.startswith('}'):
+                    # FIXME: what to do with remainder?
+                    remainder = line[1:]
+                    if remainder:
+                        print("Warning: spare characters after '}', "
+                              "will ignore: %s" % remainder)
+                    if broken:
+                        return False
+                    return Block(patch, Mask(mask, mofs, mpos), instructions)
+
+                # plain labels:
+                label = line.split(None, 1)[0]
+                if label.endswith(':'):  # really label
+                    line = line.replace(label, '', 1).strip()  # remove it
+                    instructions.append(asm.LabelInstruction(label[:-1], pos))
+                if not line:  # had only the label
+                    continue
+
+                instr = parseInstruction(line, pos)
+                instructions.append(instr)
+        except ParseError as e:
+            if errors is None:
+                raise
+            e.pos = e.pos.clone()  # as pos will go further
+            errors.append(e)
+            if instructions is not None:
+                broken = True  # continue to find errors in this block
+            elif mpos:
+                skipping = True  # mask is unusable, skip its block
+    if mask or bstr or bskip or mpos:
+        error = ParseError("Unexpected end of file", pos)
+        if errors is None:
+            raise error
+        errors.append(error)
     return None
 
-def parseFile(f, definitions=None, patch=None, libpatch=None):
+def iterBlocks(f, definitions, patch, errors=None):
+    """
+    Generator which parses patch file (file object or SourceFile)
+    and yields its blocks one by one.
+    If errors list is provided, all ParseErrors are collected there
+    and parsing continues with the next block;
+    blocks which contained errors are not yielded.
+    Otherwise the first ParseError is raised.
+    """
+    if not isinstance(f, SourceFile):
+        f = SourceFile(f)
+
+    # for #commands:
+    if_state = [True]  # this True should always remain there
+
+    pos = FilePos(f.name)
+    while True:
+        block = parseBlock(f, pos, definitions, if_state, patch, errors)
+        if block is None:
+            break
+        if block:
+            yield block
+
+    if len(if_state) != 1:
+        error = ParseError("#ifdef count mismatch! %s" % if_state, pos)
+        if errors is None:
+            raise error
+        errors.append(error)
+
+def parseFile(f, definitions=None, patch=None, libpatch=None, errors=None):
     """
     Parses patch file.
     Definitions dictionary is used for #define and its companions.
     If patch was not provided, it will be created,
     in which case libpatch (patch for includes) must be provided.
+    Errors are collected in one pass and raised together as ParseErrors;
+    if errors list is provided, they are appended to it instead.
     """
     if definitions is None:
         definitions = {}
@@ -452,17 +593,103 @@ def parseFile(f, definitions=None, patch=None, libpatch=None):
             raise ValueError("Neither patch nor libpatch were provided")
         patch = Patch(f.name, libpatch)
 
-    # for #commands:
-    if_state = [True]  # this True should always remain there
-
-    pos = FilePos(f.name)
-    while True:
-        block = parseBlock(f, pos, definitions, if_state, patch)
-        if not block:
-            break
+    collected = [] if errors is None else errors
+    for block in iterBlocks(f, definitions, patch, collected):
         patch.blocks.append(block)
-
-    if len(if_state) != 1:
-        raise ValueError('#ifdef count mismatch! '+str(if_state))
+    if errors is None and collected:
+        raise ParseErrors(collected)
 
     return patch
+
+def scanDefinitions(f, definitions):
+    """
+    Walks #commands of patch file (and of files it #includes)
+    and updates definitions dictionary
+    exactly as parseFile would do,
+    but without parsing masks and instructions.
+    """
+    def include(path):
+        with open(path, 'r') as newf:
+            scanDefinitions(newf, definitions)
+
+    if_state = [True]
+    src = SourceFile(f)
+    pos = FilePos(src.name)
+    for lnum in src.directives:
+        line = src.lines[lnum]
+        pos.setLine(lnum, line.strip())
+        try:
+            parseDirective(uncomment(line), pos, definitions, if_state,
+                           include)
+        except ParseError:
+            pass  # parser itself will report it
+
+def _parseWorker(task):
+    """
+    Parses one top-level file in a worker process.
+    Returns blocks of that file and blocks it #included,
+    detached from their (worker-local) patches.
+    """
+    name, definitions, libname, binary = task
+    library = Patch(libname, binary=binary)
+    with open(name, 'r') as f:
+        patch = parseFile(f, definitions, libpatch=library)
+    for block in patch.blocks + library.blocks:
+        block.patch = None  # don't send patches with their binary back
+    return patch.blocks, library.blocks
+
+def parseFiles(filenames, definitions=None, libpatch=None, jobs=None):
+    """
+    Parses several top-level patch files using a pool of processes.
+    Returns list of patches in the order of filenames;
+    #included blocks are appended to libpatch in that order as well,
+    so result is the same as of sequential parseFile calls.
+    jobs: number of processes, defaults to CPU count;
+        1 means parse sequentially in this process.
+    """
+    if definitions is None:
+        definitions = {}
+    if not libpatch:
+        raise ValueError("libpatch was not provided")
+    errors = []
+    if jobs == 1 or len(filenames) < 2:
+        patches = []
+        for name in filenames:
+            with open(name, 'r') as f:
+                patches.append(parseFile(f, definitions, libpatch=libpatch,
+                                         errors=errors))
+        if errors:
+            raise ParseErrors(errors)
+        return patches
+
+    # Files only depend on each other by #defines,
+    # so get definitions each file will start with by a quick scan.
+    tasks = []
+    for name in filenames:
+        tasks.append((name, dict(definitions), libpatch.name, libpatch.binary))
+        with open(name, 'r') as f:
+            scanDefinitions(f, definitions)
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(_parseWorker, task) for task in tasks]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except ParseErrors as e:
+                errors.extend(e.errors)
+    if errors:
+        raise ParseErrors(errors)
+
+    patches = []
+    for name, (blocks, libblocks) in zip(filenames, results):
+        patch = Patch(name, libpatch)
+        for block in blocks:
+            block.patch = patch
+        patch.blocks.extend(blocks)
+        for block in libblocks:
+            block.patch = libpatch
+        libpatch.blocks.extend(libblocks)
+        patches.append(patch)
+    return patches
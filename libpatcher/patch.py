@@ -57,14 +57,18 @@ class Patch(object):
         if self._is_bound:
             raise ValueError("Already bound")
         for block in self.blocks:
-            oldSize = block.getSize()
-            position = block.getPosition(binary, ranges)
+            position = block.getPosition(binary, ranges, codebase)
             block.bind(position + codebase, codebase)
-            # block size could shrink because of ALIGNs..
-            newSize = block.getSize()
-            if newSize < oldSize:
-                ranges.add(position+newSize, position+oldSize)
         self._is_bound = True
+    def unbind(self):
+        """
+        Reverts bindall(), so that patch may be bound again.
+        Ranges used must be restored by caller.
+        """
+        self._context = {}
+        for block in self.blocks:
+            block.unbind()
+        self._is_bound = False
     def apply(self, binary, codebase = 0x8004000, ignore=False):
         """
         Applies all blocks from this patch to given binary,
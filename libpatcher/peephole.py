@@ -0,0 +1,197 @@
+# This module rewrites instruction sequences of floating blocks
+# into smaller or faster equivalents before layout.
+from . import thumbimm
+from .asm import (List, Num, Reg, LiteralLabel, LabelInstruction, LiteralPool,
+                  findInstruction)
+
+__all__ = ['optimize', 'optimizeBlock']
+
+_conds = set(['EQ', 'NE', 'CS', 'CC', 'MI', 'PL', 'VS', 'VC',
+              'HI', 'LS', 'GE', 'LT', 'GT', 'LE'])
+_compares = set(['CMP', 'CMN', 'TST', 'TEQ'])
+
+def _base(opcode):
+    return opcode[:-2] if opcode.endswith('.W') else opcode
+
+def _isBranch(opcode):
+    base = _base(opcode)
+    return base == 'B' or base[0] == 'B' and base[1:] in _conds
+
+def _readsFlags(opcode):
+    base = _base(opcode)
+    return (_isBranch(opcode) and base != 'B' or
+            base in ('ADC', 'ADCS', 'SBC', 'SBCS'))
+
+def _setsFlags(opcode):
+    base = _base(opcode)
+    return (base in _compares or
+            base.endswith('S') and not _isBranch(opcode) and
+            base not in ('CBZ', 'CBNZ'))
+
+def _flagsDead(instrs, n):
+    """
+    Checks whether flags set by n'th instruction may be changed,
+    i.e. nothing reads them before they are set again.
+    Calls and returns clobber flags according to AAPCS.
+    """
+    for i in instrs[n + 1:]:
+        if isinstance(i, LabelInstruction):
+            continue
+        if i.opcode is None or _readsFlags(i.opcode):
+            return False
+        base = _base(i.opcode)
+        if base in ('BL', 'BLX') or _setsFlags(i.opcode):
+            return True
+        if base == 'BX' or base == 'POP' and Reg('PC') in i.args[0]:
+            return True
+        if _isBranch(i.opcode) or base in ('CBZ', 'CBNZ'):
+            return False  # flags may be used where it goes
+    return False  # block may fall through to original code
+
+def _reinstantiate(i, opcode, args):
+    return findInstruction(opcode, List(args), i.pos)
+
+def _lowReg(r):
+    return isinstance(r, Reg) and r < 8
+
+# Rules get list of instructions and index in it.
+# Each returns None or (count of instructions replaced,
+# replacement instructions, estimated cycles saved).
+
+def _branchToNext(instrs, n):
+    " B label, where label is right after it "
+    i = instrs[n]
+    if not i.opcode or not _isBranch(i.opcode) or not i.args[0].name:
+        return None
+    for j in instrs[n + 1:]:
+        if not isinstance(j, LabelInstruction):
+            break
+        if j.name == i.args[0].name and not i.args[0].shift:
+            # not taken conditional branch costs 1, taken ones 1+P
+            return (1, [], 3 if _base(i.opcode) == 'B' else 1)
+    return None
+
+def _pushPop(instrs, n):
+    " PUSH {list} followed by POP {same list} "
+    i = instrs[n]
+    if i.opcode not in ('PUSH', 'PUSH.W') or n + 1 >= len(instrs):
+        return None
+    j = instrs[n + 1]
+    if j.opcode not in ('POP', 'POP.W'):
+        return None
+    if sorted(i.args[0]) != sorted(j.args[0]):
+        return None
+    return (2, [], 2 * (1 + len(i.args[0])))
+
+def _movSame(instrs, n):
+    " MOV Rd, Rd and ADD/SUB Rd, Rd, 0 "
+    i = instrs[n]
+    if not i.opcode or not i.args:
+        return None
+    base = _base(i.opcode)
+    args = i.args
+    if base in ('MOV', 'MOVS') and len(args) == 2:
+        same = isinstance(args[1], Reg) and args[0] == args[1]
+    elif base in ('ADD', 'ADDS', 'SUB', 'SUBS') and len(args) in (2, 3):
+        same = (isinstance(args[-1], Num) and args[-1] == 0 and
+                (len(args) == 2 or args[0] == args[1]) and
+                isinstance(args[0], Reg))
+    else:
+        return None
+    if not same:
+        return None
+    # 16-bit ADD Rlo, imm sets flags even if written without S
+    flags = _setsFlags(i.opcode) or base != 'MOV' and i.getSize() == 2
+    if flags and not _flagsDead(instrs, n):
+        return None
+    return (1, [], 1)
+
+def _narrowMov(instrs, n):
+    " MOV.W Rlo, imm8 becomes 16-bit MOVS if flags are not used "
+    i = instrs[n]
+    if i.opcode != 'MOV.W' or len(i.args) != 2:
+        return None
+    rd, imm = i.args
+    if not _lowReg(rd) or not isinstance(imm, Num) or not 0 <= imm < 256:
+        return None
+    if not _flagsDead(instrs, n):
+        return None
+    return (1, [_reinstantiate(i, 'MOVS', [rd, imm])], 0)
+
+def _literalToMov(instrs, n):
+    " LDR Rd, =imm for immediates which MOV can load "
+    i = instrs[n]
+    if _base(i.opcode or '') != 'LDR' or len(i.args) != 2:
+        return None
+    rd, lit = i.args
+    if not isinstance(lit, LiteralLabel) or not isinstance(lit.value, Num):
+        return None
+    if rd in (Reg('SP'), Reg('PC')):
+        return None
+    value = lit.value & 0xFFFFFFFF
+    if _lowReg(rd) and value < 256 and _flagsDead(instrs, n):
+        opcode = 'MOVS'
+    else:
+        try:
+            thumbimm.encode(value)
+        except ValueError:
+            if value > 0xFFFF:
+                return None
+        opcode = 'MOV.W'
+    return (1, [_reinstantiate(i, opcode, [rd, Num(value)])], 1)
+
+_rules = [_branchToNext, _pushPop, _movSame, _narrowMov, _literalToMov]
+
+def _prunePools(instrs):
+    " Removes literal pool entries which are no longer loaded "
+    used = set()
+    for i in instrs:
+        for a in i.args or []:
+            if isinstance(a, LiteralLabel):
+                used.add(a.name)
+    for i in instrs:
+        if isinstance(i, LiteralPool):
+            i.entries = [e for e in i.entries if e.name in used]
+
+def optimizeBlock(block):
+    """
+    Applies peephole rules to given unbound block until nothing changes.
+    Returns estimated count of cycles saved.
+    """
+    instrs = block.instructions
+    saved = 0
+    changed = True
+    while changed:
+        changed = False
+        for n in range(len(instrs)):
+            for rule in _rules:
+                ret = rule(instrs, n)
+                if ret is not None:
+                    count, replacement, cycles = ret
+                    instrs[n:n + count] = replacement
+                    saved += cycles
+                    changed = True
+                    break
+            if changed:
+                break
+    _prunePools(instrs)
+    return saved
+
+def optimize(patches):
+    """
+    Optimizes floating blocks of given unbound patches.
+    Blocks bound to masks are left as is, as their size
+    must match code they replace.
+    Returns list of (block, bytes saved, estimated cycles saved)
+    for blocks which changed.
+    """
+    ret = []
+    for p in patches:
+        for block in p.blocks:
+            if not block.mask.floating:
+                continue
+            size = block.getSize()
+            cycles = optimizeBlock(block)
+            if cycles or block.getSize() != size:
+                ret.append((block, size - block.getSize(), cycles))
+    return ret
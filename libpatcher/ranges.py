@@ -61,10 +61,35 @@ class Ranges(object):
         else:
             return binary
 
+    def save(self):
+        """ Returns current state of collection, for restore() """
+        return ([list(r) for r in self._ranges], self._used)
+    def restore(self, state):
+        """ Reverts collection to state returned by save() """
+        self._ranges = [list(r) for r in state[0]]
+        self._used = state[1]
+
+    def reserve(self, f, t):
+        """
+        Excludes given fixed range from collection,
+        if it lies entirely within one of available ranges.
+        Returns False (and changes nothing) otherwise.
+        """
+        for r in self._ranges:
+            if r[0] <= f and t <= r[1]:
+                self._used = True # for restore_tail
+                if t < r[1]:
+                    self._ranges.append([t, r[1]])
+                r[1] = f
+                return True
+        return False
     def find(self, size, aligned=2):
         """
         Returns the best matching range for block of given size,
         and excludes returned range from collection.
+        Size may also be a function which returns exact size
+        for block starting at given position
+        (as size may depend on alignment).
         Will align block to 2 by default;
         to get block for unaligned data,
         pass aligned=0
@@ -75,8 +100,11 @@ class Ranges(object):
             alshift = 0
             if aligned:
                 alshift = (aligned-1) - ((r[0]+aligned-1) % aligned)
-            if r[1]-r[0] >= size+alshift:
-                ret = [r[0]+alshift,r[1]] # copy range
-                r[0] += size+alshift # and reduce it
+            need = size(r[0]+alshift) if callable(size) else size
+            if r[1]-r[0] >= need+alshift:
+                ret = [r[0]+alshift, r[0]+alshift+need]
+                r[0] += need+alshift # and reduce it
                 return ret
+        if callable(size):
+            size = size(0)
         raise RangeError("No suitable range for %d bytes (align: %d)" % (size,aligned))
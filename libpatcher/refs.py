@@ -0,0 +1,186 @@
+# This module finds references to addresses in firmware binary:
+# plain pointers, BL/B.W instructions, values loaded
+# from literal pools and MOVW/MOVT pairs.
+# All candidate positions are decoded at once with NumPy,
+# so that each lookup is just a comparison over arrays,
+# and many lookups are bisections over sorted targets.
+import numpy as np
+
+__all__ = ['RefIndex', 'movPairs']
+
+
+def movPairs(data, window=16):
+    """
+    Finds MOVW/MOVT pairs which load 32-bit value to a register:
+    MOVT is paired with the closest MOVW to the same register
+    which is at most window bytes before it.
+    Returns offsets of MOVW instructions and loaded values.
+    """
+    hw = np.frombuffer(data[:len(data) // 2 * 2], '<u2').astype(np.int64)
+    hw1, hw2 = hw[:-1], hw[1:]
+    # 11110 i 10 T 1 0 0 imm4, 0 imm3 Rd imm8
+    wide = (hw1 & 0xFB70 == 0xF240) & (hw2 & 0x8000 == 0)
+    imm = ((hw1 & 0xF) << 12 | (hw1 & 0x400) << 1 |
+           (hw2 & 0x7000) >> 4 | hw2 & 0xFF)
+    rd = hw2 >> 8 & 0xF
+    movw = np.nonzero(wide & (hw1 & 0x80 == 0))[0]
+    movt = np.nonzero(wide & (hw1 & 0x80 != 0))[0]
+    isMovw = np.zeros(len(hw1) + window, bool)
+    isMovw[movw] = True
+    offs = np.full(len(movt), -1, np.int64)
+    for d in range(2, window // 2 + 1):
+        cand = movt - d
+        ok = (offs < 0) & (cand >= 0)
+        ok[ok] = isMovw[cand[ok]] & (rd[cand[ok]] == rd[movt[ok]])
+        offs[ok] = cand[ok]
+    found = offs >= 0
+    offs, movt = offs[found], movt[found]
+    return offs * 2, imm[offs] | imm[movt] << 16
+
+
+class RefIndex(object):
+    """
+    Index of possible references in a binary loaded at given base.
+    """
+
+    def __init__(self, data, base=0x8004000):
+        self.base = base
+        self.size = len(data)
+        buf = np.frombuffer(data, np.uint8).astype(np.uint32)
+        # 32-bit little-endian values at every byte offset
+        if len(buf) >= 4:
+            self.words = (buf[:-3] | buf[1:-2] << 8 |
+                          buf[2:-1] << 16 | buf[3:] << 24)
+        else:
+            self.words = np.zeros(0, np.uint32)
+        # BL and B.W at every halfword offset
+        hw = np.frombuffer(data[:len(data) // 2 * 2], '<u2').astype(np.int64)
+        hw1, hw2 = hw[:-1], hw[1:]
+        first = hw1 >> 11 == 0b11110
+        bl = first & (hw2 >> 11 == 0b11111)
+        bw = first & (hw2 >> 11 == 0b10111)
+        idx = np.nonzero(bl | bw)[0]
+        self.branchPos = idx * 2
+        self.branchBL = bl[idx]
+        # offset field; sign is not stored separately here
+        # (J1 and J2 are both 1), just as findrefs always did
+        self.branchCode = (hw1[idx] & 0x7FF) << 11 | (hw2[idx] & 0x7FF)
+        # LDR Rt, [PC, imm] (01001 Rt imm8) and LDR.W Rt, [PC, +-imm12]
+        pc = (np.arange(len(hw)) * 2 + 4) & ~3
+        narrow = np.nonzero(hw & 0xF800 == 0x4800)[0]
+        wide = np.nonzero(hw1 & 0xFF7F == 0xF85F)[0]
+        imm12 = hw2[wide] & 0xFFF
+        pos = np.concatenate([narrow, wide])
+        pool = np.concatenate([pc[narrow] + (hw[narrow] & 0xFF) * 4,
+                               pc[wide] + np.where(hw1[wide] & 0x80,
+                                                   imm12, -imm12)])
+        ok = (pool >= 0) & (pool < len(self.words))
+        movPos, movValues = movPairs(data)
+        # each load is resolved to the pool word it reads
+        self.loadPos = np.concatenate([pos[ok] * 2, movPos])
+        self.loadValue = np.concatenate([self.words[pool[ok]].astype(np.int64),
+                                         movValues])
+        self.loadMOVW = np.arange(len(self.loadPos)) >= np.count_nonzero(ok)
+
+    def pointers(self, val):
+        " Returns offsets of 4-byte values equal to val, at any alignment "
+        return np.nonzero(self.words == val)[0]
+
+    def branches(self, val):
+        """
+        Returns offsets and BL flags of BL/B.W instructions
+        which refer to val.
+        """
+        o = (val - (self.base + self.branchPos + 4)) >> 1
+        match = (np.abs(o) < 1 << 22) & ((o & 0x3FFFFF) == self.branchCode)
+        return self.branchPos[match], self.branchBL[match]
+
+    def loads(self, val):
+        """
+        Returns offsets and MOVW flags of literal loads and MOVW/MOVT pairs
+        which load val.
+        """
+        match = self.loadValue == val
+        return self.loadPos[match], self.loadMOVW[match]
+
+    def find(self, val):
+        """
+        Returns list of (offset, kind) for all references to val,
+        kind being 'DCD', 'B.W', 'BL', 'LDR' or 'MOVW'.
+        Ordered by offset, pointers first at equal halfword.
+        """
+        refs = [((int(off) & ~1, int(off) & 1), int(off), 'DCD')
+                for off in self.pointers(val)]
+        offs, isBL = self.branches(val)
+        refs += [((int(off), 3 if b else 2), int(off), 'BL' if b else 'B.W')
+                 for off, b in zip(offs, isBL)]
+        offs, isMOVW = self.loads(val)
+        refs += [((int(off), 5 if m else 4), int(off), 'MOVW' if m else 'LDR')
+                 for off, m in zip(offs, isMOVW)]
+        refs.sort()
+        return [(off, kind) for key, off, kind in refs]
+
+    def _sorted(self):
+        """
+        Builds arrays of reference targets, sorted for bisection.
+        Pointers match exact values, while branches match
+        their target with or without thumb bit.
+        """
+        if hasattr(self, 'ptrTargets'):
+            return
+        order = np.argsort(self.words, kind='stable')
+        self.ptrTargets = self.words[order].astype(np.int64)
+        self.ptrOffs = order
+        # every offset field matches two targets, see branches()
+        pos = np.concatenate([self.branchPos, self.branchPos])
+        o = np.concatenate([self.branchCode, self.branchCode - (1 << 22)])
+        valid = np.abs(o) < 1 << 22
+        targets = (self.base + pos + 4 + o * 2)[valid]
+        idx = np.concatenate([np.arange(len(self.branchPos))] * 2)[valid]
+        order = np.argsort(targets, kind='stable')
+        self.brTargets = targets[order]
+        self.brIdx = idx[order]
+        order = np.argsort(self.loadValue, kind='stable')
+        self.ldTargets = self.loadValue[order]
+        self.ldIdx = order
+
+    def findMany(self, ranges):
+        """
+        Finds references into each of given [start, end) ranges at once.
+        Returns list of [(offset, kind, target)] for each range,
+        ordered as in find().
+        """
+        self._sorted()
+        starts = np.array([r[0] for r in ranges], np.int64)
+        ends = np.array([r[1] for r in ranges], np.int64)
+        pl = np.searchsorted(self.ptrTargets, starts, 'left')
+        pr = np.searchsorted(self.ptrTargets, ends, 'left')
+        # branch target t also matches t+1
+        bl = np.searchsorted(self.brTargets, starts - 1, 'left')
+        br = np.searchsorted(self.brTargets, ends, 'left')
+        ll = np.searchsorted(self.ldTargets, starts, 'left')
+        lr = np.searchsorted(self.ldTargets, ends, 'left')
+        ret = []
+        for n in range(len(ranges)):
+            refs = [((off & ~1, off & 1), off, 'DCD', t) for off, t in zip(
+                self.ptrOffs[pl[n]:pr[n]].tolist(),
+                self.ptrTargets[pl[n]:pr[n]].tolist())]
+            for i, t in zip(self.brIdx[bl[n]:br[n]].tolist(),
+                            self.brTargets[bl[n]:br[n]].tolist()):
+                off = int(self.branchPos[i])
+                isBL = bool(self.branchBL[i])
+                refs.append(((off, 3 if isBL else 2), off,
+                             'BL' if isBL else 'B.W', max(t, ranges[n][0])))
+            for i, t in zip(self.ldIdx[ll[n]:lr[n]].tolist(),
+                            self.ldTargets[ll[n]:lr[n]].tolist()):
+                off = int(self.loadPos[i])
+                isMOVW = bool(self.loadMOVW[i])
+                refs.append(((off, 5 if isMOVW else 4), off,
+                             'MOVW' if isMOVW else 'LDR', t))
+            refs.sort()
+            ret.append([r[1:] for r in refs])
+        return ret
+
+    def findRange(self, start, end):
+        " Returns list of (offset, kind, target) for references into range "
+        return self.findMany([(start, end)])[0]
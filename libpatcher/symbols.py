@@ -0,0 +1,79 @@
+# This module holds symbol table which resolves labels
+# of bound patches once, like linker does.
+from .asm import LabelError
+
+__all__ = ['SymbolError', 'SymbolTable']
+
+class SymbolError(LabelError):
+    " This holds all duplicate and undefined symbols found "
+    def __init__(self, problems):
+        super(SymbolError, self).__init__(problems)
+        self.problems = problems
+
+    def __str__(self):
+        return "%d symbol error(s):\n%s" % (
+            len(self.problems), '\n'.join(self.problems))
+
+class SymbolTable(object):
+    """
+    Symbols defined by bound patches:
+    local ones per block and global ones per patch.
+    Library patch's globals are visible from all patches.
+    """
+    def __init__(self, patches):
+        """
+        patches: bound patches, library included
+        """
+        self.patches = patches
+        self.problems = []
+        # (scope, name) -> instruction which defined it
+        self._defined = {}
+        # labels may belong to other patch than their block, see fold
+        for p in patches:
+            p.context.clear()
+            for block in p.blocks:
+                block.context.clear()
+        for p in patches:
+            for block in p.blocks:
+                for i in block.instructions:
+                    for name, value, scope in i.definitions():
+                        self._define(i, name, value, scope)
+
+    def _define(self, instr, name, value, scope):
+        first = self._defined.get((scope, name))
+        if first is not None:
+            self.problems.append(
+                "%s: Duplicate %s label %s, first defined at %s" % (
+                    instr.pos, "local" if scope is instr.block else "global",
+                    name, first.pos))
+            return
+        self._defined[(scope, name)] = instr
+        scope.context[name] = value
+
+    def lookup(self, block, name):
+        """
+        Returns value of given symbol as seen from given block,
+        or None if it is not defined.
+        """
+        for ctx in (block.context, block.patch.context,
+                    block.patch.library.context):
+            if name in ctx:
+                return ctx[name]
+        return None
+
+    def resolve(self):
+        """
+        Resolves all label references of all instructions,
+        so that encoding won't need to look them up.
+        Raises SymbolError listing all problems found.
+        """
+        for p in self.patches:
+            for block in p.blocks:
+                for i in block.instructions:
+                    for label in i.references():
+                        label.addr = self.lookup(block, label.name)
+                        if label.addr is None:
+                            self.problems.append(
+                                "%s: Undefined label %s" % (i.pos, label.name))
+        if self.problems:
+            raise SymbolError(self.problems)
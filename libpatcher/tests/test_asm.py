@@ -1,4 +1,5 @@
 from libpatcher.asm import *
+from libpatcher.asm import OffsetError
 from libpatcher.parser import *
 from libpatcher.parser import parseBlock, parseInstruction
 from libpatcher.block import *
@@ -60,6 +61,16 @@ def test_BEQ_self():
     eq_(op('BEQ self'), b'\xFE\xD0')
 def test_BNE_W_self():
     eq_(op('BNE.W self'), b'\x7F\xF4\xFE\xAF')
+def test_BNE_W_forward():
+    eq_(op('BNE.W far', 0, {'far': 0x8004000 + 4 + 0x12344}),
+        b'\x52\xF0\xA2\x81')
+@raises(OffsetError)
+def test_BEQ_too_far():
+    op('BEQ far', 0, {'far': 0x8004000 + 4 + 256})
+def test_BEQ_widened():
+    i = op_gen('BEQ far', 0, {'far': 0x8004000 + 4 + 256})
+    assert i.widen()
+    eq_(i.getCode(), b'\x00\xF0\x80\x80')
 def test_CBZ_R3_next():
     eq_(op('CBZ R3, next'), b'\x03\xB1')
 def test_CBNZ_R7_next():
@@ -168,3 +179,16 @@ def test_TST_R1_100000():
     eq_(op('TST R1,0x100000'), b'\x11\xF4\x80\x1F')
 def test_UXTB_R5_R4():
     eq_(op('UXTB R5,R4'), b'\xE5\xB2')
+def test_candidates_keep_priority():
+    from libpatcher import asm
+    for line in ['ADD R0,R4,0x64', 'ADD R3,R0,R2', 'MOV R0,0x2C',
+                 'MOV R0,R5', 'MOV R2,50000', 'LDR R5,[R3]',
+                 'LDR R12,[SP,0x24]', 'LDRB R2,[R4],1', 'PUSH {R4-R8,LR}',
+                 'SUB R2,R0,8', 'DCB "s" 1', 'global x', 'B.W next']:
+        opcode, _, rest = line.partition(' ')
+        args = parseInstruction(line, FilePos('test', 0)).args
+        linear = [i for i in asm._instructions if i.match(opcode, args)]
+        indexed = [i for i in asm.findCandidates(opcode, args)
+                   if i.match(opcode, args)]
+        eq_(linear, indexed)
+        assert len(asm.findCandidates(opcode, args)) <= 6
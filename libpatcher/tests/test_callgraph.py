@@ -0,0 +1,64 @@
+from libpatcher.callgraph import analyze
+from libpatcher.tests.test_disasm import assemble, codebase
+from nose.tools import eq_
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+# main calls a and b, a calls b, c is only reached by its prologue;
+# main is found by its prologue at the start of image
+funcs = [
+    (0x00, ['PUSH {R4,LR}', 'BL a', 'BL b', 'POP {R4,PC}']),
+    (0x10, ['PUSH {LR}', 'BL b', 'POP {PC}', 'NOP', 'NOP']),
+    (0x20, ['MOVS R0, 1', 'BX LR']),
+    (0x24, ['PUSH {R3,LR}', 'BL a', 'POP {R3,PC}']),
+]
+
+def build():
+    ctx = {'a': codebase + 0x10, 'b': codebase + 0x20}
+    data = b''
+    for addr, lines in funcs:
+        data += b'\0' * (addr - len(data))
+        data += assemble(lines, codebase + addr, ctx)
+    return data
+
+def test_functions():
+    g = analyze(build())
+    eq_([hex(s - codebase) for s in g.starts],
+        ['0x0', '0x10', '0x20', '0x24'])
+    eq_(g.function(codebase + 4), (codebase, codebase + 0xC))
+    eq_(g.callees(codebase), [codebase + 0x10, codebase + 0x20])
+    # trailing padding is not a part of function
+    eq_(g.function(codebase + 0x15), (codebase + 0x10, codebase + 0x18))
+    eq_(g.function(codebase + 0x18), None)
+    eq_(g.callers(codebase + 0x21), [codebase, codebase + 0x10])
+    eq_(g.callSites(codebase + 0x20), [codebase + 0x6, codebase + 0x12])
+    eq_(g.callees(codebase + 0x24), [codebase + 0x10])
+
+def test_affected():
+    g = analyze(build())
+    eq_(g.affected(codebase + 0x21),
+        {codebase: 1, codebase + 0x10: 1, codebase + 0x24: 2})
+    eq_(g.affected(codebase + 0x20, 1), {codebase: 1, codebase + 0x10: 1})
+    eq_(g.affected(codebase + 0x24), {})
+
+def test_export():
+    tmp = tempfile.mkdtemp()
+    try:
+        data = build()
+        g = analyze(data, codebase, tmp)
+        eq_(len(os.listdir(tmp)), 1)
+        cached = analyze(data, codebase, tmp)
+        eq_(json.dumps(cached.toJSON()), json.dumps(g.toJSON()))
+    finally:
+        shutil.rmtree(tmp)
+    eq_(g.toJSON()['functions'][:2],
+        [{'start': codebase, 'end': codebase + 0xC,
+          'calls': [codebase + 0x10, codebase + 0x20]},
+         {'start': codebase + 0x10, 'end': codebase + 0x18,
+          'calls': [codebase + 0x20]}])
+    f = StringIO()
+    g.writeDot(f)
+    eq_(f.getvalue().count('->'), 4)
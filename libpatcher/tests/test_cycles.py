@@ -0,0 +1,74 @@
+from libpatcher.parser import parseFile
+from libpatcher.patch import Patch
+from libpatcher.ranges import Ranges
+from libpatcher.layout import layout
+from libpatcher import cycles
+from nose.tools import eq_
+from io import StringIO
+
+codebase = 0x8004000
+
+def stats(text):
+    binary = b'\0' * 0x1000
+    library = Patch('library', binary=binary)
+    f = StringIO(text)
+    f.name = 'test_cycles.pbp'
+    patch = parseFile(f, libpatch=library)
+    ranges = Ranges()
+    ranges.add(0x100, 0x400)
+    layout([library, patch], binary, ranges, codebase)
+    return cycles.patchStats([library, patch])['test_cycles.pbp']
+
+def test_straight():
+    s, = stats('{\nglobal f\nPUSH {R4,LR}\nMOV R0, 5\nPOP {R4,PC}\n}\n')
+    eq_(s.name, 'f')
+    eq_(s.count, 3)
+    # 1+2 for PUSH, 1 for MOV, 1+2+P for POP with PC
+    eq_((s.min, s.max), (9, 9))
+    assert not s.loops
+
+def test_paths():
+    s, = stats('{\nglobal f\nCMP R0, 0\nBEQ skip\nLDR R1, [R0]\n'
+               'LDR R2, [R0, 4]\nskip:\nBX LR\n}\n')
+    # taken BEQ skips both loads; second load is pipelined
+    eq_((s.min, s.max), (1 + 3 + 3, 1 + 1 + 2 + 1 + 3))
+
+def test_loop():
+    s, = stats('{\nglobal f\nloop:\nSUBS R0, 1\nBNE loop\nBX LR\n}\n')
+    assert s.loops
+    # loop body is counted once
+    eq_((s.min, s.max), (1 + 1 + 3, 1 + 1 + 3))
+
+def test_literal_pool():
+    s, = stats('{\nglobal f\nLDR R0, =0x12345678\nBX LR\n}\n')
+    # pool is not decoded as instructions
+    eq_(s.count, 2)
+    eq_((s.min, s.max), (2 + 3, 2 + 3))
+
+def test_data():
+    # this word would be decoded as B . (loop)
+    s, = stats('{\nglobal f\nBX LR\nDCD 0xE7FEE7FE\nDCB 1, 2\n}\n')
+    eq_(s.count, 1)
+    eq_((s.min, s.max), (3, 3))
+    assert not s.loops
+
+def test_regressions():
+    old = stats('{\nglobal f\nNOP\nBX LR\n}\n')
+    new = stats('{\nglobal f\nNOP\nNOP\nBX LR\n}\n'
+                '{\nglobal g\nNOP\nNOP\nBX LR\n}\n')
+    f = StringIO()
+    cycles.saveBaseline({'p': old}, f)
+    f.seek(0)
+    eq_(cycles.regressions({'p': new}, cycles.loadBaseline(f)),
+        [('p', 'f', 4, 5)])
+
+def test_anonymous_moved():
+    # first block grows, so that the second one moves
+    old = stats('{\nNOP\nBX LR\n}\n{\nNOP\nBX LR\n}\n')
+    new = stats('{\nNOP\nNOP\nBX LR\n}\n{\nNOP\nNOP\nBX LR\n}\n')
+    eq_([s.name for s in new], ['#0', '#1'])
+    f = StringIO()
+    cycles.saveBaseline({'p': old}, f)
+    f.seek(0)
+    eq_(cycles.regressions({'p': new}, cycles.loadBaseline(f)),
+        [('p', '#0', 4, 5), ('p', '#1', 4, 5)])
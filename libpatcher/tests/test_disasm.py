@@ -0,0 +1,107 @@
+from libpatcher import disasm
+from libpatcher.parser import parseInstruction, FilePos
+from libpatcher.block import Block
+from libpatcher.patch import Patch
+from nose.tools import eq_
+from struct import unpack
+import os
+import shutil
+import tempfile
+
+mock_patch = Patch('test_patch', binary=b"test_bin")
+codebase = 0x8004000
+
+def assemble(lines, addr=codebase, context={}):
+    " Returns code for given instructions placed one after another "
+    pos = FilePos('test_disasm.pbp', 0)
+    instrs = [parseInstruction(l, pos) for l in lines]
+    block = Block(mock_patch, None, instrs)
+    block.bind(addr, codebase)
+    block.context.update(context)
+    return block.getCode()
+
+def decode(code, addr=codebase):
+    hws = unpack('<%dH' % (len(code) // 2), code)
+    return disasm.decode(hws[0], hws[1] if len(hws) > 1 else None, addr)
+
+# these should be disassembled to exactly the same text
+plain = [
+    'NOP', 'BX LR', 'BLX R8', 'MOV R0, R5', 'MOVS R0, R5',
+    'ADDS R3, R0, R2', 'CMP R2, R12', 'CMP R3, 0xF',
+    'LDR R5, [R3]', 'LDR R1, [R2, 0x10]', 'LDR R0, [R1, R2]',
+    'LDR.W R12, [SP, 0x24]', 'LDRB R2, [R4, 1]', 'STRH R1, [R2, 2]',
+    'PUSH {R3,LR}', 'POP {R4,R5,R6,R7,PC}', 'PUSH {R4,R8,LR}',
+    'MOV R2, 0x50000', 'MOV R1, 0xFF000', 'ADD R0, R4, 0x64',
+    'SUB SP, SP, 0x10', 'UXTB R0, R1',
+]
+
+def test_roundtrip():
+    for line in plain:
+        code = assemble([line])
+        d = decode(code)
+        eq_(str(d), line)
+        eq_(d.size, len(code))
+        # and it assembles back the same
+        eq_(assemble([str(d)]), code)
+
+def test_targets():
+    ctx = {'dest': codebase + 0x100, 'far': codebase - 0x12340}
+    for line, addr, target in [
+            ('BL far', codebase, ctx['far']),
+            ('B.W dest', codebase + 2, ctx['dest']),
+            ('BNE dest', codebase + 0x80, ctx['dest']),
+            ('BNE.W far', codebase + 0x80, ctx['far']),
+            ('CBZ R3, dest', codebase + 0xF0, ctx['dest']),
+            ('LDR R3, dest', codebase + 0x82, ctx['dest']),
+            ('ADR R2, dest', codebase + 0x12, ctx['dest']),
+    ]:
+        d = decode(assemble([line], addr, ctx), addr)
+        eq_(d.mnemonic, line.split()[0])
+        eq_(d.target, target)
+        eq_(d.operands[-1], target)
+
+def test_unknown():
+    d = disasm.decode(0xFFFF, 0xFFFF, codebase)
+    eq_(d.mnemonic, 'DCW')
+    eq_(d.size, 4)
+    eq_(d.target, None)
+
+def test_sweep():
+    lines = ['PUSH {R4,LR}', 'MOV R0, 0x50000', 'BL dest', 'NOP',
+             'LDR.W R1, [R0, 4]', 'POP {R4,PC}']
+    code = assemble(lines, context={'dest': codebase})
+    d = disasm.disassemble(code, codebase)
+    eq_(len(d), len(lines))
+    eq_(list(d.size), [2, 4, 4, 2, 4, 2])
+    eq_([i.mnemonic for i in d], ['PUSH', 'MOV', 'BL', 'NOP', 'LDR.W', 'POP'])
+    eq_(d.at(codebase + 4).mnemonic, 'MOV')  # second half of MOV.W
+    eq_([i.addr for i in d.refsTo(codebase + 1)], [codebase + 6])
+    eq_(len(d.between(codebase + 2, codebase + 10)), 2)
+    # it must match single instruction decoder
+    for n, i in enumerate(d):
+        off = i.addr - codebase
+        eq_(str(decode(code[off:off + i.size], i.addr)), str(i))
+
+def test_sweep_boundaries():
+    # compare with plain sequential sweep on random data
+    code = os.urandom(4096)
+    d = disasm.disassemble(code, codebase)
+    hws = unpack('<2048H', code)
+    addrs = []
+    n = 0
+    while n < len(hws):
+        addrs.append(codebase + n * 2)
+        n += 2 if hws[n] >> 11 in (0b11101, 0b11110, 0b11111) else 1
+    eq_(list(d.addr), addrs)
+
+def test_cache():
+    tmp = tempfile.mkdtemp()
+    try:
+        code = assemble(['BL dest', 'NOP', 'NOP'], context={'dest': codebase})
+        d = disasm.disassemble(code, codebase, tmp)
+        eq_(len(os.listdir(tmp)), 1)
+        disasm._cache.clear()
+        d2 = disasm.disassemble(code, codebase, tmp)
+        eq_([str(i) for i in d2], [str(i) for i in d])
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,100 @@
+from libpatcher.parser import parseFile
+from libpatcher.patch import Patch
+from libpatcher.ranges import Ranges
+from libpatcher.layout import layout
+from libpatcher.emulator import Emulator, EmulatorError
+from nose.tools import eq_, raises
+from io import StringIO
+
+codebase = 0x8004000
+
+def build(text, binary=b'\0' * 0x400):
+    " Returns emulator for binary patched with given text, and the patch "
+    library = Patch('library', binary=binary)
+    f = StringIO(text)
+    f.name = 'test_emulator.pbp'
+    patch = parseFile(f, libpatch=library)
+    ranges = Ranges()
+    ranges.add(0x100, 0x400)
+    layout([library, patch], binary, ranges, codebase)
+    return Emulator(patch.apply(binary, codebase), codebase), patch
+
+strcmp = '''{
+global strcmp
+loop:
+LDRB R2, [R0]
+LDRB R3, [R1]
+SUBS R2, R2, R3
+BNE done
+CBZ R3, done
+ADD R0, 1
+ADD R1, 1
+B loop
+done:
+MOV R0, R2
+BX LR
+}
+'''
+
+def sign(x):
+    x = x - 0x100000000 if x & 0x80000000 else x
+    return (x > 0) - (x < 0)
+
+def test_strcmp():
+    emu, patch = build(strcmp)
+    func = patch.context['strcmp']
+    for a, b in [('abc', 'abc'), ('abc', 'abd'), ('b', 'abc'),
+                 ('', 'a'), ('ab', 'a'), ('', '')]:
+        emu.free()
+        eq_(sign(emu.call(func, a, b)), (a > b) - (a < b))
+    assert emu.cycles > emu.steps > 0
+    eq_(emu.writes, 0)
+
+def test_post_index():
+    # returns strlen + 1, leaves pointer after terminator in R1
+    emu, patch = build('{\nglobal f\nMOV R1, R0\nloop:\n'
+                       'LDRB R2, [R1], 1\nCMP R2, 0\nBNE loop\n'
+                       'SUBS R0, R1, R0\nBX LR\n}\n')
+    for text in ['', 'a', 'ab', 'hello']:
+        emu.free()
+        addr = emu.alloc(text)
+        eq_(emu.call(patch.context['f'], addr), len(text) + 1)
+        eq_(emu.regs[1], addr + len(text) + 1)
+        eq_(emu.regs[2], 0)
+
+def test_counters():
+    emu, patch = build('{\nglobal f\nPUSH {R4,LR}\nMOVS R4, R0\n'
+                       'LDR R0, [R4]\nSTR R0, [R4, 4]\nPOP {R4,PC}\n}\n')
+    addr = emu.alloc(b'\x78\x56\x34\x12\0\0\0\0')
+    eq_(emu.call(patch.context['f'], addr), 0x12345678)
+    eq_(emu.read(addr + 4, 4), b'\x78\x56\x34\x12')
+    eq_((emu.steps, emu.reads, emu.writes), (5, 3, 3))
+    # PUSH 3, MOVS 1, LDR 2, STR 1 (pipelined), POP 1+2+2
+    eq_(emu.cycles, 12)
+
+def test_flags():
+    emu, patch = build('{\nglobal less\nCMP R0, R1\nBLT yes\nMOVS R0, 0\n'
+                       'BX LR\nyes:\nMOVS R0, 1\nBX LR\n}\n')
+    less = patch.context['less']
+    eq_([emu.call(less, a & 0xFFFFFFFF, b)
+         for a, b in [(-1, 1), (1, -1), (3, 3), (-5, -4)]],
+        [1, 0, 0, 1])
+
+def test_stub():
+    # fw_func is a function in firmware which we cannot run
+    emu, patch = build('"FUNC" {\nglobal fw_func\n}\n'
+                       '{\nglobal f\nPUSH {R4,LR}\nMOVS R0, 7\nBL fw_func\n'
+                       'ADD R0, 1\nPOP {R4,PC}\n}\n',
+                       b'\0' * 0x80 + b'FUNC' + b'\0' * 0x37C)
+    calls = []
+    def fw_func(emu):
+        calls.append(emu.regs[0])
+        return 41
+    emu.stub(patch.context['fw_func'], fw_func)
+    eq_(emu.call(patch.context['f']), 42)
+    eq_(calls, [7])
+
+@raises(EmulatorError)
+def test_bad_memory():
+    emu, patch = build('{\nglobal f\nLDR R0, [R0]\nBX LR\n}\n')
+    emu.call(patch.context['f'], 0x40000000)
@@ -0,0 +1,220 @@
+from libpatcher.parser import parseFile, ParseError
+from libpatcher.patch import Patch
+from libpatcher.ranges import Ranges
+from libpatcher.layout import layout
+from libpatcher.symbols import SymbolError
+from libpatcher.unused import dropUnused
+from libpatcher.fold import foldIdentical
+from libpatcher.linkmap import makeMap, reuseMap, blockHash
+from libpatcher import disasm
+from nose.tools import eq_, raises
+from io import StringIO
+from struct import pack, unpack
+import pickle
+
+codebase = 0x8004000
+
+def source(text, name='test_layout.pbp'):
+    f = StringIO(text)
+    f.name = name
+    return f
+
+def build(text, binary):
+    library = Patch('library', binary=binary)
+    patch = parseFile(source(text), libpatch=library)
+    ranges = Ranges()
+    ranges.add(0x100, 0x400)
+    passes = layout([library, patch], binary, ranges, codebase)
+    return library, patch, passes
+
+def sizes(block):
+    return [i.getSize() for i in block.instructions]
+
+def test_near_stays_short():
+    binary = b'\0' * 0x1000
+    library, patch, passes = build(
+        '{\nglobal near\nB near\nBNE near\nBX LR\n}\n', binary)
+    eq_(passes, 1)
+    eq_(sizes(patch.blocks[0]), [0, 2, 2, 2])
+
+def test_far_widened():
+    # BNE reaches 256 bytes only, B 2 KB;
+    # branch target is in the binary, far from floating block
+    binary = b'\xff' * 0x2000 + b'\0\xbf\0\xbf'
+    library, patch, passes = build(
+        '@ 00 bf 00 bf {\nglobal far\nNOP\n}\n'
+        '{\nB far\nBNE far\nBEQ here\nglobal here\nBX LR\n}\n', binary)
+    eq_(passes, 2)
+    eq_(sizes(patch.blocks[1]), [4, 4, 2, 0, 2])
+    block = patch.blocks[1]
+    eq_(block.instructions[0].opcode, 'B')
+    data = patch.apply(binary, codebase)
+    eq_(data[0x100:0x104], b'\x01\xf0\x7e\xbf')  # B.W far
+
+def test_widening_pushes_labels():
+    # BEQ at the start is near its label
+    # until BNE after it gets widened, moving the label away
+    body = 'BEQ back\n' + 'NOP\n' * 127 + 'BNE away\nglobal back\nBX LR\n'
+    binary = b'\xff' * 0x2000 + b'\0\xbf\0\xbf'
+    library, patch, passes = build(
+        '@ 00 bf 00 bf {\nglobal away\nNOP\n}\n{\n' + body + '}\n', binary)
+    eq_(passes, 3)
+    eq_(sizes(patch.blocks[1])[:1] + sizes(patch.blocks[1])[-3:],
+        [4, 4, 0, 2])
+
+def test_alternatives_pickled():
+    library = Patch('library', binary=b'\0')
+    patch = parseFile(source('{\nBNE somewhere\n}\n'), libpatch=library)
+    instr = pickle.loads(pickle.dumps(patch.blocks[0].instructions[0]))
+    eq_(instr.getSize(), 2)
+    assert instr.widen()
+    eq_(instr.getSize(), 4)
+    assert not instr.widen()
+
+def test_literal_pool():
+    binary = b'\0' * 0x1000
+    library, patch, passes = build(
+        '{\nLDR R0, =0x12345678\nLDR R1, =0x12345678\nLDR R2, =proc+1\n'
+        'LDR R8, =-1\nBX LR\nglobal proc\nNOP\n}\n', binary)
+    block = patch.blocks[0]
+    # values are stored once, 4-aligned, after the code
+    eq_(sizes(block), [2, 2, 2, 4, 2, 0, 2, 2 + 3 * 4])
+    data = patch.apply(binary, codebase)
+    eq_(data[0x110:0x11C], pack('<III', 0x12345678, codebase + 0x10D,
+                                0xFFFFFFFF))
+    for offset in (0x100, 0x102):
+        d = disasm.decode(unpack('<H', data[offset:offset + 2])[0],
+                          addr=codebase + offset)
+        eq_(d.target, codebase + 0x110)
+
+def test_literal_pool_ltorg():
+    binary = b'\0' * 0x1000
+    library, patch, passes = build(
+        '{\nLDR R0, =5\nB skip\nLTORG\nglobal skip\n'
+        'LDR R1, =5\nLDR R2, =6\nBX LR\n}\n', binary)
+    block = patch.blocks[0]
+    # R1 refers back to first pool, so it needs LDR.W
+    eq_(sizes(block), [2, 2, 4, 0, 4, 2, 2, 4])
+    data = patch.apply(binary, codebase)
+    eq_(data[0x104:0x108], pack('<I', 5))
+    eq_(data[0x110:0x114], pack('<I', 6))
+    d = disasm.decode(*unpack('<HH', data[0x108:0x10C]), addr=codebase + 0x108)
+    eq_(d.mnemonic, 'LDR.W')
+    eq_(d.target, codebase + 0x104)
+
+@raises(ParseError)
+def test_literal_without_value():
+    parseFile(source('{\nLDR R0, =\n}\n'),
+              libpatch=Patch('library', binary=b'\0'))
+
+def test_exact_size():
+    binary = b'\0' * 0x1000
+    library = Patch('library', binary=binary)
+    patch = parseFile(source('{\nNOP\nALIGN 4\nDCD 1\n}\n{\nNOP\n}\n'),
+                      libpatch=library)
+    block = patch.blocks[0]
+    eq_([block.sizeAt(addr) for addr in range(0x100, 0x104)], [8, 7, 6, 9])
+    ranges = Ranges()
+    ranges.add(0x102, 0x200)
+    layout([library, patch], binary, ranges, codebase)
+    # no space is reserved for ALIGN which appears to be empty
+    eq_(block.mask.size, 6)
+    eq_(block.getCode(), b'\x00\xbf\x01\x00\x00\x00')
+    eq_(patch.blocks[1].getPosition(), 0x108)
+    eq_(ranges.save()[0], [[0x10A, 0x200]])
+
+def test_symbols_resolved():
+    binary = b'\0' * 0x1000
+    library, patch, passes = build(
+        '{\nB.W there\nlocal: NOP\nB local\nglobal there\nBX LR\n}\n',
+        binary)
+    labels = [l for i in patch.blocks[0].instructions
+              for l in i.references()]
+    eq_([l.addr for l in labels], [codebase + 0x108, codebase + 0x104])
+
+def test_symbol_errors():
+    binary = b'\0' * 0x1000
+    try:
+        build('{\nglobal dup\nB nowhere\nBL missing\n}\n'
+              '{\nglobal dup\nBX LR\n}\n', binary)
+    except SymbolError as e:
+        # all problems are reported at once
+        eq_(len(e.problems), 3)
+        assert 'Duplicate global label dup' in e.problems[0]
+        assert 'Undefined label nowhere' in e.problems[1]
+        assert 'Undefined label missing' in e.problems[2]
+    else:
+        raise AssertionError("SymbolError not raised")
+
+def test_drop_unused():
+    library = Patch('library', binary=b'\0' * 0x1000)
+    parseFile(source('{\nglobal used\nB helper\n}\n'
+                     '{\nglobal helper\nBX LR\n}\n'
+                     '{\nglobal unused\nB helper\n}\n'
+                     '{\nglobal kept\nBX LR\n}\n', 'lib.pbp'),
+              patch=library)
+    patch = parseFile(source('@ 00 00 {\nBL used\n}\n'
+                             '{\nglobal own\nBX LR\n}\n'), libpatch=library)
+    removed = dropUnused([library, patch], keep=['kept'])
+    eq_(sorted([b.instructions[0].name for b in removed]), ['own', 'unused'])
+    eq_([b.instructions[0].name for b in library.blocks],
+        ['used', 'helper', 'kept'])
+    eq_(len(patch.blocks), 1)
+
+def test_fold_identical():
+    binary = b'\0' * 0x1000
+    library = Patch('library', binary=binary)
+    helper = '{\nglobal %s\nCMP R0, 0\nBEQ done\nLDR R0, =0x1234\ndone:\nBX LR\n}\n'
+    one = parseFile(source(helper % 'helper' +
+                           '{\nglobal call1\nB.W helper\n}\n', 'one.pbp'),
+                    libpatch=library)
+    two = parseFile(source(helper % 'helper' +
+                           '{\nglobal call2\nB.W helper\n}\n'
+                           '{\nglobal other\nLDR R0, =0x1235\nBX LR\n}\n',
+                           'two.pbp'), libpatch=library)
+    folded = foldIdentical([library, one, two])
+    # helpers first, then callers which became identical
+    eq_(len(folded), 2)
+    eq_(len(one.blocks), 2)
+    eq_(len(two.blocks), 1)
+    ranges = Ranges()
+    ranges.add(0x100, 0x400)
+    layout([library, one, two], binary, ranges, codebase)
+    eq_(one.context['helper'], two.context['helper'])
+    eq_(one.context['call1'], two.context['call2'])
+    eq_(two.context['other'], codebase + 0x110)
+
+def test_reuse_map():
+    binary = b'\0' * 0x1000
+    text = '{\nglobal one\nBX LR\n}\n{\nglobal two\nB one\n}\n'
+    library, patch, passes = build(text, binary)
+    linkmap = makeMap([library, patch], codebase)
+    eq_([b['source'] for b in linkmap['blocks']], ['ranges', 'ranges'])
+    eq_([s['addr'] for s in linkmap['symbols']],
+        [codebase + 0x100, codebase + 0x102])
+    # new block goes to free space instead of moving old ones
+    library = Patch('library', binary=binary)
+    patch = parseFile(source('{\nglobal new\nNOP\nNOP\n}\n' + text),
+                      libpatch=library)
+    eq_(reuseMap([library, patch], linkmap), 2)
+    ranges = Ranges()
+    ranges.add(0x100, 0x400)
+    layout([library, patch], binary, ranges, codebase)
+    eq_([patch.context[n] - codebase for n in ('new', 'one', 'two')],
+        [0x104, 0x100, 0x102])
+    eq_([b['source'] for b in makeMap([patch], codebase)['blocks']],
+        ['ranges', 'map', 'map'])
+
+def test_block_hash_shift():
+    binary = b'\0' * 0x1000
+    def hashes(text):
+        library = Patch('library', binary=binary)
+        patch = parseFile(source('{\nglobal f\nBX LR\n}\n' + text),
+                          libpatch=library)
+        return [blockHash(b) for b in patch.blocks]
+    eq_(hashes('{\nB f\n}\n'), hashes('{\nB f\n}\n'))
+    for a, b in [('B f', 'B f+2'), ('DCD f', 'DCD f+1'),
+                 ('LDR R0, =f', 'LDR R0, =f+1')]:
+        old, new = hashes('{\n%s\n}\n' % a), hashes('{\n%s\n}\n' % b)
+        eq_(old[0], new[0])
+        assert old[1] != new[1], (a, b)
@@ -1,6 +1,7 @@
-from libpatcher.parser import parseFile
+from libpatcher.parser import parseFile, parseFiles, iterBlocks, ParseErrors
 from libpatcher.patch import Patch
 from pprint import pprint
+from nose.tools import eq_
 
 def test_file():
     try:
@@ -10,3 +11,73 @@ def test_file():
     patch = parseFile(f, libpatch=Patch('library', binary=b'bin'))
     print(patch)
     pprint(patch.blocks)
+
+def test_files_parallel():
+    import os, shutil, tempfile
+    tmp = tempfile.mkdtemp()
+    try:
+        def mkfile(name, text):
+            path = os.path.join(tmp, name)
+            with open(path, 'w') as f:
+                f.write(text)
+            return path
+        mkfile('lib.pbp', '#define fromlib\n{\nglobal libproc\nBX LR\n}\n')
+        first = mkfile('first.pbp',
+                       '#define first 1\n#include lib.pbp\n'
+                       '00 bf @ {\nNOP\n}\n')
+        second = mkfile('second.pbp',
+                        '#ifdef first\n#ifdef fromlib\n'
+                        '"OK" @ {\nMOV R0, 1\n}\n#endif\n#else\n'
+                        '"Bad" @ {\nMOV R0, 2\n}\n#endif\n')
+        results = []
+        for jobs in (1, 2):
+            library = Patch('library', binary=b'bin')
+            definitions = {}
+            patches = parseFiles([first, second], definitions,
+                                 libpatch=library, jobs=jobs)
+            results.append((repr(patches), repr(library.blocks),
+                            repr([p.blocks for p in patches]), definitions))
+            for p in patches:
+                for b in p.blocks:
+                    assert b.patch is p
+            for b in library.blocks:
+                assert b.patch is library
+        eq_(results[0], results[1])
+        assert "<global label:libproc>" in results[1][1]
+        assert "<MOV R0,1>" in results[1][2]
+    finally:
+        shutil.rmtree(tmp)
+
+def test_disabled_region_skipped():
+    import io
+    f = io.StringIO('#ifdef nothing\n"Bad" @ {\n  NOSUCHOP R0\n'
+                    '#ifndef nothing\n#define inner\n#endif\n}\n'
+                    '#else\n"Good" @ {\nNOP\n}\n#endif\n')
+    f.name = 'disabled.pbp'
+    definitions = {}
+    patch = parseFile(f, definitions, libpatch=Patch('library', binary=b'bin'))
+    eq_(len(patch.blocks), 1)
+    eq_(patch.blocks[0].mask.parts, [b'Good'])
+    assert 'inner' not in definitions
+
+def test_all_errors_reported():
+    import io
+    f = io.StringIO('"One" @ {\n  NOSUCHOP R0\n  MOV R0, 1\n  DCW 0x12345\n}\n'
+                    'zz @ {\n  NOP\n}\n'
+                    '#nosuchcmd\n'
+                    '"Two" @ {\n  NOP\n}\n')
+    f.name = 'errors.pbp'
+    patch = Patch('test', library=Patch('library', binary=b'bin'))
+    errors = []
+    blocks = list(iterBlocks(f, {}, patch, errors))
+    eq_(len(blocks), 1)
+    eq_(blocks[0].mask.parts, [b'Two'])
+    eq_([e.pos.getLnum()+1 for e in errors], [2, 4, 6, 9])
+    f.seek(0)
+    try:
+        parseFile(f, libpatch=Patch('library', binary=b'bin'))
+    except ParseErrors as e:
+        eq_(len(e.errors), 4)
+        assert str(e).startswith("4 parse error(s)")
+    else:
+        assert False, "ParseErrors not raised"
@@ -0,0 +1,59 @@
+from libpatcher.parser import parseFile
+from libpatcher.patch import Patch
+from libpatcher.peephole import optimize, _readsFlags
+from nose.tools import eq_
+from io import StringIO
+
+def parse(text, binary=b'\0' * 0x100):
+    library = Patch('library', binary=binary)
+    f = StringIO(text)
+    f.name = 'test_peephole.pbp'
+    return parseFile(f, libpatch=library)
+
+def opcodes(block):
+    return [i.opcode for i in block.instructions if i.opcode]
+
+def test_branch_to_next():
+    patch = parse('{\nCMP R0, 1\nBEQ next\nB.W next\nnext:\nBX LR\n}\n')
+    (block, size, cycles), = optimize([patch])
+    eq_(opcodes(block), ['CMP', 'BX'])
+    eq_(size, 6)
+    eq_(cycles, 4)
+
+def test_push_pop():
+    patch = parse('{\nPUSH {R4,LR}\nPOP {R4,LR}\nPUSH {R4}\nPOP {R5}\n}\n')
+    optimize([patch])
+    eq_(opcodes(patch.blocks[0]), ['PUSH', 'POP'])
+
+def test_mov_flags():
+    # first MOV.W is followed by BEQ which uses flags, so it must stay
+    patch = parse('{\nCMP R0, 1\nMOV.W R1, 5\nBEQ skip\nMOV.W R2, 5\n'
+                  'MOV R3, R3\nskip:\nBX LR\n}\n')
+    (block, size, cycles), = optimize([patch])
+    eq_([(i.opcode, i.getSize()) for i in block.instructions[1:4]],
+        [('MOV.W', 4), ('BEQ', 2), ('MOVS', 2)])
+    eq_(opcodes(block)[4], 'BX')
+    eq_(size, 4)
+
+def test_reads_flags():
+    # assembler doesn't know these yet, but they may come from elsewhere
+    for opcode in ['ADC', 'ADCS', 'SBC', 'SBCS', 'SBCS.W', 'BEQ', 'BNE.W']:
+        eq_(_readsFlags(opcode), True)
+    for opcode in ['B', 'ADDS', 'SUBS', 'MOVS', 'CMP']:
+        eq_(_readsFlags(opcode), False)
+
+def test_literals():
+    patch = parse('{\nLDR R0, =5\nLDR R1, =0x12345678\nLDR R8, =0x1234\n'
+                  'LDR R2, =0xFF00\nBX LR\n}\n')
+    (block, size, cycles), = optimize([patch])
+    eq_([(i.opcode, i.getSize()) for i in block.instructions[:4]],
+        [('MOVS', 2), ('LDR', 2), ('MOV.W', 4), ('MOV.W', 4)])
+    # only one value remains in pool
+    eq_([e.name for e in block.instructions[-1].entries], ['=0x12345678'])
+    eq_(cycles, 3)
+
+def test_masked_untouched():
+    patch = parse('"MARK" {\nB next\nnext:\nNOP\n}\n',
+                  b'\0' * 0x80 + b'MARK' + b'\0' * 0x7C)
+    eq_(optimize([patch]), [])
+    eq_(opcodes(patch.blocks[0]), ['B', 'NOP'])
@@ -0,0 +1,92 @@
+from libpatcher.refs import RefIndex
+from libpatcher.tests.test_xrefdb import movw
+from nose.tools import eq_
+from struct import pack
+import os
+import random
+
+base = 0x8004000
+
+def genCode(pos, to, is_bl):
+    " BL/B.W encoding as findrefs.py always generated it "
+    offset = (to - (pos + 4)) >> 1
+    if abs(offset) >= 1 << 22:
+        return b''
+    hi = (0b11110 << 11) + ((offset >> 11) & 0x7FF)
+    lo = ((0b11111 if is_bl else 0b10111) << 11) + (offset & 0x7FF)
+    return pack('<HH', hi, lo)
+
+def scan(data, val):
+    " Plain sequential search, as findrefs.py did it "
+    ret = []
+    for i in range(0, len(data) - 3, 2):
+        for ix in (i, i + 1):
+            if data[ix:ix + 4] == pack('<I', val):
+                ret.append((ix, 'DCD'))
+        if data[i:i + 4] == genCode(i + base, val, False):
+            ret.append((i, 'B.W'))
+        if data[i:i + 4] == genCode(i + base, val, True):
+            ret.append((i, 'BL'))
+    return ret
+
+def test_find():
+    rnd = random.Random(1)
+    data = bytearray(os.urandom(0x2001))
+    val = base + 0x1235
+    for n in range(30):
+        pos = rnd.randrange(0, len(data) - 4)
+        if n % 3 == 0:
+            data[pos:pos + 4] = pack('<I', val)
+        else:
+            pos &= ~1
+            data[pos:pos + 4] = genCode(base + pos, val, n % 3 == 1)
+    data = bytes(data)
+    refs = [r for r in RefIndex(data, base).find(val)
+            if r[1] in ('DCD', 'B.W', 'BL')]
+    eq_(refs, scan(data, val))
+    eq_(len(refs), 30)
+
+def test_find_many():
+    rnd = random.Random(2)
+    data = bytearray(os.urandom(0x2000))
+    vals = [base + 0x1001, base + 0x1010, base + 0x1800]
+    for n in range(60):
+        val = vals[n % 3]
+        pos = rnd.randrange(0, len(data) - 4)
+        if n % 2 == 0:
+            data[pos:pos + 4] = pack('<I', val)
+        else:
+            pos &= ~1
+            data[pos:pos + 4] = genCode(base + pos, val, n % 4 == 1)
+    data = bytes(data)
+    index = RefIndex(data, base)
+    results = index.findMany([(v, v + 1) for v in vals])
+    for val, refs in zip(vals, results):
+        eq_(refs, [(off, kind, val) for off, kind in index.find(val)])
+    # branches match with or without thumb bit, others only exact value
+    eq_([r[:2] for r in index.findRange(base + 0x1000, base + 0x1001)],
+        [r for r in index.find(base + 0x1000) if r[1] != 'DCD'])
+    refs = index.findRange(base + 0x1000, base + 0x1801)
+    expected = []
+    for val in range(base + 0x1000, base + 0x1801):
+        expected += [(off, kind) for off, kind in index.find(val)
+                     if kind in ('DCD', 'LDR', 'MOVW') or val % 2 == 0]
+    eq_(sorted(r[:2] for r in refs), sorted(expected))
+
+def test_loads():
+    val = base + 0x1235
+    data = bytearray(0x100)
+    data[0x40:0x44] = pack('<I', val)
+    # LDR R0, [PC, 0x3C] at 2; LDR.W R1, [PC, 0x38] at 4
+    data[2:4] = pack('<H', 0x4800 | 0x3C // 4)
+    data[4:8] = pack('<HH', 0xF8DF, 0x1000 | 0x38)
+    # LDR.W R2, [PC, -0x14] at 0x50
+    data[0x50:0x54] = pack('<HH', 0xF85F, 0x2014)
+    data[0x80:0x88] = movw(3, val & 0xFFFF) + movw(3, val >> 16, True)
+    data = bytes(data)
+    index = RefIndex(data, base)
+    expected = [(2, 'LDR'), (4, 'LDR'), (0x40, 'DCD'), (0x50, 'LDR'),
+                (0x80, 'MOVW')]
+    eq_(index.find(val), expected)
+    eq_(index.findRange(val, val + 1),
+        [(off, kind, val) for off, kind in expected])
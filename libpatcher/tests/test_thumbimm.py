@@ -0,0 +1,61 @@
+from libpatcher import thumbimm
+from nose.tools import eq_, raises
+import random
+
+def reference_encode(n):
+    " Brute-force rotating encoder which was used by asm before "
+    if n <= 0xFF:
+        return n
+    b1 = n >> 24
+    b2 = (n >> 16) & 0xFF
+    b3 = (n >> 8) & 0xFF
+    b4 = n & 0xFF
+    if b1 == b2 == b3 == b4:
+        return (0b11 << 8) + b1
+    if b1 == 0 and b3 == 0 and b2 == b4:
+        return (0b01 << 8) + b2
+    if b2 == 0 and b4 == 0 and b1 == b3:
+        return (0b10 << 8) + b1
+    def rol(n, ofs):
+        return ((n << ofs) & 0xFFFFFFFF) | (n >> (32 - ofs))
+    for i in range(0b1000, 32):
+        val = rol(n, i)
+        if((val & 0xFFFFFF00) == 0 and
+           (val & 0xFF) == 0x80 + (val & 0x7F)):
+            return ((i << 7) & 0xFFF) + (val & 0x7F)
+    raise ValueError
+
+def test_all_encodable_values():
+    values = set()
+    for imm12 in range(0x1000):
+        try:
+            value = thumbimm.decode(imm12)
+        except ValueError:
+            continue
+        values.add(value)
+        code = thumbimm.encode(value)
+        eq_(code, reference_encode(value))
+        eq_(thumbimm.decode(code), value)
+    # some values have several encodings
+    assert len(values) > 3000
+
+def test_not_encodable_values():
+    rnd = random.Random(1)
+    for i in range(20000):
+        value = rnd.getrandbits(rnd.randint(9, 32))
+        try:
+            expected = reference_encode(value)
+        except ValueError:
+            expected = None
+        try:
+            code = thumbimm.encode(value)
+        except ValueError:
+            code = None
+        eq_(code, expected)
+
+def test_negative():
+    eq_(thumbimm.encode(-1), 0x3FF)
+
+@raises(ValueError)
+def test_too_large():
+    thumbimm.encode(1 << 32)
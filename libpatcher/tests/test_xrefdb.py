@@ -0,0 +1,49 @@
+from libpatcher.refs import movPairs
+from libpatcher.xrefdb import XrefDB
+from libpatcher.tests.test_disasm import assemble, codebase
+from nose.tools import eq_
+from struct import pack
+import os
+import shutil
+import tempfile
+
+def movw(rd, imm, top=False):
+    hw1 = 0xF240 | (imm >> 12) | (imm >> 1 & 0x400) | (0x80 if top else 0)
+    hw2 = (imm << 4 & 0x7000) | rd << 8 | imm & 0xFF
+    return pack('<HH', hw1, hw2)
+
+def test_mov_pairs():
+    data = (b'\0\0' + movw(0, 0x5678) + movw(1, 0x1111) + b'\0\0' +
+            movw(0, 0x1234, True) + movw(2, 0x2222, True))
+    offs, values = movPairs(data)
+    eq_(list(offs), [2])
+    eq_(list(values), [0x12345678])
+
+def test_xrefdb():
+    func = codebase + 0x40
+    code = assemble(['BL func', 'NOP', 'LDR R0, [PC, 8]', 'B.W func'],
+                    context={'func': func})
+    code += b'\0' * (8 - len(code) % 8) + pack('<I', func + 1)
+    pool = codebase + len(code) - 4
+    code += movw(3, func + 1 & 0xFFFF) + movw(3, func >> 16, True)
+    code += b'\0' * (0x40 - len(code)) + assemble(['BL start'], func,
+                                                 {'start': codebase})
+    tmp = tempfile.mkdtemp()
+    try:
+        db = XrefDB.open(code, codebase, tmp)
+        eq_(os.listdir(tmp), [os.path.basename(db.filename)])
+        refs = db.refsTo(func)
+        eq_([kind for source, target, kind in refs],
+            ['BL', 'LDR', 'B', 'DCD', 'MOVW'])
+        eq_(refs[1], (codebase + 6, func + 1, 'LDR'))
+        eq_(db.refsTo(pool), [(codebase + 6, pool, 'literal')])
+        eq_(db.calls(codebase), [(codebase, func, 'BL')])
+        eq_(db.calls(func, func + 4), [(func, codebase, 'BL')])
+        eq_(len(db.refsFrom(func, func + 4)), 1)
+        db.close()
+        # second open reuses the file
+        db = XrefDB.open(code, codebase, tmp)
+        eq_(len(db.refsInto(codebase, codebase + len(code))), 7)
+        db.close()
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,58 @@
+# This module encodes and decodes Thumb-2 "modified immediate" constants,
+# i.e. 12-bit i:imm3:imm8 fields expanded by ThumbExpandImm function.
+
+from functools import lru_cache
+
+__all__ = ['encode', 'decode']
+
+
+@lru_cache(maxsize=4096)
+def encode(value):
+    """
+    Encodes 32-bit value to its 12-bit i:imm3:imm8 form.
+    Negative values are taken as 32-bit two's complement.
+    Raises ValueError if value cannot be encoded.
+    """
+    if abs(value) > 0xFFFFFFFF:
+        raise ValueError("Value too large: 0x%X" % value)
+    value &= 0xFFFFFFFF
+    if value <= 0xFF:  # 1 byte
+        return value
+    b1 = value >> 24
+    b2 = (value >> 16) & 0xFF
+    b3 = (value >> 8) & 0xFF
+    b4 = value & 0xFF
+    if b1 == b2 == b3 == b4:
+        return (0b11 << 8) + b1
+    if b1 == 0 and b3 == 0 and b2 == b4:
+        return (0b01 << 8) + b2
+    if b2 == 0 and b4 == 0 and b1 == b3:
+        return (0b10 << 8) + b1
+    # Otherwise it must be 8 bits with the topmost one set,
+    # rotated right by 8..31 bits.
+    # As value > 0xFF, these bits cannot wrap around bit 0,
+    # so rotation is determined by the highest set bit.
+    shift = value.bit_length() - 8
+    if value & ((1 << shift) - 1):
+        raise ValueError("Value cannot be encoded: 0x%X" % value)
+    rot = 32 - shift
+    return (rot << 7) + ((value >> shift) & 0x7F)
+
+
+@lru_cache(maxsize=4096)
+def decode(imm12):
+    """
+    Returns 32-bit value which given 12-bit i:imm3:imm8 field encodes.
+    Raises ValueError for invalid (unpredictable) encodings.
+    """
+    if not 0 <= imm12 <= 0xFFF:
+        raise ValueError("Not a 12-bit field: 0x%X" % imm12)
+    imm8 = imm12 & 0xFF
+    if imm12 >> 10 == 0:
+        mode = (imm12 >> 8) & 0b11
+        if mode and not imm8:
+            raise ValueError("Unpredictable encoding: 0x%X" % imm12)
+        return imm8 * (0x1, 0x00010001, 0x01000100, 0x01010101)[mode]
+    unrotated = 0x80 + (imm12 & 0x7F)
+    rot = imm12 >> 7
+    return ((unrotated >> rot) | (unrotated << (32 - rot))) & 0xFFFFFFFF
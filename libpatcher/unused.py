@@ -0,0 +1,75 @@
+# This module removes floating blocks nobody refers to,
+# like linker's --gc-sections does.
+from .asm import LabelInstruction, ValInstruction, LiteralPool
+
+__all__ = ['dropUnused']
+
+def _names(block):
+    """
+    Returns set of local names defined by given block
+    and set of (patch, name) pairs for its globals.
+    Works on unbound blocks.
+    """
+    local, glob = set(), set()
+    for i in block.instructions:
+        if isinstance(i, LabelInstruction):
+            if i.glob:
+                glob.add((i.owner or block.patch, i.name))
+            else:
+                local.add(i.name)
+        elif isinstance(i, ValInstruction):
+            glob.add((block.patch, i.name))
+        elif isinstance(i, LiteralPool):
+            local.update([e.name for e in i.entries])
+    return local, glob
+
+def dropUnused(patches, keep=()):
+    """
+    Removes floating blocks which cannot be reached
+    by following label references from mask-anchored blocks
+    or from blocks defining global labels listed in keep.
+    Library patch's globals are visible from all patches,
+    as for label lookup.
+    Should be called on unbound patches, library first.
+    Returns list of removed blocks.
+    """
+    locals_ = {}
+    owners = {}  # (patch, name) -> blocks defining that global
+    for p in patches:
+        for block in p.blocks:
+            local, glob = _names(block)
+            locals_[block] = local
+            for key in glob:
+                owners.setdefault(key, []).append(block)
+
+    def targets(block):
+        " Blocks which given block refers to "
+        for i in block.instructions:
+            for label in i.references():
+                if label.name in locals_[block]:
+                    continue
+                for key in ((block.patch, label.name),
+                            (block.patch.library, label.name)):
+                    if key in owners:
+                        for b in owners[key]:
+                            yield b
+                        break
+
+    pending = [b for p in patches for b in p.blocks
+               if not b.mask or not b.mask.floating]
+    for name in keep:
+        for p in patches:
+            pending.extend(owners.get((p, name), []))
+    reached = set()
+    while pending:
+        block = pending.pop()
+        if block in reached:
+            continue
+        reached.add(block)
+        pending.extend(targets(block))
+
+    removed = []
+    for p in patches:
+        removed.extend([b for b in p.blocks if b not in reached])
+        p.blocks[:] = [b for b in p.blocks if b in reached]
+    return removed
@@ -0,0 +1,177 @@
+# This module stores all references found in firmware binary
+# in SQLite database, so that they may be queried instantly.
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+from . import disasm
+from .refs import movPairs
+
+__all__ = ['XrefDB']
+
+# schema version; databases of other versions are rebuilt
+VERSION = 1
+
+_conds = set(['EQ', 'NE', 'CS', 'CC', 'MI', 'PL', 'VS', 'VC',
+              'HI', 'LS', 'GE', 'LT', 'GT', 'LE'])
+
+def _kind(mnemonic):
+    " Kind of reference made by instruction with given mnemonic "
+    base = mnemonic[:-2] if mnemonic.endswith('.W') else mnemonic
+    if base in ('B', 'BL', 'ADR'):
+        return base
+    if base in ('CBZ', 'CBNZ'):
+        return 'CBZ'
+    if base[0] == 'B' and base[1:] in _conds:
+        return 'Bcc'
+    if base == 'LDR':
+        return 'literal'
+    return base
+
+def _references(data, base):
+    """
+    Returns (sources, targets, kinds) arrays for all references in binary:
+    branches and literal addresses found by linear sweep
+    (kinds B, BL, Bcc, CBZ, ADR, literal),
+    values loaded from literal pools (LDR),
+    MOVW/MOVT pairs (MOVW) and 4-aligned pointers into binary (DCD).
+    """
+    d = disasm.disassemble(data, base)
+    table = disasm._getTable()
+    kinds = np.array([_kind(e.opcode) for e in table] + ['?'])
+    sel = np.nonzero(d.target >= 0)[0]
+    sources = [d.addr[sel]]
+    targets = [d.target[sel]]
+    names = [kinds[d.entry[sel]]]
+
+    # values of literal pool words
+    lit = sel[names[0] == 'literal']
+    pool = d.target[lit] - base
+    ok = (pool >= 0) & (pool + 4 <= len(data))
+    words = np.frombuffer(data[:len(data) // 4 * 4], '<u4')
+    inpool = pool[ok]
+    aligned = inpool % 4 == 0  # literal loads are always word-aligned
+    sources.append(d.addr[lit][ok][aligned])
+    targets.append(words[inpool[aligned] // 4].astype(np.int64))
+    names.append(np.full(np.count_nonzero(aligned), 'LDR'))
+
+    offs, values = movPairs(data)
+    sources.append(offs + base)
+    targets.append(values)
+    names.append(np.full(len(offs), 'MOVW'))
+
+    ptr = np.nonzero((words >= base) & (words < base + len(data)))[0]
+    sources.append(ptr * 4 + base)
+    targets.append(words[ptr].astype(np.int64))
+    names.append(np.full(len(ptr), 'DCD'))
+    return (np.concatenate(sources), np.concatenate(targets),
+            np.concatenate(names))
+
+
+class XrefDB(object):
+    """
+    Database of references in firmware binary.
+    Each reference is (source, target, kind) with addresses
+    (target may have thumb bit set, as loaded from memory).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+
+    @classmethod
+    def build(cls, data, base, filename):
+        " Indexes given binary into new database file "
+        tmp = filename + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        db = sqlite3.connect(tmp)
+        db.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+            CREATE TABLE refs (source INTEGER, target INTEGER, kind TEXT);
+        """)
+        db.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ('version', VERSION), ('base', base),
+            ('sha1', hashlib.sha1(data).hexdigest())])
+        sources, targets, kinds = _references(data, base)
+        db.executemany("INSERT INTO refs VALUES (?, ?, ?)",
+                       zip(sources.tolist(), targets.tolist(),
+                           kinds.tolist()))
+        db.executescript("""
+            CREATE INDEX refs_target ON refs (target);
+            CREATE INDEX refs_source ON refs (source);
+        """)
+        db.commit()
+        db.close()
+        os.replace(tmp, filename)
+        return cls(filename)
+
+    @classmethod
+    def open(cls, data, base=0x8004000, dirname='.'):
+        """
+        Opens database for given binary in given directory,
+        building it first if needed.
+        File is named after binary's hash.
+        """
+        filename = os.path.join(dirname, '%s-%X.xrefs.sqlite' % (
+            hashlib.sha1(data).hexdigest(), base))
+        if os.path.exists(filename):
+            ret = cls(filename)
+            if ret.meta('version') == VERSION:
+                return ret
+            ret.close()
+        return cls.build(data, base, filename)
+
+    def close(self):
+        self.db.close()
+
+    def meta(self, key):
+        try:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?",
+                                  (key,)).fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return row[0] if row else None
+
+    def _query(self, where, args):
+        return self.db.execute(
+            "SELECT source, target, kind FROM refs WHERE %s "
+            "ORDER BY source, kind" % where, args).fetchall()
+
+    def refsTo(self, addr):
+        """
+        Returns references to given address, with or without thumb bit.
+        """
+        addr &= ~1
+        return self._query("target BETWEEN ? AND ?", (addr, addr + 1))
+
+    def refsInto(self, start, end):
+        " Returns references to addresses in start..end range "
+        return self._query("target >= ? AND target < ?", (start, end))
+
+    def refsFrom(self, start, end):
+        " Returns references made from start..end range "
+        return self._query("source >= ? AND source < ?", (start, end))
+
+    def functionEnd(self, func):
+        """
+        Guesses where function starting at given address ends:
+        at the next address which is called with BL.
+        """
+        row = self.db.execute(
+            "SELECT MIN(target) FROM refs WHERE kind = 'BL' AND target > ?",
+            (func & ~1,)).fetchone()
+        return row[0]
+
+    def calls(self, func, end=None):
+        """
+        Returns BL references made by function starting at given address;
+        if end is not given, it is guessed with functionEnd().
+        """
+        func &= ~1
+        if end is None:
+            end = self.functionEnd(func) or func + 1
+        return self._query("kind = 'BL' AND source >= ? AND source < ?",
+                           (func, end))
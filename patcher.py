@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 
-from libpatcher import Patch, Ranges, parseFile
+import json
+import os
+
+from libpatcher import Patch, Ranges, parseFiles, layout, dropUnused, \
+    foldIdentical, makeMap, writeMap, loadMap, reuseMap, optimize
 
 def parse_args():
     import argparse
     parser = argparse.ArgumentParser(
         description="Pebble firmware patcher")
-    parser.add_argument("patch", nargs='+', type=argparse.FileType("r"),
+    parser.add_argument("patch", nargs='+',
                         help="File with a patch to apply")
     parser.add_argument("-o", "--output", required=True,
                         type=argparse.FileType("wb"),
@@ -35,8 +39,54 @@ def parse_args():
                         help="Codebase of the binary. "
                         "Defaults to 0x8004000 (which is for 3.x fw); "
                         "for 1.x-2.x set it to 0x8010000")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Number of processes to parse patch files with. "
+                        "Defaults to number of CPUs; use 1 to disable")
+    parser.add_argument("--gc-sections", action="store_true",
+                        help="Don't store floating blocks which are "
+                        "not referred to from mask-anchored blocks")
+    parser.add_argument("--keep", action="append", default=[],
+                        metavar="SYMBOL",
+                        help="Keep floating block defining given global "
+                        "label with --gc-sections; may be repeated")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="Rewrite code of floating blocks "
+                        "to smaller or faster equivalents")
+    parser.add_argument("--icf", action="store_true",
+                        help="Store identical floating blocks only once, "
+                        "e.g. helpers copied to several patch files")
+    parser.add_argument("--map", metavar="FILE",
+                        help="Write where each block and global label "
+                        "was placed to FILE, and as JSON to FILE.json")
+    parser.add_argument("--reuse-map", action="store_true",
+                        help="Keep addresses of floating blocks which "
+                        "didn't change since map given with --map was made")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print estimated cycle counts of all blocks "
+                        "(for Cortex-M3/M4; requires NumPy)")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="With --stats, report blocks which got slower "
+                        "than in FILE; FILE is created if missing")
     return parser.parse_args()
 
+def print_stats(patches, baseline=None):
+    import sys
+    from libpatcher import cycles
+    stats = cycles.patchStats(patches)
+    regressed = []
+    if baseline and os.path.exists(baseline):
+        with open(baseline) as f:
+            regressed = cycles.regressions(stats, cycles.loadBaseline(f))
+    elif baseline:
+        with open(baseline, 'w') as f:
+            cycles.saveBaseline(stats, f)
+    print("Estimated cycles:")
+    cycles.writeStats(stats, sys.stdout,
+                      [(patch, name) for patch, name, old, new in regressed])
+    for patch, name, old, new in regressed:
+        print("Regression: %s in %s: %d -> %d cycles" % (
+            name, patch, old, new))
+
 def patch_fw(args):
     data = args.tintin.read()
 
@@ -61,16 +111,52 @@ def patch_fw(args):
             definitions[d] = True
 
     # Read all requested patch files
-    patches = [library]
     print("Loading files:")
-    for f in args.patch:
-        print(f.name)
-        patches.append(parseFile(f, definitions, libpatch=library))
+    for name in args.patch:
+        print(name)
+    patches = [library] + parseFiles(args.patch, definitions,
+                                     libpatch=library, jobs=args.jobs)
+    if args.gc_sections:
+        removed = dropUnused(patches, args.keep)
+        print("Removed %d unused blocks, saved %d bytes" % (
+            len(removed), sum([b.getSize() for b in removed])))
+        if args.debug:
+            for b in removed:
+                print(b)
+    if args.optimize:
+        optimized = optimize(patches)
+        print("Optimized %d blocks, saved %d bytes and about %d cycles" % (
+            len(optimized), sum([b for block, b, c in optimized]),
+            sum([c for block, b, c in optimized])))
+        if args.debug:
+            for block, b, c in optimized:
+                print("%s: %d bytes, %d cycles" % (block.mask.pos, b, c))
+    if args.icf:
+        folded = foldIdentical(patches)
+        print("Folded %d identical blocks, saved %d bytes" % (
+            len(folded), sum([b.getSize() for kept, b in folded])))
+        if args.debug:
+            for kept, b in folded:
+                print(b)
+    if args.reuse_map and args.map and os.path.exists(args.map + '.json'):
+        with open(args.map + '.json') as f:
+            reused = reuseMap(patches, loadMap(f))
+        print("Reusing placement of %d blocks" % reused)
     # Bind them all to real binary (i.e. scan masks)...
     print("Binding patches:")
     for p in patches:  # including library
         print(p)
-        p.bindall(data, ranges, args.codebase)
+    passes = layout(patches, data, ranges, args.codebase)
+    if args.debug:
+        print("Layout done in %d passes" % passes)
+    if args.map:
+        linkmap = makeMap(patches, args.codebase)
+        with open(args.map, 'w') as f:
+            writeMap(linkmap, f)
+        with open(args.map + '.json', 'w') as f:
+            json.dump(linkmap, f, indent=1)
+    if args.stats:
+        print_stats(patches, args.baseline)
     # ...and apply
     print("Applying patches:")
     for p in patches:
@@ -1,15 +1,25 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # This script updates strings in tintin_fw.bin file
 
 import sys
-from struct import pack, unpack
+from struct import pack
+
+import numpy as np
 
 # data is a loaded tintin_fw file contents
-data = ""
-# datap is an original file converted to list of integers (pointers)
-datap = []
-# datar is data to return
-datar = ""
+data = b""
+# datap maps each value in original file which looks like a valid pointer
+# to list of offsets where it is stored (aligned or not)
+datap = {}
+# datas maps last (up to STRTAIL) chars of each NUL-terminated printable
+# string in original file to list of offsets of NULs ending such strings
+datas = {}
+STRTAIL = 8
+# strends holds, for each offset in original file,
+# offset of NUL ending printable string which starts there, or -1
+strends = None
+# datar is data to return, edited in place
+datar = bytearray()
 
 EOF = 0x70000 - 48
 
@@ -25,19 +35,67 @@ def is_string_pointer(ptr):
     Checks if a number points to somthing similar to string;
     returns string (maybe empty) if it is a valid string or False otherwise
     """
-    def is_string_char(c):
-        return c in "\t\r\n" or (c >= ' ' and c <= '~') # tab, endline or printable latin
-
     if not is_valid_pointer(ptr):
         return False
 
-    for i in range(ptr-0x08010000, len(data)):
-        if data[i] == '\0':
-            #return i - (ptr-0x08010000) # line ended without non-string chars, return strlen
-            return data[ptr-0x08010000:i] # line ended without non-string chars, return it
-        if not is_string_char(data[i]):
-            return False # encountered non-string char, return False
-    return False # reched end of file, return False
+    o = ptr-0x08010000
+    if strends[o] < 0: # non-string char before \0 or end of file
+        return False
+    return data[o:strends[o]]
+
+def index_strings(data):
+    """
+    Finds all NUL-terminated runs of printable chars in given file contents.
+    Returns tuple: (datas dict, strends array - see above)
+    """
+    b = np.frombuffer(data, np.uint8)
+    # tab, endline or printable latin
+    printable = (((b >= 0x20) & (b <= 0x7E)) |
+                 (b == 9) | (b == 10) | (b == 13))
+    edges = np.diff(np.concatenate([[False], printable, [False]]).astype(np.int8))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0] # run ends right before this offset
+    terminated = ends < len(b)
+    terminated[terminated] = b[ends[terminated]] == 0
+    starts = starts[terminated]
+    ends = ends[terminated]
+
+    strends = np.full(len(b), -1, np.int64)
+    lengths = ends - starts
+    # k-th char of each run is at (start of run) + k
+    first = np.cumsum(lengths) - lengths # index of run's first char in list
+    chars = np.repeat(starts - first, lengths) + np.arange(lengths.sum())
+    strends[chars] = np.repeat(ends, lengths)
+    index = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        tail = data[max(start, end - STRTAIL):end]
+        for k in range(len(tail)):
+            index.setdefault(tail[k:], []).append(end)
+    return index, strends
+
+def index_pointers(data):
+    """
+    Builds pointer index for given file contents:
+    dict mapping each value which looks like a valid pointer
+    to sorted list of offsets where it is stored.
+    """
+    offsets = []
+    values = []
+    for align in range(4): # uint32 view of file at each alignment
+        count = max(len(data) - align, 0) // 4
+        words = np.frombuffer(data, '<u4', count, align)
+        found = np.nonzero((words >= 0x08010000) &
+                           (words < 0x08010000 + len(data)))[0]
+        offsets.append(found * 4 + align)
+        values.append(words[found])
+    offsets = np.concatenate(offsets)
+    values = np.concatenate(values)
+    order = np.lexsort((offsets, values))
+    offsets = offsets[order].tolist()
+    values, starts = np.unique(values[order], return_index=True)
+    ends = list(starts[1:]) + [len(offsets)]
+    return dict((v, offsets[a:b]) for v, a, b in
+                zip(values.tolist(), starts.tolist(), ends))
 
 def find_all_strings():
     """
@@ -45,10 +103,10 @@ def find_all_strings():
     Returns array of tuples: (offset, value, string)
     """
     pointers = [] # tuples: offset to pointer, offset to its string, the string itself
-    for i, n in enumerate(datap):
+    for i, n in sorted((i, n) for n, os in datap.items() for i in os):
         s = is_string_pointer(n)
         if s:
-            #print >>log, i,n,s
+            #print(i,n,s, file=log)
             pointers.append((i, n, s))
     return pointers
 
@@ -56,13 +114,16 @@ def find_pointers_to_offset(offset):
     """
     Finds all pointers to given offset; returns offsets to them
     """
-    ptr = offset + 0x08010000
-    return [i for i,v in enumerate(datap) if v == ptr]
+    return datap.get(offset + 0x08010000, [])
 
 def find_string_offsets(s):
-    """ Returns list of offsets to given string """
+    """ Returns list of offsets to given (encoded) string """
+    if all(c in b"\t\r\n" or (c >= 0x20 and c <= 0x7E) for c in s):
+        # it may be only the whole printable string or its tail
+        return [end - len(s) for end in datas.get(s[-STRTAIL:], [])
+                if end >= len(s) and data[end - len(s):end] == s]
     ret = []
-    s = s + '\0' # string in file must end with \0 !
+    s = s + b'\0' # string in file must end with \0 !
     i = data.find(s)
     while i != -1:
         ret.append(i)
@@ -72,8 +133,8 @@ def find_string_offsets(s):
 def parse_args():
     def hexarg(x):
         try:
-            return x.decode("hex")
-        except:
+            return bytes.fromhex(x)
+        except ValueError:
             return int(x,0)
     import argparse
     parser = argparse.ArgumentParser(
@@ -85,9 +146,9 @@ def parse_args():
         "(for strings which have free space after them).")
     parser.add_argument("tintin", nargs='?', default="tintin_fw.bin", type=argparse.FileType("rb"),
                         help="Input tintin_fw file, defaults to tintin_fw.bin")
-    parser.add_argument("output", nargs='?', default=sys.stdout, type=argparse.FileType("wb"),
+    parser.add_argument("output", nargs='?', default=sys.stdout.buffer, type=argparse.FileType("wb"),
                         help="Output file, defaults to stdout")
-    parser.add_argument("-s", "--strings", default=sys.stdin, type=argparse.FileType("r"),
+    parser.add_argument("-s", "--strings", default=sys.stdin, type=argparse.FileType("r", encoding="utf-8"),
                         help="File with strings to translate, by default will read from stdin")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-t", "--txt", dest="old_format", action="store_true",
@@ -131,21 +192,21 @@ def read_strings_txt(f):
             continue
         line = line.replace('\\n', '\n').replace('\\#', '#').replace('\\\\', '\\') # unescape
         if not ':=' in line:
-            print >>log, "Warning: bad line in strings:", line
+            print("Warning: bad line in strings:", line, file=log)
             continue
         left, right = line.split(':=', 1)
         if not right: # empty
-            print >>log, "Warning: translation is empty; ignoring:", line
+            print("Warning: translation is empty; ignoring:", line, file=log)
             continue
         if ':=' in right:
-            print >>log, "Warning: ambigous line in strings:", line
+            print("Warning: ambigous line in strings:", line, file=log)
             continue
         if left.startswith('!'): # inplace translating
             left = left[1:]
             inplace.append(left)
         if left in strings:
-            print >>log, "Warning: duplicate string, ignoring:", line
-            print >>log, "Original: "+strings[left]
+            print("Warning: duplicate string, ignoring:", line, file=log)
+            print("Original: "+strings[left], file=log)
             continue
         strings[left] = right
         keys.append(left)
@@ -157,7 +218,7 @@ def read_strings_po(f, exclude=[]):
         line = line[kwlen :].strip() # remove 'msgid' and spaces
         if line[0] == '"':
             if line[-1] != '"':
-                print >>log, "Warning! Expected '\"' not found in line %d" % line
+                print("Warning! Expected '\"' not found in line %d" % line, file=log)
             line = line[1 :-1] # remove quotes
         line = line.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\') # unescape - TODO: test
         return line
@@ -178,13 +239,13 @@ def read_strings_po(f, exclude=[]):
         line = line[:-1] # remove tralining \n
         if len(line) == 0 : # end of record
             if ref in exclude:
-                #print >>log, "Line %s has ref <%s> which is requested to be excluded; skipping" % (repr(left), ref)
+                #print("Line %s has ref <%s> which is requested to be excluded; skipping" % (repr(left), ref), file=log)
                 skipnum += 1
             elif left: # or else, if left is empty -> ignoring
                 if right: # both left and right are provided
                     # FIXME: support inplace for contexted lines? do we need this at all?
                     if left == right:
-                        print >>log, "Translation = original, ignoring line %s" % left
+                        print("Translation = original, ignoring line %s" % left, file=log)
                     elif left in keys:
                         if context or type(strings[left]) is list: # this or previous is contexted
                             if type(strings[left]) is not list:
@@ -198,11 +259,11 @@ def read_strings_po(f, exclude=[]):
                                     strings[left].append(right)
                                 else: # have such item already
                                     if strings[left][c]:
-                                        print >>log, "Warning: duplicate contexted line %s @ %d" % (left, c)
+                                        print("Warning: duplicate contexted line %s @ %d" % (left, c), file=log)
                                     else:
                                         strings[left][c] = right
                         else:
-                            print >>log, "Warning: ignoring duplicate line %s" % left
+                            print("Warning: ignoring duplicate line %s" % left, file=log)
                     else:
                         keys.append(left)
                         if context != None:
@@ -215,7 +276,7 @@ def read_strings_po(f, exclude=[]):
                         if inplace:
                             inplaces.append(left)
                 else: # only left provided -> line untranslated, ignoring
-                    print >>log, "Ignoring untranslated line %s" % left
+                    print("Ignoring untranslated line %s" % left, file=log)
             # now clear scratchpad
             left = None
             right = None
@@ -246,9 +307,10 @@ def read_strings_po(f, exclude=[]):
                 try:
                     context.append(int(num))
                 except ValueError:
-                    print >>log, "*** ERROR: %s is not an integer "
-                    "or comma-separated list of integers "
-                    "and not a supported flag (line %s)" % (num, line)
+                    print("*** ERROR: %s is not an integer "
+                          "or comma-separated list of integers "
+                          "and not a supported flag (line %s)" % (num, line),
+                          file=log)
             if not context: # only inplace flag
                 context = None
         elif line.startswith('"'): # continuation?
@@ -257,26 +319,36 @@ def read_strings_po(f, exclude=[]):
             elif left is not None:
                 left += parsevalline(line, 0)
             else:
-                print >>log, "Warning: unexpected continuation line: %s" % line
+                print("Warning: unexpected continuation line: %s" % line, file=log)
         else:
-            print >>log, "Warning: unexpected line in input: %s" % line
+            print("Warning: unexpected line in input: %s" % line, file=log)
     if skipnum:
-        print >>log, "Excluded %d lines as requested" % skipnum
+        print("Excluded %d lines as requested" % skipnum, file=log)
     return strings, keys, inplaces
 
+def encode_strings(strings, keys, inplace):
+    """
+    Converts strings read from file to UTF-8 bytes,
+    as they are stored in firmware
+    """
+    def enc(s):
+        return s.encode('utf-8') if s is not None else None
+    ret = {}
+    for k, v in strings.items():
+        ret[enc(k)] = [enc(x) for x in v] if type(v) is list else enc(v)
+    return ret, [enc(k) for k in keys], [enc(k) for k in inplace]
+
 def translate_fw(args):
-    global data, datap, datar, log
-    if args.output == log == sys.stdout:
-        log = sys.stderr # if writing new tintin to sdout, print >>log, all messages to stderr to avoid cluttering
+    global data, datap, datas, strends, datar, log
+    if args.output is sys.stdout.buffer and log is sys.stdout:
+        log = sys.stderr # if writing new tintin to sdout, print all messages to stderr to avoid cluttering
 
     # load source fw:
     data = args.tintin.read()
-    datar = data # start from just copy, later will change it
-    # convert to pointers:
-    for i in range(0, len(data)-3): # each 4-aligned int; -3 to avoid last (partial) value.
-        # Also include not-aligned values
-        n = unpack("I", data[i:i+4])[0]
-        datap.append(n)
+    datar = bytearray(data) # start from just copy, later will change it
+    # index pointers (including not-aligned values):
+    datap = index_pointers(data)
+    datas, strends = index_strings(data)
 
     ranges = []
     def addrange(start, end):
@@ -286,56 +358,56 @@ def translate_fw(args):
                 ranges.remove(r) # remove as it is unneeded
                 continue # to next range
             if start == r[0] and end == r[1]: # duplicate
-                print >>log, "### Duplicate range %x-%x, skipping." % (start, end)
+                print("### Duplicate range %x-%x, skipping." % (start, end), file=log)
                 return
             if start >= r[0] and end <= r[1]: # fully inside; ignore
-                print >>log, "### Range clash!! This must be an error! Range %x-%x fits within %x-%x; ignoring" % (
-                    start, end, r[0], r[1])
+                print("### Range clash!! This must be an error! Range %x-%x fits within %x-%x; ignoring" % (
+                    start, end, r[0], r[1]), file=log)
                 return
             if start <= r[0] and end >= r[1]:
                 # fully outside; replace. FIXME : this might introduce clashes with other ranges
-                print >>log, "### Range clash!! This must be an error! Range %x-%x contained in %x-%x; replacing" % (
-                    start, end, r[0], r[1])
+                print("### Range clash!! This must be an error! Range %x-%x contained in %x-%x; replacing" % (
+                    start, end, r[0], r[1]), file=log)
                 r[0] = start
                 r[1] = end
                 return
             if start <= r[0] and end > r[0]: # clash with beginning; truncate
-                print >>log, "### Range clash!! This must be an error! Range %x-%x clashes with %x-%x; truncating" % (
-                    start, end, r[0], r[1])
+                print("### Range clash!! This must be an error! Range %x-%x clashes with %x-%x; truncating" % (
+                    start, end, r[0], r[1]), file=log)
                 end = r[0]
             if start < r[1] and end >= r[1]: # clash with end; truncate
-                print >>log, "### Range clash!! This must be an error! Range %x-%x clashes with %x-%x; truncating" % (
-                    start, end, r[0], r[1])
+                print("### Range clash!! This must be an error! Range %x-%x clashes with %x-%x; truncating" % (
+                    start, end, r[0], r[1]), file=log)
                 start = r[1]
         for r in ranges: # another loop for neighbours - now when we surely have no clashes
             if r[1] == start:
-                print >>log, " #  Range neighbourhood, merging %x-%x to %x-%x" % (
-                    start, end, r[0], r[1])
+                print(" #  Range neighbourhood, merging %x-%x to %x-%x" % (
+                    start, end, r[0], r[1]), file=log)
                 r[1] = end
                 return
             if end == r[0]:
-                print >>log, " #  Range neighbourhood, merging %x-%x to %x-%x" % (
-                    start, end, r[0], r[1])
+                print(" #  Range neighbourhood, merging %x-%x to %x-%x" % (
+                    start, end, r[0], r[1]), file=log)
                 r[0] = start
                 return
         ranges.append([start, end])
     for r in args.ranges or []:
         if len(r) == 3: # signature-specified range - convert it to offsets
-            if type(r[0]) != str or type(r[1]) != str or type(r[2]) != int:
-                print >>log, "-Warning: invalid range mask specification %s; ignoring" % repr(r)
+            if type(r[0]) != bytes or type(r[1]) != bytes or type(r[2]) != int:
+                print("-Warning: invalid range mask specification %s; ignoring" % repr(r), file=log)
                 continue
             start = data.find(r[0])
             if start < 0:
-                print >>log, "-Warning: starting mask %s not found, ignoring this range" % repr(r[0])
+                print("-Warning: starting mask %s not found, ignoring this range" % repr(r[0]), file=log)
                 continue
             end = start+data[start:].find(r[1])
             if end < start:
-                print >>log, "-Warning: start at 0x%X, ending mask %s not found, ignoring this range" % (start, repr(r[1]))
+                print("-Warning: start at 0x%X, ending mask %s not found, ignoring this range" % (start, repr(r[1])), file=log)
                 continue
             length = end + len(r[1]) - start
             if length != r[2]:
-                print >>log, ("-Warning: length mismatch for range %s..%s (0x%X..0x%X), expected %d, found %d; "+
-                        "ignoring this range") % (repr(r[0]), repr(r[1]), start, end, r[2], length)
+                print(("-Warning: length mismatch for range %s..%s (0x%X..0x%X), expected %d, found %d; "+
+                        "ignoring this range") % (repr(r[0]), repr(r[1]), start, end, r[2], length), file=log)
                 continue
             end += len(r[1]) # append ending mask size
             addrange(start, end)
@@ -347,22 +419,22 @@ def translate_fw(args):
             if start < end:
                 addrange(start, end)
             else:
-                print >>log, "Warning: cannot append to end of file because its size is >= 0x70000 (max fw size)"
+                print("Warning: cannot append to end of file because its size is >= 0x70000 (max fw size)", file=log)
         else:
-            print >>log, "?!? confused: unexpected range", r
+            print("?!? confused: unexpected range", r, file=log)
     if ranges:
-        print >>log, "Using following ranges:"
+        print("Using following ranges:", file=log)
         for r in ranges:
-            print >>log, " * 0x%X..0x%X (%d bytes)" % (r[0], r[1], r[1]-r[0])
+            print(" * 0x%X..0x%X (%d bytes)" % (r[0], r[1], r[1]-r[0]), file=log)
     elif len(ranges) == 0:
-        print >>log, "WARNING: no usable ranges!"
+        print("WARNING: no usable ranges!", file=log)
 
     if args.print_only:
-        print >>log, "Scanning tintin_fw..."
+        print("Scanning tintin_fw...", file=log)
         ptrs = find_all_strings()
-        print >>log, "Found %d referenced strings" % len(ptrs)
+        print("Found %d referenced strings" % len(ptrs), file=log)
         for p in ptrs:
-            args.output.write(p[2]+'\n')
+            args.output.write(p[2]+b'\n')
         args.output.close()
         sys.exit(0)
 
@@ -370,9 +442,10 @@ def translate_fw(args):
         strings, keys, inplace = read_strings_txt(args.strings)
     else:
         strings, keys, inplace = read_strings_po(args.strings, args.exclude)
-    print >>log, "Got %d valid strings to translate" % len(strings)
+    strings, keys, inplace = encode_strings(strings, keys, inplace)
+    print("Got %d valid strings to translate" % len(strings), file=log)
     if not strings:
-        print >>log, "NOTICE: No strings, nothing to do! Will just duplicate fw"
+        print("NOTICE: No strings, nothing to do! Will just duplicate fw", file=log)
 
     npass = 0
     while True:
@@ -381,32 +454,32 @@ def translate_fw(args):
         for key in list(keys): # use clone to avoid breaking on removal
             val = strings[key] # string or list
             vals = val if type(val) is list else [val]
-            print >>log, "Processing", repr(key)
+            print("Processing", repr(key.decode('utf-8')), file=log)
             os = find_string_offsets(key)
             if not os: # no such string
-                print >>log, " -- not found, ignoring"
+                print(" -- not found, ignoring", file=log)
                 continue
             if type(val) is list: # contexted
                 if len(os) < len(val):
-                    print >>log, " ** Warning: too many contexts given for %s" % key
+                    print(" ** Warning: too many contexts given for %s" % key.decode('utf-8'), file=log)
                 elif len(os) > len(val):
-                    #print >>log, " ** Warning: too few contexts given for %s" % key
+                    #print(" ** Warning: too few contexts given for %s" % key, file=log)
                     # not all contexts may need to be translated
                     val += [None] * (len(os) - len(val)) # pad it with Nones to avoid Index out of bounds
             mustrepoint=[] # list of "inplace" key occurances which cannot be replaced inplace
             if (type(val) is not list # val is not contexted
                 and (len(val) <= len(key) or key in inplace)): # can just replace
                 # but will not replace contexted vals
-                print >>log, " -- found %d occurance(s), replacing" % len(os)
+                print(" -- found %d occurance(s), replacing" % len(os), file=log)
                 for idx, o in enumerate(os):
                     doreplace = True
-                    print >>log, " -- 0x%X:" % o,
+                    print(" -- 0x%X:" % o, file=log, end=' ')
                     if key in inplace and len(val) > len(key) and not args.force: # check that "rest" has only \0's
                         rest = datar[o+len(key):o+32]
                         for i in range(len(rest)):
-                            if rest[i] != '\0':
-                                print >>log, " ** SKIPPING because overwriting is unsafe here; use -f to override. "+\
-                                        "Will try to rewrite pointers."
+                            if rest[i] != 0:
+                                print(" ** SKIPPING because overwriting is unsafe here; use -f to override. "+
+                                        "Will try to rewrite pointers.", file=log)
                                 mustrepoint.append(o)
                                 doreplace = False # don't replace this occurance
                                 break # break inner loop
@@ -420,19 +493,19 @@ def translate_fw(args):
                     for i in range(o+1, # there definitely is a pointer to o
                                    o+min(len(key)+1,len(val)+1)): # use min because we don't need to worry about the rest
                         if find_pointers_to_offset(i):
-                            print >>log, " ** SKIPPING "+\
-                                    "because there are links to the rest of the string due to optimization; "+\
-                                    "will try to rewrite pointers."
+                            print(" ** SKIPPING "+
+                                    "because there are links to the rest of the string due to optimization; "+
+                                    "will try to rewrite pointers.", file=log)
                             mustrepoint.append(o)
                             doreplace = False
                             break
                     if not doreplace:
                         continue # skip to next occurance, this will be handled later
                     oldlen = len(datar)
-                    datar = datar[0:o] + val + '\0' + datar[o+len(val)+1:]
+                    datar[o:o+len(val)+1] = val + b'\0'
                     if len(datar) != oldlen:
                         raise AssertionError("Length mismatch")
-                    print >>log, "OK" # this occurance replaced successfully
+                    print("OK", file=log) # this occurance replaced successfully
                 if not mustrepoint:
                     keys.remove(key) # this string is translated
                     translated += 1
@@ -440,22 +513,22 @@ def translate_fw(args):
             # we are here means that new string is longer than old (and not an
             # inplace one - or at least has one non-inplace-possible occurance)
             # so will add it to end of tintin file or to ranges
-            print >>log, " -- %s %d occurance(s), looking for pointers" % ("still have" if mustrepoint else "found", len(mustrepoint or os))
+            print(" -- %s %d occurance(s), looking for pointers" % ("still have" if mustrepoint else "found", len(mustrepoint or os)), file=log)
             ps = []
             for o in list(mustrepoint) or list(os): # use mustrepoint if it is not empty
                 newps = find_pointers_to_offset(o)
                 ps.extend(newps)
                 if not newps:
-                    print >>log, " !? String at 0x%X is unreferenced, will ignore! (must be partial or something)" % o
+                    print(" !? String at 0x%X is unreferenced, will ignore! (must be partial or something)" % o, file=log)
                     # and remove it from list (needed for reuse_ranges)
                     if mustrepoint:
                         mustrepoint.remove(o)
                     else:
                         os.remove(o)
             if not ps:
-                print >>log, " !! No pointers to that string, cannot translate!"
+                print(" !! No pointers to that string, cannot translate!", file=log)
                 continue
-            print >>log, " == found %d ptrs; appending or inserting string and updating them" % len(ps)
+            print(" == found %d ptrs; appending or inserting string and updating them" % len(ps), file=log)
 
             stored = {}
             key_translated = True
@@ -463,12 +536,12 @@ def translate_fw(args):
                 if v == None:
                     continue # skip empty ones
                 if idx >= len(ps):
-                    print >>log, " *! Warning: no pointers for given context %d" % idx
+                    print(" *! Warning: no pointers for given context %d" % idx, file=log)
                     continue
 
                 if v in stored: # such string was already stored
                     newps = stored[v]
-                    print >>log, " -- using stored ptr"
+                    print(" -- using stored ptr", file=log)
                 else:
                     r = None # range to use
                     for rx in sorted(ranges, key=lambda r: r[1]-r[0]):
@@ -476,14 +549,14 @@ def translate_fw(args):
                             r = rx
                             break # break inner loop (on ranges)
                     if not r: # suitable range not found
-                        print >>log, " ## Notice: no (more) ranges available large enough for this phrase. Will skip it."
+                        print(" ## Notice: no (more) ranges available large enough for this phrase. Will skip it.", file=log)
                         untranslated += 1
                         key_translated = False
                         continue # to next value variant
-                    print >>log, " -- using range 0x%X-0x%X%s" % (r[0],r[1]," (end of file)" if r[1] == EOF else "")
+                    print(" -- using range 0x%X-0x%X%s" % (r[0],r[1]," (end of file)" if r[1] == EOF else ""), file=log)
                     newp = r[0]
                     oldlen = len(datar)
-                    datar = datar[0:newp] + v + '\0' + datar[newp+len(v)+1:]
+                    datar[newp:newp+len(v)+1] = v + b'\0'
                     if len(datar) != oldlen and r[1] != EOF: #70000 is "range" at the end of file
                         raise AssertionError("Length mismatch")
                     r[0] += len(v) + 1 # remove used space from that range
@@ -493,11 +566,11 @@ def translate_fw(args):
                 for pidx, p in enumerate(ps): # now update pointers
                     if len(vals) > 1: # if contexted
                         if pidx >= len(vals):
-                            print >>log, " *! Warning: exceeding pointer %d for context %d" % (pidx, idx)
+                            print(" *! Warning: exceeding pointer %d for context %d" % (pidx, idx), file=log)
                         if idx != pidx:
                             continue # skip irrelevant pointers
                     oldlen = len(datar)
-                    datar = datar[0:p] + newps + datar[p+4:]
+                    datar[p:p+4] = newps
                     if len(datar) != oldlen:
                         raise AssertionError("Length mismatch")
             if key_translated and key in keys:
@@ -510,46 +583,46 @@ def translate_fw(args):
                     while i < len(data):
                         if find_pointers_to_offset(i): # string is overused starting from this point
                             break
-                        if data[i] == '\0' : # last byte
+                        if data[i] == 0 : # last byte
                             i += 1 # include it too
                             break
                         i += 1
                     addrange(o, i)
-                    print >>log, " ++ Reclaimed %d bytes from this string" % (i-o)
+                    print(" ++ Reclaimed %d bytes from this string" % (i-o), file=log)
         npass += 1
-        print >>log, "Pass %d completed." % npass
+        print("Pass %d completed." % npass, file=log)
         sizes = [r[1]-r[0] for r in ranges]
-        print >>log, "Remaining space at this point: %d bytes scattered in %d ranges, max range size is %d bytes" % \
-                (sum(sizes), len(ranges), max(sizes or [0]))
-        print >>log
+        print("Remaining space at this point: %d bytes scattered in %d ranges, max range size is %d bytes" %
+                (sum(sizes), len(ranges), max(sizes or [0])), file=log)
+        print(file=log)
         if not args.reuse_ranges: # new ranges definitely could not appear
             break
         if len(keys) == 0:
-            print >>log, "All strings are translated. Enjoy!"
+            print("All strings are translated. Enjoy!", file=log)
             break
         if untranslated == 0:
-            print >>log, "No more exceeding strings. Nice."
+            print("No more exceeding strings. Nice.", file=log)
             break
         if translated == 0:
-            print >>log, "Nothing changed in this pass; giving up."
+            print("Nothing changed in this pass; giving up.", file=log)
             break
-        print >>log, "Translated %d strings in this pass; let's try to translate %d remaining" % (translated, untranslated)
+        print("Translated %d strings in this pass; let's try to translate %d remaining" % (translated, untranslated), file=log)
         untranslated = 0 # restart counter as we will retry all these strings
     if keys:
-        print >>log, "Strings still not translated:"
-        print >>log, '\n'.join(["* "+k for k in keys])
+        print("Strings still not translated:", file=log)
+        print('\n'.join(["* "+k.decode('utf-8') for k in keys]), file=log)
     else:
-        print >>log, "Everything translated. Hooray!"
-    print >>log, "Saving..."
+        print("Everything translated. Hooray!", file=log)
+    print("Saving...", file=log)
     if len(datar) != len(data): # something appended
         datar += data[-48:] # add ending bytes - needed for iOS app
     args.output.write(datar)
     args.output.close()
-    print >>log, "Done."
+    print("Done.", file=log)
     if untranslated:
-        print >>log, "WARNING: Couldn't translate %d strings because of ranges lack." % untranslated
+        print("WARNING: Couldn't translate %d strings because of ranges lack." % untranslated, file=log)
     else:
-        print >>log, "I think that all the strings were translated successfully :-)"
+        print("I think that all the strings were translated successfully :-)", file=log)
 
 if __name__ == "__main__":
     args = parse_args()
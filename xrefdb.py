@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+#
+# Queries database of all references in tintin_fw binary.
+# Database is built on first use and stored next to the binary.
+
+import os
+
+from libpatcher.xrefdb import XrefDB
+
+
+def parse_args():
+    import argparse
+    hexint = lambda x: int(x, base=0)
+    parser = argparse.ArgumentParser(
+        description="Cross-reference database for Pebble firmware")
+    parser.add_argument("-t", "--tintin", default="tintin_fw.bin",
+                        help="Input tintin_fw file, defaults to tintin_fw.bin")
+    parser.add_argument("-c", "--codebase", type=hexint, default=0x8004000,
+                        help="Codebase of the binary. "
+                        "Defaults to 0x8004000 (which is for 3.x fw); "
+                        "for 1.x-2.x set it to 0x8010000")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("to", help="Who references given address")
+    p.add_argument("addr", type=hexint)
+    p = sub.add_parser("calls", help="What given function calls")
+    p.add_argument("func", type=hexint)
+    p.add_argument("end", type=hexint, nargs='?',
+                   help="End of function, guessed if not given")
+    p = sub.add_parser("into", help="All references into given range")
+    p.add_argument("start", type=hexint)
+    p.add_argument("end", type=hexint)
+    p = sub.add_parser("from", help="All references from given range")
+    p.add_argument("start", type=hexint)
+    p.add_argument("end", type=hexint)
+    sub.add_parser("build", help="Just build the database")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    data = open(args.tintin, "rb").read()
+    db = XrefDB.open(data, args.codebase,
+                     os.path.dirname(os.path.abspath(args.tintin)))
+    if args.command == "to":
+        rows = db.refsTo(args.addr)
+    elif args.command == "calls":
+        rows = db.calls(args.func, args.end)
+    elif args.command == "into":
+        rows = db.refsInto(args.start, args.end)
+    elif args.command == "from":
+        rows = db.refsFrom(args.start, args.end)
+    else:
+        rows = []
+        print("Database: %s" % db.filename)
+    for source, target, kind in rows:
+        print("%08X: %-7s %08X" % (source, kind, target))